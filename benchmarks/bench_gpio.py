@@ -0,0 +1,105 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+""" Rotary encoder decode accuracy and callback throughput on the simulated
+    GPIO backend. Run with: python -m benchmarks.bench_gpio """
+
+import argparse
+import asyncio
+import random
+from time import perf_counter
+from tests.context import vb3
+from vb3.simulator import spin
+
+PIN_A = 23
+PIN_B = 24
+
+
+def random_session(detents, interval):
+    """ Turn the knob back and forth in bursts """
+    trace = []
+    expected = []
+    timestamp = 0
+    while len(expected) < detents:
+        direction = random.choice((-1, 1))
+        burst = min(random.randint(1, 10), detents - len(expected))
+        trace += spin(PIN_A, PIN_B, burst, direction=direction, interval=interval,
+                      start=timestamp)
+        expected += [vb3.RotaryEncoder.RIGHT if direction > 0 else vb3.RotaryEncoder.LEFT]*burst
+        timestamp = trace[-1][0] + 0.1
+    return trace, expected
+
+
+def accuracy(turns, expected):
+    correct = sum(1 for turn, direction in zip(turns, expected) if turn == direction)
+    return 100 * correct / len(expected)
+
+
+def bench_threaded(gpio, trace, expected, bounces):
+    turns = []
+    encoder = vb3.RotaryEncoder(PIN_A, PIN_B, pull=gpio.PUD_UP)
+    encoder.set_callback(lambda: turns.append(encoder.direction))
+    start = perf_counter()
+    gpio.replay(trace, speed=0, bounces=bounces)
+    elapsed = perf_counter() - start
+    encoder.off()
+    return accuracy(turns, expected), len(trace)/elapsed
+
+
+async def bench_events(gpio, trace, expected, bounces, speed):
+    turns = []
+    events = vb3.InputEvents()
+    encoder = vb3.RotaryEncoder(PIN_A, PIN_B, pull=gpio.PUD_UP, events=events)
+    encoder.set_callback(lambda: turns.append(encoder.direction))
+    task = asyncio.create_task(events.dispatcher())
+    await asyncio.sleep(0)
+    start = perf_counter()
+    thread = gpio.replay_in_thread(trace, speed=speed, bounces=bounces)
+    while thread.is_alive() or events.queue_depth():
+        await asyncio.sleep(0.001)
+    elapsed = perf_counter() - start
+    task.cancel()
+    encoder.off()
+    return accuracy(turns, expected), events.events/elapsed, events.latency(), events.latency_max
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--detents', type=int, default=2000)
+    parser.add_argument('-s', '--speed', type=float, default=10,
+                        help='replay speed for the event loop runs (0 is as fast as possible)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    print('{:>10} {:>8} {:>10} {:>12} {:>12} {:>12}'.format(
+        'interval', 'bounces', 'mode', 'accuracy %', 'edges/s', 'latency ms'))
+    for interval in (0.0005, 0.002, 0.01):
+        trace, expected = random_session(args.detents, interval)
+        for bounces in (0, 2):
+            gpio = vb3.SimulatedGPIO()
+            vb3.gpio.use_backend(gpio)
+            result, rate = bench_threaded(gpio, trace, expected, bounces)
+            print('{:>10} {:>8} {:>10} {:>12.2f} {:>12.0f} {:>12}'.format(
+                interval, bounces, 'threaded', result, rate, '-'))
+            gpio = vb3.SimulatedGPIO()
+            vb3.gpio.use_backend(gpio)
+            result, rate, latency, latency_max = asyncio.run(
+                bench_events(gpio, trace, expected, bounces, args.speed))
+            print('{:>10} {:>8} {:>10} {:>12.2f} {:>12.0f} {:>5.2f} ({:.2f})'.format(
+                interval, bounces, 'events', result, rate, 1000*latency, 1000*latency_max))
+
+
+if __name__ == '__main__':
+    main()
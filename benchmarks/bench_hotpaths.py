@@ -0,0 +1,221 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+""" Microbenchmarks of the vb3 hot paths, compared with the baselines in
+    benchmarks/baselines.json. The times are relative to a fixed pure Python
+    workload, so the baselines carry over to other machines. The run fails
+    when a hot path is more than --threshold times slower than its baseline.
+    Store new baselines with --save.
+    Run with: python -m benchmarks.bench_hotpaths """
+
+import argparse
+import json
+import logging
+import os
+import sys
+import timeit
+from tests.context import vb3
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+REPEAT = 5
+
+STATE = {'status': 'play', 'volume': 50, 'seek': 10000, 'duration': 240, 'artist': 'Artist',
+         'album': 'Album', 'title': 'Title', 'trackType': 'flac', 'samplerate': '44.1 kHz',
+         'bitdepth': '16 bit', 'random': False, 'repeat': False, 'mute': False}
+LABEL = 'a long artist - album - title that scrolls over the screen'
+
+
+def calibration():
+    """ The reference workload """
+    return sum(i * i for i in range(1000))
+
+
+class Panel:
+    width = 128
+    height = 64
+
+    def image(self, image):
+        pass
+
+    def show(self):
+        pass
+
+
+def display():
+    display = vb3.Display(panel=Panel())
+    display.update_main_screen(LABEL, 240, 10)
+    display.status(display.STATUS_PLAY)
+    return display
+
+
+def bench_sanitize():
+    state = vb3.VolumioState()
+    return lambda: state.sanitize(STATE)
+
+
+def bench_update_delta():
+    state = vb3.VolumioState()
+    states = (STATE, dict(STATE, volume=51))
+    counter = [0]
+
+    def update_delta():
+        counter[0] += 1
+        state.update(states[counter[0] & 1])
+        return state.delta()
+    return update_delta
+
+
+def bench_changed():
+    state = vb3.VolumioState()
+    state.update(STATE)
+    return lambda: state.changed('volume')
+
+
+def bench_popup_label():
+    popup = vb3.Popup(('{} {}', '{}'), lambda: 'flac', lambda: '16 bit', lambda: '44.1 kHz')
+    return popup.label
+
+
+def bench_decode_rotary(gpio):
+    """ One detent: four quadrature states """
+    encoder = vb3.RotaryEncoder(23, 24, pull=gpio.PUD_UP)
+    encoder.set_callback(lambda: None)
+    steps = [(23, 0), (24, 0), (23, 1), (24, 1)]
+
+    def detent():
+        for pin, level in steps:
+            gpio.output(pin, level)
+            encoder._decode_rotary(pin)
+    return detent
+
+
+def bench_draw_main_screen():
+    return display().draw_main_screen
+
+
+def bench_scrollable_text():
+    image = display()._image
+    scrollable = vb3.display.ScrollableText(LABEL, vb3.display.ImageFont.load_default())
+    offset = [0]
+
+    def draw():
+        offset[0] = (offset[0] + 10) % scrollable.textwidth
+        scrollable.draw(image, (0, 2), offset[0])
+    return draw
+
+
+def bench_bar_modal():
+    screen = display()
+    return lambda: vb3.display.BarModal(screen._image, screen._popup_font, 'Volume 50', 50)
+
+
+def bench_pack_pages():
+    image = display()._image
+    return lambda: vb3.panel.pack_pages(image)
+
+
+def bench_pack_nibbles():
+    image = vb3.display.Image.new('1', (256, 64))
+    return lambda: vb3.panel.pack_nibbles(image)
+
+
+def bench_led_set(gpio):
+    led = vb3.RGBLED(13, 19, 26)
+    colours = (vb3.RGBLED.DIM_GREEN, vb3.RGBLED.DIM_BLUE)
+    counter = [0]
+
+    def set_led():
+        counter[0] += 1
+        led.set(colours[counter[0] & 1])
+    return set_led
+
+
+def clear_pwm_history(gpio):
+    for pwm in gpio.pwm.values():
+        pwm.history.clear()
+
+
+def benchmarks(gpio):
+    """ Name, function to time and the setup for each repeat """
+    return (('VolumioState.sanitize', bench_sanitize(), None),
+            ('VolumioState.update+delta', bench_update_delta(), None),
+            ('VolumioState.changed', bench_changed(), None),
+            ('Popup.label', bench_popup_label(), None),
+            ('RotaryEncoder._decode_rotary x4', bench_decode_rotary(gpio), None),
+            ('Display.draw_main_screen', bench_draw_main_screen(), None),
+            ('ScrollableText.draw', bench_scrollable_text(), None),
+            ('BarModal', bench_bar_modal(), None),
+            ('pack_pages 128x64', bench_pack_pages(), None),
+            ('pack_nibbles 256x64', bench_pack_nibbles(), None),
+            ('RGBLED.set', bench_led_set(gpio), lambda: clear_pwm_history(gpio)))
+
+
+def best_times(function, setup=None):
+    """ Best time (sec) per call of the function and of the reference workload,
+        out of REPEAT interleaved runs of ~0.2 sec, so both see the same load
+        of the machine """
+    timers = [timeit.Timer(function), timeit.Timer(calibration)]
+    numbers = [timer.autorange()[0] for timer in timers]
+    times = [[], []]
+    for _ in range(REPEAT):
+        if setup:
+            setup()
+        for timer, number, results in zip(timers, numbers, times):
+            results.append(timer.timeit(number) / number)
+    return min(times[0]), min(times[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-t', '--threshold', type=float, default=1.5,
+                        help='fail when a hot path is this many times slower than its baseline')
+    parser.add_argument('-s', '--save', action='store_true', help='store the results as baselines')
+    parser.add_argument('-b', '--baselines', default=BASELINES)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    gpio = vb3.SimulatedGPIO()
+    vb3.gpio.use_backend(gpio)
+    try:
+        with open(args.baselines) as file:
+            baselines = json.load(file)
+    except FileNotFoundError:
+        baselines = dict()
+    results = dict()
+    regressions = []
+    print('{:>32} {:>10} {:>10} {:>10}'.format('hot path', 'us/call', 'relative', 'baseline'))
+    for name, function, setup in benchmarks(gpio):
+        elapsed, reference = best_times(function, setup)
+        results[name] = elapsed / reference
+        baseline = baselines.get(name)
+        status = ''
+        if baseline and results[name] > args.threshold * baseline:
+            regressions.append(name)
+            status = 'SLOWER'
+        print('{:>32} {:>10.2f} {:>10.3f} {:>10} {}'.format(
+            name, 1e6 * elapsed, results[name],
+            '{:.3f}'.format(baseline) if baseline else '-', status))
+    if args.save:
+        with open(args.baselines, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print('Stored the baselines in {}'.format(args.baselines))
+    elif regressions:
+        print('{} slower than {} times the baseline: {}'.format(
+            len(regressions), args.threshold, ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+""" Import time of the vbuddy boot stages, measured with python -X importtime.
+    Every stage runs in a fresh interpreter and includes the stages before it.
+    Run with: python -m benchmarks.bench_import """
+
+import argparse
+import os
+import subprocess
+import sys
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+TESTS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Boot stages in the order vbuddy reaches them
+STAGES = (('package', 'import vb3'),
+          ('argparser', 'vb3.argparser; vb3.setup_logging'),
+          ('display', 'vb3.Display'),
+          ('battery', 'vb3.Battery; vb3.History'),
+          ('client', 'vb3.VolumioClient; vb3.Network'),
+          ('gpio', 'vb3.PushButton; vb3.RGBLED'))
+
+
+def import_time(statements, mock=False):
+    """ Total import time in seconds of a series of statements in a new interpreter """
+    if mock:
+        # the mocked RPi and board modules from the test suite
+        prelude = 'import sys; sys.path.insert(0, {!r}); from tests.context import vb3'.format(TESTS)
+    else:
+        prelude = 'import sys; sys.path.insert(0, {!r})'.format(SRC)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', '; '.join((prelude,) + statements)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr.splitlines()[-1])
+    total = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if line.startswith('import time:') and fields[0].split(':')[1].strip().isdigit():
+            total += int(fields[0].split(':')[1])
+    return total/1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-r', '--runs', type=int, default=5,
+                        help='number of runs per stage (the fastest run is reported)')
+    parser.add_argument('--mock', action='store_true',
+                        help='use the mocked hardware modules of the test suite')
+    parser.add_argument('--max-ms', type=float,
+                        help='exit with an error when the package stage is slower than this')
+    args = parser.parse_args()
+    print('{:>10} {:>12}'.format('stage', 'cumulative ms'))
+    statements = ()
+    package = None
+    for stage, statement in STAGES:
+        statements += (statement,)
+        elapsed = min(import_time(statements, args.mock) for _ in range(args.runs))
+        package = package or elapsed
+        print('{:>10} {:>12.1f}'.format(stage, 1000*elapsed))
+    if args.max_ms and 1000*package > args.max_ms:
+        print('Import of the vb3 package takes {:.1f}ms (limit {}ms)'.format(1000*package, args.max_ms))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
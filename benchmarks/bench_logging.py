@@ -0,0 +1,99 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+""" Cost of the log calls in the event loop per input event, at each log level,
+    for blocking logging (logging.basicConfig) and for vb3.setup_logging. The log
+    is written to a stream that takes --write-delay sec per write, like an SD
+    card or a busy journald. Run with: python -m benchmarks.bench_logging """
+
+import argparse
+import io
+import logging
+import time
+from time import perf_counter
+from tests.context import vb3
+
+STEPS = 1
+DIRECTION = 'RIGHT'
+STATE = {'status': 'play', 'volume': 50, 'title': 'Title', 'artist': 'Artist'}
+
+
+def eager_event():
+    """ The log calls of a volume knob detent and the pushState that follows,
+        with str.format """
+    logging.debug('Rotary encoder turned {} step(s) {}'.format(STEPS, DIRECTION))
+    logging.info('pushState message received')
+    logging.debug('\twith data:\n  {}'.format(STATE))
+    logging.info('state[{}] = \'{}\''.format('volume', STATE['volume']))
+
+
+def lazy_event():
+    """ The same log calls with lazy % formatting """
+    logging.debug('Rotary encoder turned %d step(s) %s', STEPS, DIRECTION)
+    logging.info('pushState message received')
+    logging.debug('\twith data:\n  %s', STATE)
+    logging.info('state[%s] = \'%s\'', 'volume', STATE['volume'])
+
+
+class SlowStream(io.StringIO):
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return super().write(text)
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+
+
+def bench(function, events):
+    start = perf_counter()
+    for _ in range(events):
+        function()
+    return (perf_counter() - start) / events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--events', type=int, default=2000)
+    parser.add_argument('-d', '--write-delay', type=float, default=0.0002)
+    args = parser.parse_args()
+    print('{:>8} {:>10} {:>8} {:>12}'.format('level', 'logging', 'format', 'us/event'))
+    for level in ('debug', 'info', 'warning'):
+        for setup in ('blocking', 'queue'):
+            for name, function in (('eager', eager_event), ('lazy', lazy_event)):
+                reset_logging()
+                stream = SlowStream(args.write_delay)
+                if setup == 'blocking':
+                    logging.basicConfig(level=getattr(logging, level.upper()), stream=stream)
+                    elapsed = bench(function, args.events)
+                else:
+                    vb3.setup_logging(level, stream=stream)
+                    elapsed = bench(function, args.events)
+                    vb3.util.stop_logging()
+                print('{:>8} {:>10} {:>8} {:>12.2f}'.format(level, setup, name, 1e6 * elapsed))
+    reset_logging()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+""" pushState and command throughput of VolumioClient against the stand-in
+    Volumio server on localhost, for each available event loop. Commands are
+    sent from the pushState handler (in the event loop) and from a thread, like
+    the RPi.GPIO callbacks. Run with: python -m benchmarks.bench_loop """
+
+import argparse
+import asyncio
+import importlib.util
+import logging
+from time import perf_counter
+from tests.context import vb3
+from tests.volumio_server import VolumioServer
+
+
+class Counter:
+    """ pushState handler that sets an event after a number of state changes
+        and optionally sends a command on every state change """
+
+    def __init__(self, command=None):
+        self.command = command
+        self.count = 0
+        self.target = 0
+        self.done = asyncio.Event()
+
+    def expect(self, number):
+        self.count = 0
+        self.target = number
+        self.done.clear()
+
+    def __call__(self):
+        self.count += 1
+        if self.count >= self.target:
+            self.done.set()
+        elif self.command:
+            self.command()
+
+
+async def push_states(server, counter, number):
+    counter.expect(number)
+    start = perf_counter()
+    for _ in range(number):
+        # in msec, VolumioState keeps whole seconds
+        server.state['seek'] += 1000
+        await server.push_state()
+    await counter.done.wait()
+    return number / (perf_counter() - start)
+
+
+async def loop_commands(client, counter, number):
+    counter.command = client.toggle_play
+    counter.expect(number)
+    start = perf_counter()
+    client.toggle_play()
+    await counter.done.wait()
+    counter.command = None
+    return number / (perf_counter() - start)
+
+
+async def thread_commands(client, counter, number):
+    loop = asyncio.get_running_loop()
+    start = perf_counter()
+    for _ in range(number):
+        counter.expect(1)
+        await loop.run_in_executor(None, client.toggle_play)
+        await counter.done.wait()
+    return number / (perf_counter() - start)
+
+
+async def bench(number):
+    server = VolumioServer()
+    port = await server.start()
+    client = vb3.VolumioClient(None, host='127.0.0.1', port=port)
+    counter = Counter()
+    client.set_pushState_handler(counter)
+    counter.expect(1)
+    await client.connect()
+    await counter.done.wait()
+    try:
+        return (await push_states(server, counter, number),
+                await loop_commands(client, counter, number),
+                await thread_commands(client, counter, number))
+    finally:
+        await client.disconnect()
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--number', type=int, default=500)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    loops = ['asyncio']
+    if importlib.util.find_spec('uvloop'):
+        loops.append('uvloop')
+    else:
+        print('uvloop is not installed')
+    print('{:>8} {:>14} {:>14} {:>14}'.format('loop', 'pushState/s', 'loop cmd/s', 'thread cmd/s'))
+    for name in loops:
+        vb3.setup_event_loop(name)
+        result = asyncio.run(bench(args.number))
+        print('{:>8} {:>14.0f} {:>14.0f} {:>14.0f}'.format(name, *result))
+    vb3.setup_event_loop('asyncio')
+
+
+if __name__ == '__main__':
+    main()
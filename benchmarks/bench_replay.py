@@ -0,0 +1,160 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+""" Replays a recorded session (vbuddy -R <file>) through update_ui, the display,
+    the LED, the inputs and the battery monitor in virtual time, and reports the
+    CPU time per simulated hour, the frames sent and the commands emitted.
+    Without a session file, a synthetic session is replayed.
+    Run with: python -m benchmarks.bench_replay [session file] """
+
+import argparse
+import asyncio
+import importlib.machinery
+import importlib.util
+import logging
+import os
+import random
+from time import process_time
+from tests.context import vb3
+from vb3.simulator import spin
+
+
+class Panel:
+    """ Stand-in for the display driver that counts the frames """
+    width = 128
+    height = 64
+
+    def __init__(self):
+        self.frames = 0
+
+    def image(self, image):
+        pass
+
+    def show(self):
+        self.frames += 1
+
+
+def load_vbuddy():
+    """ Import the vbuddy script for update_ui and the input setup """
+    filename = os.path.join(os.path.dirname(vb3.__file__), os.pardir, 'vbuddy')
+    loader = importlib.machinery.SourceFileLoader('vbuddy', filename)
+    spec = importlib.util.spec_from_loader('vbuddy', loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def synthetic_session(minutes, start=1700000000.0):
+    """ Play an album: a track every 4 minutes, turning the volume knob now and
+        then, a play/pause click every 10 minutes and a battery sample every 10 sec """
+    pins = vb3.Config.DEFAULTS['gpio']
+    records = [(start, 'session', {'gpio': pins})]
+    volume = 40
+    status = 'play'
+    for second in range(0, 60*minutes, 10):
+        timestamp = start + second
+        records.append((timestamp, 'battery', (20 - second/3600, 0.01, 400.0)))
+        if second % 240 == 0:
+            records.append((timestamp + 0.5, 'state', dict(
+                status=status, volume=volume, seek=0, duration=240000, artist='Artist',
+                album='Album', title='Title {}'.format(second//240 + 1),
+                trackType='flac', samplerate='44.1 kHz', bitdepth='16 bit')))
+        if second % 60 == 30:
+            detents = random.randint(1, 5)
+            direction = random.choice((-1, 1))
+            records += [(timestamp, 'edge', (pin, level)) for timestamp, pin, level in
+                        spin(pins['rotary_encoder_2a'], pins['rotary_encoder_2b'], detents,
+                             direction=direction, interval=0.005, start=timestamp)]
+            volume = max(0, min(100, volume + direction*detents))
+            records.append((timestamp + 0.2, 'state', dict(status=status, volume=volume)))
+        if second % 600 == 300:
+            records += [(timestamp, 'edge', (pins['pushbutton_2'], 0)),
+                        (timestamp + 0.1, 'edge', (pins['pushbutton_2'], 1))]
+            status = 'pause' if status == 'play' else 'play'
+            records.append((timestamp + 0.5, 'state', dict(status=status, volume=volume)))
+    return sorted(records, key=lambda record: record[0])
+
+
+async def replay_session(vbuddy, session, gpio):
+    config = vb3.Config()
+    pins = dict(config['gpio'], **session.info().get('gpio', {}))
+    panel = Panel()
+    display = vb3.Display(panel=panel)
+    led = vb3.RGBLED(*(pins[name] for name in vbuddy.LED_PINS))
+    volumio_client = vb3.VolumioClient(display)
+    commands = []
+    volumio_client._emit = lambda *args: commands.append(args)
+    volumio_client.set_pushState_handler(vbuddy.update_ui, volumio_client, display, led)
+    battery = vb3.Battery()
+    battery._ina = session.ina
+    battery.set_warn_function(vbuddy.low_battery_warning, led)
+    battery.set_empty_function(lambda: None)
+    battery.set_normal_function(vbuddy.battery_recovered, volumio_client, led)
+    session.volumio_client = volumio_client
+    events = vb3.InputEvents()
+    buttons = [vbuddy.setup_input(number, pins, gpio.PUD_UP, events, volumio_client, display)
+               for number in vbuddy.INPUT_PINS.keys()]
+    display.status(display.STATUS_STOP)
+    tasks = [asyncio.create_task(coroutine) for coroutine in (
+        events.dispatcher(), led.animator(),
+        display.updater(config['display']['update_interval']), battery.monitor())]
+    await session.run()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for button in buttons:
+        button.off()
+    led.off()
+    return panel.frames, len(commands), events.events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('session', nargs='?', help='recorded session file')
+    parser.add_argument('-m', '--minutes', type=int, default=30,
+                        help='length of the synthetic session')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    random.seed(1)
+    if args.session:
+        records = vb3.session.read_session(args.session)
+    else:
+        records = synthetic_session(args.minutes)
+    vbuddy = load_vbuddy()
+    gpio = vb3.SimulatedGPIO()
+    vb3.gpio.use_backend(gpio)
+    session = vb3.SessionReplay(records, gpio=gpio, ina=vb3.session.ReplayINA())
+    clock = vb3.session.VirtualClock(session.start_time())
+    loop = vb3.session.VirtualTimeLoop(clock)
+    start = process_time()
+    try:
+        with clock:
+            frames, commands, edges = loop.run_until_complete(
+                replay_session(vbuddy, session, gpio))
+    finally:
+        loop.close()
+    cpu = process_time() - start
+    hours = max(session.duration(), 1) / 3600
+    print('{:.1f} simulated minutes, {} records ({} states, {} edges, {} battery samples)'
+          .format(60*hours, len(records), session.replayed['state'], session.replayed['edge'],
+                  session.replayed['battery']))
+    print('{:>22} {:>10.2f}'.format('CPU sec/simulated hour', cpu / hours))
+    print('{:>22} {:>10.0f}'.format('frames/hour', frames / hours))
+    print('{:>22} {:>10.0f}'.format('commands/hour', commands / hours))
+    print('{:>22} {:>10.0f}'.format('input edges/hour', edges / hours))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,55 @@
-from .battery import Battery  # noqa: F401
-from .display import Display  # noqa: F401
-from .display import Popup  # noqa: F401
-from .gpio import PushButton  # noqa: F401
-from .gpio import RotaryEncoder  # noqa: F401
-from .gpio import RGBLED  # noqa: F401
-from .network import Network  # noqa: F401
-from .util import argparser  # noqa: F401
-from .util import setup_exception_handling  # noqa: F401
-from .util import setup_logging  # noqa: F401
-from .util import shutdown  # noqa: F401
-from .volumio_client import VolumioClient  # noqa: F401
-from .volumio_client import VolumioState  # noqa: F401
+# Subsystems are imported on first use (PEP 562), so that e.g. the display can
+# show the logo before the socket.io stack and the battery driver are loaded
+import importlib
+
+_ATTRIBUTES = {
+    'Battery': 'battery',
+    'Config': 'config',
+    'Display': 'display',
+    'LoopMonitor': 'diagnostics',
+    'Popup': 'display',
+    'History': 'history',
+    'InputEvents': 'gpio',
+    'PushButton': 'gpio',
+    'RotaryEncoder': 'gpio',
+    'RGBLED': 'gpio',
+    'RenderProcessDisplay': 'render',
+    'SessionReplay': 'session',
+    'Network': 'network',
+    'SimulatedGPIO': 'simulator',
+    'Snapshot': 'snapshot',
+    'argparser': 'util',
+    'create_panel': 'panel',
+    'dump_log': 'util',
+    'metrics': 'util',
+    'recorder': 'session',
+    'serve_metrics': 'util',
+    'setup_diagnostics': 'diagnostics',
+    'setup_event_loop': 'util',
+    'setup_exception_handling': 'util',
+    'setup_logging': 'util',
+    'shutdown': 'util',
+    'tracer': 'tracing',
+    'VolumioClient': 'volumio_client',
+    'VolumioState': 'volumio_client',
+}
+
+_SUBMODULES = ('battery', 'config', 'diagnostics', 'display', 'gpio', 'history', 'network',
+               'panel', 'render', 'session', 'simulator', 'snapshot', 'tracing', 'util',
+               'volumio_client')
+
+__all__ = list(_ATTRIBUTES.keys())
+
+
+def __getattr__(name):
+    if name in _ATTRIBUTES.keys():
+        value = getattr(importlib.import_module('.' + _ATTRIBUTES[name], __name__), name)
+        globals()[name] = value
+        return value
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__ + list(_SUBMODULES))
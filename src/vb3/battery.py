@@ -15,8 +15,63 @@
 
 import asyncio
 import logging
+from array import array
+from time import perf_counter, time
 import board
 import adafruit_ina219
+from .session import recorder
+from .util import metrics
+
+I2C_READS = metrics.counter('vbuddy_battery_i2c_reads_total', 'INA219 register reads')
+SAMPLE_TIME = metrics.histogram('vbuddy_battery_sample_seconds', 'Time to read a battery sample')
+
+
+class SampleBuffer:
+    """ Fixed-size ring buffer with timestamped voltage, current and power samples """
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self._index = 0
+        self.timestamp = array('d', [0] * size)
+        self.voltage = array('d', [0] * size)
+        self.current = array('d', [0] * size)
+        self.power = array('d', [0] * size)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, voltage, current, power):
+        i = self._index
+        self.timestamp[i] = timestamp
+        self.voltage[i] = voltage
+        self.current[i] = current
+        self.power[i] = power
+        self._index = (i + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def last(self, field, n=1):
+        """ The last n values of a field, oldest first """
+        values = getattr(self, field)
+        n = min(n, self.count)
+        return [values[(self._index - n + i) % self.size] for i in range(n)]
+
+    def mean(self, field, n):
+        values = self.last(field, n)
+        return sum(values) / len(values)
+
+    def slope(self, field):
+        """ Least squares rate of change (per sec) of a field over the buffer """
+        if self.count < 2:
+            return None
+        timestamps = self.last('timestamp', self.count)
+        values = self.last(field, self.count)
+        t_mean = sum(timestamps) / self.count
+        v_mean = sum(values) / self.count
+        t_var = sum((t - t_mean) ** 2 for t in timestamps)
+        if t_var == 0:
+            return None
+        return sum((t - t_mean) * (v - v_mean) for t, v in zip(timestamps, values)) / t_var
 
 
 class Battery:
@@ -25,8 +80,22 @@ class Battery:
     LOW = 2.9
     WARN = 3.2
     EMPTY = 2.8
+    HYSTERESIS = 0.05  # Voltage per cell above a threshold to leave a state
+    BUFFER_SIZE = 64  # Number of samples kept for the time remaining estimate
+    SMOOTHING = 6  # Number of samples averaged for voltage, current and power
+    CONFIRM_SAMPLES = 3  # Number of consecutive samples to confirm a state change
+# Adaptive polling interval (sec)
+    MIN_INTERVAL = 1
+    MAX_INTERVAL = 30
+# Poll faster when the current (mA) is above this level
+    NOMINAL_CURRENT = 500
 
-    def __init__(self, i2c_addr=None):
+# Battery states
+    NORMAL = 0
+    WARNING = 1
+    DEPLETED = 2
+
+    def __init__(self, i2c_addr=None, buffer_size=BUFFER_SIZE, history=None):
         i2c_bus = board.I2C()
         if i2c_addr:
             self._ina = adafruit_ina219.INA219(i2c_bus, addr=i2c_addr)
@@ -37,17 +106,69 @@ class Battery:
         self.low = Battery.LOW
         self.warn = Battery.WARN
         self.empty = Battery.EMPTY
+        self.hysteresis = Battery.HYSTERESIS
+        self.smoothing = Battery.SMOOTHING
+        self.confirm_samples = Battery.CONFIRM_SAMPLES
+        self.min_interval = Battery.MIN_INTERVAL
+        self.max_interval = Battery.MAX_INTERVAL
+        self.nominal_current = Battery.NOMINAL_CURRENT
+        self.samples = SampleBuffer(buffer_size)
+        self.history = history
+        self.state = Battery.NORMAL
+        self._next_state = Battery.NORMAL
+        self._confirmations = 0
         self._warn_function = None
         self._warn_function_args = None
         self._empty_function = None
         self._empty_function_args = None
+        self._normal_function = None
+        self._normal_function_args = None
+
+    def sample(self):
+        """ Read the INA219 and store the sample in the buffer """
+        start = perf_counter()
+        bus_voltage = self._ina.bus_voltage
+        shunt_voltage = self._ina.shunt_voltage
+        current = self._ina.current
+        SAMPLE_TIME.observe(perf_counter() - start)
+        I2C_READS.inc(3)
+        timestamp = time()
+        recorder.battery(timestamp, bus_voltage, shunt_voltage, current)
+        voltage = shunt_voltage + bus_voltage
+        power = bus_voltage * current / 1000
+        self.samples.append(timestamp, voltage, current, power)
+        if self.history:
+            self.history.append(self.history.BATTERY, voltage, current, power, self.state)
+        return voltage
+
+    def _smoothed(self, field):
+        if len(self.samples) == 0:
+            self.sample()
+        return self.samples.mean(field, self.smoothing)
 
     def voltage(self):
-        return self._ina.shunt_voltage + self._ina.bus_voltage
+        """ Smoothed battery voltage (V) """
+        return self._smoothed('voltage')
+
+    def current(self):
+        """ Smoothed current (mA) """
+        return self._smoothed('current')
+
+    def power(self):
+        """ Smoothed power (W) """
+        return self._smoothed('power')
 
     def level(self):
         return int(100*(self.voltage()/self.cell_count-self.low)/(self.full-self.low))
 
+    def time_remaining(self):
+        """ Estimate of the time (sec) until the battery is empty, based on the
+            discharge rate over the sample buffer. None when not discharging """
+        slope = self.samples.slope('voltage')
+        if slope is None or slope >= 0:
+            return None
+        return max(0, (self.voltage() - self.cell_count*self.empty) / -slope)
+
     def set_warn_function(self, function, *args):
         if not callable(function):
             raise TypeError('Argument for warn function is not a function, but a {}.'
@@ -62,14 +183,83 @@ class Battery:
         self._empty_function = function
         self._empty_function_args = args
 
-    async def monitor(self, polling_interval=10):
+    def set_normal_function(self, function, *args):
+        """ Register a function that is called when the voltage recovers from
+            the warning level (e.g. when charging) """
+        if not callable(function):
+            raise TypeError('Argument for normal function is not a function, but a {}.'
+                            .format(type(function)))
+        self._normal_function = function
+        self._normal_function_args = args
+
+    def _target_state(self, voltage):
+        """ The state the voltage points to, with hysteresis on the way up """
+        warn = self.cell_count*self.warn
+        empty = self.cell_count*self.empty
+        hysteresis = self.cell_count*self.hysteresis
+        if voltage <= empty:
+            return Battery.DEPLETED
+        if voltage <= warn:
+            if self.state == Battery.DEPLETED and voltage < empty + hysteresis:
+                return Battery.DEPLETED
+            return Battery.WARNING
+        if self.state != Battery.NORMAL and voltage < warn + hysteresis:
+            return Battery.WARNING
+        return Battery.NORMAL
+
+    def update_state(self, voltage):
+        """ Change state when <confirm_samples> consecutive samples agree and
+            call the function for the new state once """
+        next_state = self._target_state(voltage)
+        if next_state == self.state:
+            self._confirmations = 0
+            return self.state
+        if next_state != self._next_state:
+            self._next_state = next_state
+            self._confirmations = 0
+        self._confirmations += 1
+        if self._confirmations < self.confirm_samples:
+            return self.state
+        self.state = next_state
+        self._confirmations = 0
+        if next_state == Battery.DEPLETED and self._empty_function:
+            logging.warning('Battery._monitor: call _empty_function (v=%.3f)' % voltage)
+            self._empty_function(*self._empty_function_args)
+        elif next_state == Battery.WARNING and self._warn_function:
+            logging.warning('Battery._monitor: call _warn_function (v=%.3f)' % voltage)
+            self._warn_function(*self._warn_function_args)
+        elif next_state == Battery.NORMAL and self._normal_function:
+            logging.warning('Battery._monitor: call _normal_function (v=%.3f)' % voltage)
+            self._normal_function(*self._normal_function_args)
+        return self.state
+
+    def next_interval(self):
+        """ Polling interval: slow when the battery is full and steady, fast
+            near a threshold, when discharging fast or when confirming a change """
+        if self._confirmations > 0:
+            return self.min_interval
+        voltage = self.voltage()
+        if self.state == Battery.NORMAL:
+            threshold = self.cell_count*self.warn
+        else:
+            threshold = self.cell_count*self.empty
+        margin = max(0, voltage - threshold)
+        span = self.cell_count*(self.full - self.warn)
+        interval = self.min_interval + \
+            (self.max_interval - self.min_interval) * min(1, margin / span)
+        slope = self.samples.slope('voltage')
+        if slope is not None and slope < 0:
+            # at least 10 samples before the threshold is reached
+            interval = min(interval, margin / -slope / 10)
+        current = abs(self.current())
+        if current > self.nominal_current:
+            interval = interval * self.nominal_current / current
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    async def monitor(self, polling_interval=None):
+        """ Battery sampling task: the only place where the INA219 is read.
+            Without a <polling_interval>, the interval adapts to the battery """
         logging.info('started battery polling task')
         while True:
-            voltage = self.voltage()
-            if voltage <= self.cell_count*self.warn and self._warn_function:
-                logging.warning('Battery._monitor: call _warn_function (v=%.3f)' % voltage)
-                self._warn_function(*self._warn_function_args)
-            if voltage <= self.cell_count*self.EMPTY and self._empty_function:
-                logging.warning('Battery._monitor: call _empty_function (v=%.3f)' % voltage)
-                self._empty_function(*self._empty_function_args)
-            await asyncio.sleep(polling_interval)
+            self.update_state(self.sample())
+            await asyncio.sleep(polling_interval or self.next_interval())
@@ -0,0 +1,190 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import copy
+import logging
+try:
+    import tomllib
+except ImportError:
+    import tomli as tomllib
+
+
+class InvalidConfig(Exception):
+    def __init__(self, filename, reason, message='Invalid configuration in {}: {}'):
+        self.filename = filename
+        self.reason = reason
+        self.message = message
+        super().__init__(self, message)
+
+    def __str__(self):
+        return self.message.format(self.filename, self.reason)
+
+
+class Config:
+    """ Settings from a TOML file on top of the defaults below. reload() reads
+        the file again and runs the reload functions of the sections that changed """
+
+    DEFAULTS = {
+        # RPi.GPIO mode must be set to GPIO.BCM, since CircuitPython
+        # (used for the SSD1306 OLED display) uses that under the hood.
+        # Numbers below are BCM numbers (see https://pinout.xyz/)
+        'gpio': {
+            'pull': 'none',
+            'pushbutton_1': 4,  # GPIO_BOARD: 7
+            'rotary_encoder_1a': 23,  # GPIO_BOARD: 16
+            'rotary_encoder_1b': 24,  # GPIO_BOARD: 18
+            'pushbutton_2': 17,  # GPIO_BOARD: 11
+            'rotary_encoder_2a': 27,  # GPIO_BOARD: 13
+            'rotary_encoder_2b': 5,  # GPIO_BOARD: 29
+            'led_red': 13,  # GPIO_BOARD: 33
+            'led_green': 12,  # GPIO_BOARD: 32
+            'led_blue': 6,  # GPIO_BOARD: 31
+        },
+        'display': {
+            # 'ssd1306', 'ssd1306_128x32', 'sh1106' (I2C) or 'ssd1322' (SPI, 256x64 grayscale)
+            'driver': 'ssd1306',
+            # I2C address of the display (0 is the default address 0x3c)
+            'i2c_addr': 0,
+            # GPIO pins for the D/C and reset lines of a SPI display (0 is not connected)
+            'spi_dc': 25,
+            'spi_reset': 0,
+            'update_interval': 0.1,
+            'modal_duration': 3,
+            # Render the frames in a separate process
+            'render_process': False,
+        },
+        'volumio': {
+            'host': 'localhost',
+            'port': 3000,
+        },
+        'service': {
+            # 'asyncio' or 'uvloop' (when it is installed)
+            'event_loop': 'asyncio',
+            # Time limit for the whole shutdown (sec)
+            'shutdown_timeout': 2.0,
+        },
+        # A popup has one label or a list of two, with a {} placeholder for
+        # each value. See the popup values in vbuddy for the available names
+        'popups': [
+            {'label': ['Battery: {}% {}', 'Voltage: {:.2f}V'],
+             'values': ['battery.level', 'battery.remaining', 'battery.voltage']},
+            {'label': ['{}', '{} {}'],
+             'values': ['track.type', 'track.bitdepth', 'track.rate']},
+            {'label': ['ssid: {}', 'ip:{}'],
+             'values': ['network.ssid', 'network.ip']},
+            {'label': ['ssid: {}', 'pw: {}'],
+             'values': ['network.hotspot_ssid', 'network.hotspot_passphrase']},
+            {'label': ['wifi: {}', '{}'],
+             'values': ['network.signal', 'network.throughput']},
+        ],
+    }
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._reload_function = dict()
+        self._settings = copy.deepcopy(Config.DEFAULTS)
+        self.previous = self._settings
+        if filename:
+            try:
+                self._settings = self.load()
+            except InvalidConfig as exception:
+                logging.error('{}, using the defaults'.format(exception))
+            self.previous = self._settings
+
+    def __getitem__(self, section):
+        return self._settings[section]
+
+    def set_reload_function(self, section, function, *args):
+        """ Run function(*args) after a reload that changed the section """
+        if section not in Config.DEFAULTS.keys():
+            raise ValueError('Unknown config section: {}'.format(section))
+        if not callable(function):
+            raise TypeError('Argument for reload function is not a function, '
+                            'but a {}.'.format(type(function)))
+        self._reload_function[section] = (function, args)
+
+    def load(self):
+        """ Read the config file and merge it with the defaults """
+        try:
+            with open(self.filename, 'rb') as file:
+                data = tomllib.load(file)
+        except FileNotFoundError:
+            logging.info('No config file {}, using the defaults'.format(self.filename))
+            return copy.deepcopy(Config.DEFAULTS)
+        except (OSError, tomllib.TOMLDecodeError) as exception:
+            raise InvalidConfig(self.filename, exception)
+        settings = copy.deepcopy(Config.DEFAULTS)
+        for section, values in data.items():
+            if section not in settings.keys():
+                logging.warning('Ignoring unknown section [{}] in {}'.format(section, self.filename))
+            elif section == 'popups':
+                settings[section] = self._popups(values)
+            else:
+                settings[section].update(self._section(section, values))
+        return settings
+
+    def _section(self, section, values):
+        if not isinstance(values, dict):
+            raise InvalidConfig(self.filename, '{} should be a table'.format(section))
+        result = dict()
+        for key, value in values.items():
+            if key not in Config.DEFAULTS[section].keys():
+                logging.warning('Ignoring unknown setting {}.{} in {}'
+                                .format(section, key, self.filename))
+                continue
+            default = Config.DEFAULTS[section][key]
+            # an int is fine where a float is expected
+            if isinstance(default, float) and isinstance(value, int) and not isinstance(value, bool):
+                value = float(value)
+            if type(value) is not type(default):
+                raise InvalidConfig(self.filename, '{}.{} should be a {}, not a {}'.format(
+                    section, key, type(default).__name__, type(value).__name__))
+            result[key] = value
+        return result
+
+    def _popups(self, values):
+        if not isinstance(values, list):
+            raise InvalidConfig(self.filename, 'popups should be an array of tables')
+        for popup in values:
+            if not isinstance(popup, dict) or \
+                    not isinstance(popup.get('label'), (str, list)) or \
+                    not isinstance(popup.get('values', []), list):
+                raise InvalidConfig(self.filename, 'a popup needs a label and a list of values')
+        return values
+
+    def reload(self):
+        """ Read the config file again and apply the sections that changed. On
+            errors, the current settings stay. Returns the changed sections """
+        try:
+            settings = self.load()
+        except InvalidConfig as exception:
+            logging.error('{}, keeping the current settings'.format(exception))
+            return []
+        changed = [section for section in settings.keys()
+                   if settings[section] != self._settings[section]]
+        self.previous = self._settings
+        self._settings = settings
+        logging.info('Reloaded {}, changed: {}'.format(self.filename, ', '.join(changed) or 'nothing'))
+        for section in changed:
+            if section in self._reload_function.keys():
+                function, args = self._reload_function[section]
+                try:
+                    function(*args)
+                except Exception as exception:
+                    logging.error('Cannot apply [{}]: {} ({})'
+                                  .format(section, exception, type(exception).__name__))
+            else:
+                logging.warning('Changes in [{}] are applied after a restart'.format(section))
+        return changed
@@ -0,0 +1,195 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+import tracemalloc
+from time import perf_counter, strftime
+from .util import diagnostics_directory, dump_log, metrics
+
+LOOP_LAG = metrics.histogram('vbuddy_loop_lag_seconds',
+                             'Delay of the event loop in waking up a sleeping task')
+LOOP_STALLS = metrics.counter('vbuddy_loop_stalls_total',
+                              'Event loop stalls that held back the watchdog ping')
+
+
+def sd_notify(message):
+    """ Send a message like READY=1 or WATCHDOG=1 to systemd. Returns False
+        when the service doesn't run under systemd with a notify socket """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(message.encode(), address)
+    except OSError as exception:
+        logging.debug('Cannot notify systemd: %s', exception)
+        return False
+    return True
+
+
+def watchdog_interval():
+    """ Time (sec) between watchdog pings: half the WatchdogSec of the service,
+        or None without a watchdog """
+    try:
+        if int(os.environ.get('WATCHDOG_PID', os.getpid())) != os.getpid():
+            return None
+        return int(os.environ['WATCHDOG_USEC']) / 2e6
+    except (KeyError, ValueError):
+        return None
+
+
+class LoopMonitor:
+    """ Measures the event loop lag and pings the systemd watchdog from the event
+        loop, so the pings stop when the loop stalls and systemd restarts the service """
+
+# Time between lag samples (sec)
+    INTERVAL = 0.5
+# Lag that counts as a stall (sec)
+    STALL_TIME = 1
+
+    def __init__(self, interval=INTERVAL, stall_time=STALL_TIME):
+        self.interval = interval
+        self.stall_time = stall_time
+        self.lag = 0
+        self.max_lag = 0
+        metrics.gauge('vbuddy_loop_lag_max_seconds', 'Largest event loop lag', lambda: self.max_lag)
+
+    async def monitor(self):
+        """ Asyncio task that samples the loop lag and pings the watchdog """
+        watchdog = watchdog_interval()
+        sd_notify('READY=1')
+        logging.info('started loop monitor task{}'.format(
+            ' (watchdog ping every {}s)'.format(watchdog) if watchdog else ''))
+        last_ping = perf_counter()
+        while True:
+            start = perf_counter()
+            await asyncio.sleep(self.interval)
+            now = perf_counter()
+            self.lag = max(0, now - start - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            LOOP_LAG.observe(self.lag)
+            if self.lag > self.stall_time:
+                LOOP_STALLS.inc()
+                logging.warning('Event loop stalled for {:.2f}s'.format(self.lag))
+                continue
+            if watchdog and now - last_ping >= watchdog:
+                sd_notify('WATCHDOG=1')
+                last_ping = now
+
+
+def dump_stacks(loop=None):
+    """ Log the stacks of all asyncio tasks and threads """
+    output = io.StringIO()
+    tasks = asyncio.all_tasks(loop) if loop else ()
+    output.write('{} asyncio tasks:\n'.format(len(tasks)))
+    for task in tasks:
+        # Task.get_name() is new in Python 3.8
+        output.write('\nTask {}{}:\n'.format(task.get_name() if hasattr(task, 'get_name') else id(task),
+                                             ' (done)' if task.done() else ''))
+        stack = traceback.StackSummary.extract((frame, frame.f_lineno) for frame in task.get_stack())
+        output.write(''.join(stack.format()))
+    frames = sys._current_frames()
+    output.write('\n{} threads:\n'.format(len(frames)))
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    for ident, frame in frames.items():
+        output.write('\nThread {} ({}):\n'.format(names.get(ident, '?'), ident))
+        output.write(''.join(traceback.format_stack(frame)))
+    logging.warning('Stack dump\n{}'.format(output.getvalue()))
+    return output.getvalue()
+
+
+class Profiler:
+    """ cProfile and tracemalloc capture that stops after <duration> sec. The
+        results are written to <directory>/vbuddy-<time>.prof and .txt """
+
+    DURATION = 30
+# Number of allocation sites in the tracemalloc report
+    TOP_ALLOCATIONS = 25
+
+    def __init__(self, directory=None, duration=DURATION):
+        self.directory = directory or diagnostics_directory()
+        self.duration = duration
+        self._profile = None
+        self._timer = None
+
+    def running(self):
+        return self._profile is not None
+
+    def toggle(self):
+        if self.running():
+            return self.stop()
+        return self.start()
+
+    def start(self):
+        if self.running():
+            return None
+        logging.warning('Profiling for {}s'.format(self.duration))
+        tracemalloc.start()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        try:
+            self._timer = asyncio.get_running_loop().call_later(self.duration, self.stop)
+        except RuntimeError:
+            self._timer = None
+        return None
+
+    def stop(self):
+        """ Stop the capture and write the results. Returns the name of the profile """
+        if not self.running():
+            return None
+        self._profile.disable()
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        filename = os.path.join(self.directory, 'vbuddy-{}'.format(strftime('%Y%m%d-%H%M%S')))
+        try:
+            self._profile.dump_stats(filename + '.prof')
+            with open(filename + '.txt', 'w') as file:
+                for statistic in snapshot.statistics('lineno')[:Profiler.TOP_ALLOCATIONS]:
+                    file.write('{}\n'.format(statistic))
+            logging.warning('Profile written to {}.prof and {}.txt'.format(filename, filename))
+        except OSError as exception:
+            logging.error('Cannot write profile: {}'.format(exception))
+            filename = None
+        self._profile = None
+        return filename + '.prof' if filename else None
+
+
+def dump_diagnostics(loop=None):
+    dump_stacks(loop)
+    dump_log()
+
+
+def setup_diagnostics(loop, profiler=None):
+    """ SIGUSR1 logs the stacks of all tasks and threads and dumps the log ring
+        buffer, SIGUSR2 starts or stops profiling """
+    profiler = profiler or Profiler()
+    loop.add_signal_handler(signal.SIGUSR1, dump_diagnostics, loop)
+    loop.add_signal_handler(signal.SIGUSR2, profiler.toggle)
+    logging.info('Added signal handlers for SIGUSR1 (stack and log dump) and SIGUSR2 (profiling)')
+    return profiler
@@ -18,26 +18,48 @@ import logging
 import os
 from PIL import Image, ImageFont, ImageDraw
 import re
-from time import time
-# Import needed board pins.
-from board import SCL, SDA
-import busio
+from time import perf_counter, time
+from .panel import create_panel
+from .tracing import tracer
+from .util import metrics
 
-# Import the SSD1306 module.
-import adafruit_ssd1306
+FRAMES = metrics.counter('vbuddy_display_frames_total', 'Frames sent to the display')
+RENDER_TIME = metrics.histogram('vbuddy_display_render_seconds', 'Time to render a frame')
+TRANSFER_TIME = metrics.histogram('vbuddy_display_transfer_seconds',
+                                  'Time to send a frame to the display')
 
 
 class Display:
-    """ Class for the user interface using a 128x64 OLED SSD1306 compatible display """
-# Display dimensions
+    """ Class for the user interface on an OLED display. The layout is designed
+        for 128x64 pixels and scales to the size of the panel (see panel.py) """
+# The display renders ~10 frames/sec for days, so it reuses its images and
+# labels between frames instead of allocating new ones
+    __slots__ = ('_status', '_prev_status', '_label', '_prev_label', '_duration', '_seek',
+                 '_main_screen_last_updated', '_modal', '_modal_timeout', '_modal_duration',
+                 '_current_popup', '_popup', '_popup_timeout', '_frame', '_restored',
+                 '_display', 'width', 'height', '_scroll', 'update_interval', '_image',
+                 '_draw', '_logo_image', '_font', '_popup_font', '_scrollable',
+                 '_separator_width', '_time_key', '_time_labels', '_layout')
+
+# Display dimensions the layout is designed for
     WIDTH = 128
     HEIGHT = 64
+# Vertical blank space on the main screen (px) above the label, between the label and
+# the time, below the time and for the progress bar, around two lines of 14 px glyphs.
+# On other panels the space left by the glyphs is divided in the same proportions
+    MAIN_SCREEN_SPACING = (6, 8, 17, 5)
+# Separator between the position and the remaining time on the main screen
+    SEPARATOR_LABEL = ' - '
 # Default show duration for modal windows (sec)
     MODAL_DURATION = 3
 
 # Popup reset timeout
     POPUP_TIMEOUT = 3 * MODAL_DURATION
 
+# Directory for the scaled logo
+    CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                             'vbuddy')
+
 # Text modal type definitions
     VOLUME = 0
     STATUS_CONNECTING = 1
@@ -56,7 +78,7 @@ class Display:
              STATUS_STOP: 'Stop',
              STATUS_SHUTDOWN: 'Shutdown'}
 
-    def __init__(self, i2c_addr=None):
+    def __init__(self, i2c_addr=None, panel=None):
         self._status = Display.STATUS_STOP
         self._prev_status = Display.STATUS_STOP
         self._label = ''
@@ -70,8 +92,14 @@ class Display:
         self._current_popup = 0
         self._popup = []
         self._popup_timeout = Display.POPUP_TIMEOUT
-        i2c = busio.I2C(SCL, SDA)
-        self._display = adafruit_ssd1306.SSD1306_I2C(self.WIDTH, self.HEIGHT, i2c, addr=i2c_addr or 0x3c)
+        self._frame = None
+        self._restored = None
+        self._scrollable = None
+        self._time_key = None
+        self._time_labels = None
+        if panel is None:
+            panel = create_panel(i2c_addr=i2c_addr)
+        self._display = panel
         self.width = self._display.width
         self.height = self._display.height
         self._scroll = -self.width
@@ -80,8 +108,8 @@ class Display:
 # Define image and draw objects for main screen and modal screen
         self._image = Image.new('1', (self.width, self.height))
         self._draw = ImageDraw.Draw(self._image)
-        self.clear()
-        self.logo_image()
+        if not self.logo_image():
+            self.clear()
 
 # Load font. If TTF file is not found, load default font
 # Make sure the .ttf font file is in the same directory as
@@ -95,33 +123,87 @@ class Display:
             self._popup_font = ImageFont.truetype(os.path.dirname(os.path.realpath(__file__)) + '/Vera.ttf', 11)
         except IOError:
             self._popup_font = ImageFont.load_default()
+        self._separator_width = self._draw.textsize(Display.SEPARATOR_LABEL, font=self._font)[0]
+        self._layout = self.main_screen_layout()
 
     def show(self, image):
         """ Update display with new image """
+        start = perf_counter()
         self._display.image(image)
         self._display.show()
+        TRANSFER_TIME.observe(perf_counter() - start)
+        FRAMES.inc()
+        tracer.frame()
 
     def logo_image(self, filename=None):
-        """ Show a logo """
+        """ Show a logo. The logo is scaled to the size of the display once and
+            cached, so it shows up quickly at boot """
         if not filename:
             filename = os.path.dirname(os.path.realpath(__file__)) + '/volumio.ppm'
+        cache = os.path.join(Display.CACHE_DIR, '{}-{}x{}.pbm'.format(
+            os.path.splitext(os.path.basename(filename))[0], self.width, self.height))
         try:
-            self._logo_image = Image.open(filename). \
-                resize((self.width, self.height), Image.LANCZOS).convert('1')
-            self._image.paste(self._logo_image)
-            self.show(self._image)
-        except IOError:
-            logging.error('Cannot open file %s' % filename)
-            pass
+            if os.path.getmtime(cache) < os.path.getmtime(filename):
+                raise IOError('Cached logo is outdated')
+            self._logo_image = Image.open(cache)
+            self._logo_image.load()
+        except (IOError, OSError):
+            try:
+                self._logo_image = Image.open(filename). \
+                    resize((self.width, self.height), Image.LANCZOS).convert('1')
+            except IOError:
+                logging.error('Cannot open file %s' % filename)
+                self._logo_image = Image.new('1', (self.width, self.height))
+                return False
+            try:
+                os.makedirs(Display.CACHE_DIR, exist_ok=True)
+                self._logo_image.save(cache)
+            except (IOError, OSError) as exception:
+                logging.info('Cannot cache logo: {}'.format(exception))
+        self._image.paste(self._logo_image)
+        self.show(self._image)
+        return True
+
+    def restore(self, mode, size, data):
+        """ Show a saved main screen frame until the live state arrives. A small
+            square in the top right corner marks it as stale """
+        if mode != '1' or tuple(size) != (self.width, self.height):
+            logging.info('Saved frame does not fit the display')
+            return False
+        self._restored = Image.frombytes(mode, tuple(size), data)
+        ImageDraw.Draw(self._restored).rectangle((self.width - 6, 0, self.width - 1, 5),
+                                                 outline=1, fill=0)
+        self._image.paste(self._restored)
+        self.show(self._image)
+        return True
+
+    def frame(self):
+        """ The last rendered main screen, without modals. The image is reused
+            for the next frame, so copy it to keep it """
+        return self._frame
 
     def update(self):
+        """ Render a frame and show it """
+        self.show(self.render())
+
+    def render(self):
+        """ Render the main screen (or the restored frame or the logo) with the
+            current modal. Returns the image """
+        start = perf_counter()
         if self._status == Display.STATUS_PLAY or self._status == Display.STATUS_PAUSE:
             self.draw_main_screen()
+            if self._frame is None:
+                self._frame = self._image.copy()
+            else:
+                self._frame.paste(self._image)
+        elif self._restored:
+            self._image.paste(self._restored)
         else:
             self._image.paste(self._logo_image)
         if (time()-self._modal_timeout) < 0 and self._modal:
             self._image.paste(self._modal.image(), (self._modal.x, self._modal.y))
-        self.show(self._image)
+        RENDER_TIME.observe(perf_counter() - start)
+        return self._image
 
 # Asyncio task to update the screen regulary
     async def updater(self, interval=0.1):
@@ -144,18 +226,19 @@ class Display:
         """ Pop-up window with slider bar for volume """
         textlabel = Display.LABEL[Display.VOLUME] + ' ' + str(int(level))
         self._modal_timeout = time() + self._modal_duration
-        self._modal = BarModal(self._image, self._font, textlabel, level)
+        self._modal = BarModal(self._image, self._font, textlabel, level, reuse=self._modal)
 
     def status(self, status_type):
         """ Pop-up window with horizontally and vertically centered text label """
         if status_type not in Display.LABEL.keys() or status_type == self._status:
             return
-        logging.debug('Set status to {}'.format(status_type))
+        logging.debug('Set status to %d', status_type)
         self._prev_status = self._status
         self._status = status_type
         if status_type != Display.STATUS_STOP and status_type != self._prev_status:
             self._modal_timeout = time() + self._modal_duration
-            self._modal = TextModal(self._image, self._font, Display.LABEL[status_type])
+            self._modal = TextModal(self._image, self._font, Display.LABEL[status_type],
+                                    reuse=self._modal)
 
     def set_modal_duration(self, duration):
         self._modal_duration = duration
@@ -163,67 +246,76 @@ class Display:
     def add_popup(self, popup):
         self._popup.append(popup)
 
+    def remove_popups(self):
+        self._popup = []
+        self._current_popup = 0
+
     def show_next_popup(self):
         """ Cycle through the popup modals """
+        if not self._popup:
+            return
         if self._modal_timeout + self._popup_timeout < time():
             self._current_popup = 0
-        logging.info('Showing popup {} from {}.'.format(self._current_popup + 1, len(self._popup)))
-        label = self._popup[self._current_popup].label()
-        self._modal_timeout = time() + self._modal_duration
+        logging.info('Showing popup %d from %d.', self._current_popup + 1, len(self._popup))
+        self.popup(self._popup[self._current_popup].label())
+        self._current_popup = (self._current_popup + 1) % len(self._popup)
+
+    def popup(self, label):
+        """ Pop-up window with a label (str) or a label of two lines (tuple) """
         if type(label) is tuple:
-            self._modal = TwoLineTextModal(self._image, self._popup_font, label)
+            self._modal = TwoLineTextModal(self._image, self._popup_font, label,
+                                           reuse=self._modal)
         elif type(label) is str:
-            self._modal = TextModal(self._image, self._popup_font, label)
+            self._modal = TextModal(self._image, self._popup_font, label, reuse=self._modal)
         else:
             raise TypeError('Textlabel is a {}. Should be string or tuple'
                             .format(type(label).__name__))
-        self._current_popup = (self._current_popup + 1) % len(self._popup)
+        self._modal_timeout = time() + self._modal_duration
+
+    def main_screen_layout(self):
+        """ The y positions of the label and the time and the height of the progress
+            bar on the main screen. The blank space above the label shrinks first,
+            the progress bar is at least 2 px high """
+        top, bottom = self._font.getbbox('0:00')[1::2]
+        space = max(0, self.height - 2*(bottom - top))
+        above, between, below, bar = Display.MAIN_SCREEN_SPACING
+        design = above + between + below + bar
+        above = space*above // design
+        between = round(space*between/design)
+        bar = max(2, round(space*bar/design))
+        return above - top, above + bottom - 2*top + between, bar - 1
 
     def draw_main_screen(self):
-        v_offset = 2
-        v_padding = 4
-        bar_height = 4
-        separator_label = ' - '
+        label_y, time_y, bar_height = self._layout
         if self._status == Display.STATUS_PLAY:
             position = time() - self._main_screen_last_updated + self._seek
         else:
             position = 1.0 * self._seek
-        try:
-            remaining = max(self._duration - position, 0)
-            duration_label = str(int(remaining/60)) + ':' + \
-                '%02d' % int(remaining % 60)
-        except TypeError:
-            duration_label = '-:--'
-        try:
-            position_label = str(int(position/60)) + ':' + '%02d' % int(position % 60)
-# The position_minutes string is used to determine the width of the label to ensure the colon
-# is always at the same position
-            position_minutes = str(int(position/60)) + ':00'
-        except TypeError:
-            position_label = '0:00'
         try:
             rel_position = min(100, max(0, position/self._duration))
         except (NameError, TypeError, ZeroDivisionError):
             rel_position = 0
             bar_height = 0
+        position_label, duration_label, position_label_width = self.time_labels(position)
         self._draw.rectangle((0, 0, self.width, self.height), outline=0, fill=0)
-        separator_label_width, separator_label_height = self._draw.textsize(separator_label, font=self._font)
-        position_label_width, position_label_height = self._draw.textsize(position_minutes, font=self._font)
-        scrollable = ScrollableText(self._label, self._font)
+        scrollable = self._scrollable
+        if scrollable is None:
+            scrollable = self._scrollable = ScrollableText(self._label, self._font)
 # Draw the artist, album and song title (scrolling)
-        scrollable.draw(self._image, (0, v_offset), self._scroll)
+        scrollable.draw(self._image, (0, label_y), self._scroll)
 # Draw the current position in the song
-        self._draw.text(((self.width - separator_label_width)/2 - position_label_width,
-                         v_offset + scrollable.textheight + v_padding),
+        self._draw.text(((self.width - self._separator_width)/2 - position_label_width,
+                         time_y),
                         position_label, font=self._font, fill=1)
 # Draw the total duration of the song + the separator. Ensure that the separator is centered horizontally
-        self._draw.text(((self.width - separator_label_width)/2,
-                         v_offset + scrollable.textheight + v_padding),
-                        separator_label+duration_label, font=self._font, fill=1)
-# Draw the progress bar only when height > 0
+        self._draw.text(((self.width - self._separator_width)/2,
+                         time_y),
+                        duration_label, font=self._font, fill=1)
+# Draw the progress bar only when height > 0. A bar of 2 px has no room for an outline
         if bar_height > 0:
             self._draw.rectangle((0, self.height - 1 - bar_height,
-                                  self.width - 1, self.height - 1), outline=1, fill=0)
+                                  self.width - 1, self.height - 1),
+                                 outline=1 if bar_height > 1 else 0, fill=0)
             self._draw.rectangle((0, self.height - 1 - bar_height,
                                   int((self.width - 1)*rel_position), self.height - 1),
                                  outline=1, fill=1)
@@ -232,31 +324,75 @@ class Display:
         if self._scroll > scrollable.textwidth:
             self._scroll = -self.width
 
+    def time_labels(self, position):
+        """ The position label, the separator + remaining time label and the width of
+            the position label with 00 seconds. The labels only change once a second,
+            so they are kept until then """
+        try:
+            remaining = int(max(self._duration - position, 0))
+        except TypeError:
+            remaining = None
+        try:
+            position = int(position)
+        except TypeError:
+            position = None
+        key = (position, remaining)
+        if key == self._time_key:
+            return self._time_labels
+        if remaining is None:
+            duration_label = '-:--'
+        else:
+            duration_label = '%d:%02d' % (remaining // 60, remaining % 60)
+        if position is None:
+            position_label = '0:00'
+            position_minutes = '0:00'
+        else:
+            position_label = '%d:%02d' % (position // 60, position % 60)
+# The position_minutes string is used to determine the width of the label to ensure the colon
+# is always at the same position
+            position_minutes = '%d:00' % (position // 60)
+        position_label_width = self._draw.textsize(position_minutes, font=self._font)[0]
+        self._time_key = key
+        self._time_labels = (position_label, Display.SEPARATOR_LABEL + duration_label,
+                             position_label_width)
+        return self._time_labels
+
     def update_main_screen(self, label, duration, seek):
         """ Update the text label, the seek time and the duration on the current song """
         self._label = label
         self._duration = duration
         self._seek = seek
         self._main_screen_last_updated = time()
+        self._restored = None
 # Reset scroll offset when the label changes
         if label != self._prev_label:
             self._scroll = -self.width
             self._prev_label = label
+            self._scrollable = None
 
 
 class Modal(object):
-    """ Base class that creates an empty modal """
-    def __init__(self, image):
+    """ Base class that creates an empty modal. It takes over the image of the
+        <reuse> modal, if that has the same size. On panels lower than 64 px the
+        margins above and below shrink faster than the panel, so the text fits """
+    __slots__ = ('x', 'y', 'width', 'height', '_image', '_draw', 'scale')
+
+    def __init__(self, image, reuse=None):
 
         self.x = 4
         y_fraction = 0.2
         (image_width, image_height) = image.size
-        self.y = int(y_fraction*image_height)
+        self.scale = min(1, image_height/Display.HEIGHT)
+        self.y = int(y_fraction*self.scale*image_height)
         self.width = image_width - 2*self.x
         self.height = image_height - 2*self.y
 
-        self._image = Image.new('1', (self.width, self.height))
-        self._draw = ImageDraw.Draw(self._image)
+        if isinstance(reuse, Modal) and reuse._image.size == (self.width, self.height):
+            self._image = reuse._image
+            self._draw = reuse._draw
+        else:
+            self._image = Image.new('1', (self.width, self.height))
+            self._draw = ImageDraw.Draw(self._image)
 
         self._draw.rectangle((0, 0, self.width - 1, self.height - 1), outline=1, fill=0)
 
@@ -266,10 +402,11 @@ class Modal(object):
 
 class TextModal(Modal):
     """ Class that creates a modal with a textlabel """
+    __slots__ = ()
 
-    def __init__(self, image, font, textlabel):
+    def __init__(self, image, font, textlabel, reuse=None):
 
-        super(TextModal, self).__init__(image)
+        super(TextModal, self).__init__(image, reuse)
 
         textwidth, textheight = self._draw.textsize(textlabel, font=font)
         xtext = max(0, int((self.width-textwidth)/2))
@@ -279,15 +416,16 @@ class TextModal(Modal):
 
 class TwoLineTextModal(Modal):
     """ Class that creates a modal with a textlabel """
+    __slots__ = ()
 
-    def __init__(self, image, font, textlabel):
+    def __init__(self, image, font, textlabel, reuse=None):
 
         if not isinstance(textlabel, tuple):
             raise TypeError('textlabel needs to be a tuple')
 
-        super(TwoLineTextModal, self).__init__(image)
+        super(TwoLineTextModal, self).__init__(image, reuse)
 
-        y_padding = 2
+        y_padding = int(2*self.scale)
         textwidth, textheight = self._draw.textsize(textlabel[0], font=font)
         ytext = int((self.height - 2*textheight - y_padding)/2)
         for i in (0, 1):
@@ -299,21 +437,22 @@ class TwoLineTextModal(Modal):
 
 class BarModal(Modal):
     """ Class that creates a modal with a label and a sliderbar"""
+    __slots__ = ()
 
-    def __init__(self, image, font, textlabel, level):
+    def __init__(self, image, font, textlabel, level, reuse=None):
 
-        super(BarModal, self).__init__(image)
+        BarModal.validate_level(level)
 
-        if type(level) is not int or level < 0 or level > 100:
-            raise ValueError
+        super(BarModal, self).__init__(image, reuse)
 
         x_padding = 8
-        y_padding = 8
-        bar_height = 4
+        y_padding = int(8*self.scale)
+        bar_height = max(2, int(4*self.scale))
 
         textwidth, textheight = self._draw.textsize(textlabel, font=font)
         xtext = max(0, int((self.width-textwidth)/2))
-        ytext = 4
+# The label is 4 px below the top, or higher if it would touch the bar
+        ytext = max(0, min(4, self.height - y_padding - bar_height - textheight - 2))
 
         self._draw.rectangle((x_padding,
                               self.height - y_padding - bar_height,
@@ -325,20 +464,27 @@ class BarModal(Modal):
                               self.height - y_padding), outline=1, fill=1)
         self._draw.text((xtext, ytext), textlabel, font=font, fill=255)
 
+    @staticmethod
+    def validate_level(level):
+        if type(level) is not int or level < 0 or level > 100:
+            raise ValueError('Volume level should be an int between 0-100, not {!r}'.format(level))
+
 
 class ScrollableText:
     """ Class to scroll a long textlabel over the screen """
+    __slots__ = ('_image', '_draw', 'textlabel', 'textwidth', 'textheight')
+
     def __init__(self, textlabel, font):
-        self._image = Image.new('1', (10, 10))
-        self._draw = ImageDraw.Draw(self._image)
         self.textlabel = textlabel
-        self.textwidth, self.textheight = self._draw.textsize(textlabel, font=font)
-        self._image = Image.new('1', (self.textwidth+4, self.textheight+4))
+        self.textwidth, self.textheight = font.getsize(textlabel)
+        self._image = Image.new('1', (self.textwidth+4, self.textheight))
         self._draw = ImageDraw.Draw(self._image)
         self._draw.text((0, 0), textlabel, font=font, fill=1)
 
     def draw(self, image, position, offset):
-        """ Draw the label on (x,y) position of an image with starting at <offset> """
+        """ Draw the label on (x,y) position of an image with starting at <offset>.
+            The label is pasted with a negative offset instead of cropped, so no
+            temporary image is needed. The image has to be cleared before """
         width, height = image.size
         i = 0
         if self.textwidth <= width:
@@ -347,8 +493,7 @@ class ScrollableText:
             position = (-offset, position[1])
         else:
             i = offset % (self.textwidth+int(0.1*width))
-        temp = self._image.crop((i, 0, width+i, self.textheight))
-        image.paste(temp, position)
+        image.paste(self._image, (position[0] - i, position[1]))
 
 
 class InvalidLabelError(Exception):
@@ -373,6 +518,8 @@ class LabelArgsMismatchException(Exception):
 
 
 class Popup:
+    __slots__ = ('_args', '_labeltext')
+
     def __init__(self, labeltext, *args):
         Popup.validate_label(labeltext)
         Popup.validate_placeholders(labeltext, args)
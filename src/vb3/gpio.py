@@ -13,9 +13,15 @@
 # You should have received a copy of the GNU General Public License along with
 # Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import logging
+import math
+import threading
 import RPi.GPIO as GPIO
 from time import time
+from .session import recorder
+from .tracing import tracer
+from .util import metrics
 
 
 PUD_UP = GPIO.PUD_UP
@@ -23,19 +29,158 @@ PUD_DOWN = GPIO.PUD_DOWN
 PUD_OFF = GPIO.PUD_OFF
 
 
+def use_backend(backend):
+    """ Use another implementation of the RPi.GPIO interface (e.g. the simulator)
+        for the PushButton, RotaryEncoder and RGBLED objects created after this """
+    global GPIO, PUD_UP, PUD_DOWN, PUD_OFF
+    GPIO = backend
+    PUD_UP = GPIO.PUD_UP
+    PUD_DOWN = GPIO.PUD_DOWN
+    PUD_OFF = GPIO.PUD_OFF
+
+
+def backend():
+    return GPIO
+
+
 def cleanup():
     GPIO.cleanup()
 
 
+INPUT_EDGES = metrics.counter('vbuddy_input_edges_total', 'GPIO edges handled in the event loop')
+INPUT_DROPPED = metrics.counter('vbuddy_input_dropped_total',
+                                'GPIO edges dropped before the dispatcher started')
+INPUT_LATENCY = metrics.histogram('vbuddy_input_latency_seconds',
+                                  'Time between a GPIO edge and the start of its handler')
+BUTTON_GESTURES = metrics.counter('vbuddy_button_gestures_total',
+                                  'Push button gestures with a callback')
+ROTARY_DETENTS = metrics.counter('vbuddy_rotary_detents_total', 'Rotary encoder detents')
+
+
+class InputEvents:
+    """ Stream of GPIO edges from the RPi.GPIO callback thread to the asyncio
+        event loop. Edges are timestamped in the GPIO thread and handled by
+        the dispatcher task, so debouncing, decoding and callbacks run in the
+        event loop """
+
+    def __init__(self):
+        self._handlers = dict()
+        self._loop = None
+        self._queue = None
+        self.events = 0
+        self.dropped = 0
+        self.max_queue_depth = 0
+        self.latency_total = 0
+        self.latency_max = 0
+        metrics.gauge('vbuddy_input_queue_depth', 'GPIO edges waiting for the dispatcher',
+                      self.queue_depth)
+
+    def add_handler(self, gpio_pin, handler):
+        """ Register a function that is called with (gpio_pin, level, timestamp)
+            for every edge on a pin """
+        if not callable(handler):
+            raise TypeError('Argument for handler function is not a function, but a {}.'
+                            .format(type(handler)))
+        self._handlers[gpio_pin] = handler
+
+    def remove_handler(self, gpio_pin):
+        self._handlers.pop(gpio_pin, None)
+
+    def edge(self, channel):
+        """ RPi.GPIO callback: timestamp the edge and hand it to the event loop """
+        timestamp = time()
+        level = GPIO.input(channel)
+        if self._loop is None:
+            self.dropped += 1
+            INPUT_DROPPED.inc()
+            return
+        self._loop.call_soon_threadsafe(self._put, (timestamp, channel, level))
+
+    def _put(self, event):
+        self._queue.put_nowait(event)
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+    def queue_depth(self):
+        if self._queue is None:
+            return 0
+        return self._queue.qsize()
+
+    def latency(self):
+        """ Average time (sec) between an edge and the start of its handler """
+        if self.events == 0:
+            return 0
+        return self.latency_total / self.events
+
+    async def dispatcher(self):
+        """ Asyncio task that calls the handlers for the queued edges """
+        self._queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        logging.info('started input event dispatcher task')
+        try:
+            while True:
+                timestamp, channel, level = await self._queue.get()
+                latency = time() - timestamp
+                self.events += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+                INPUT_EDGES.inc()
+                INPUT_LATENCY.observe(latency)
+                recorder.edge(timestamp, channel, level)
+                handler = self._handlers.get(channel)
+                if handler is None:
+                    continue
+                try:
+                    handler(channel, level, timestamp)
+                except Exception:
+                    logging.exception('Input event handler for GPIO {} failed'
+                                      .format(channel))
+        finally:
+            self._loop = None
+
+
 class PushButton:
-    """ Pushbutton with configurable callback function"""
+    """ Pushbutton with configurable callback function. With an InputEvents
+        stream, callbacks can also be registered for gestures """
+
+# Gesture definitions
+    PRESS = 0
+    RELEASE = 1
+    CLICK = 2
+    DOUBLE_CLICK = 3
+    LONG_PRESS = 4
+    REPEAT = 5
+
+# Default gesture timing (sec)
+    DEBOUNCE_TIME = 0.02
+    DOUBLE_CLICK_TIME = 0.3
+    LONG_PRESS_TIME = 1.0
+    REPEAT_INTERVAL = 0.25
 
-    def __init__(self, gpio_pin, minimum_delay=0.5, pull=PUD_OFF):
+    def __init__(self, gpio_pin, minimum_delay=0.5, pull=None, events=None,
+                 active_low=None):
+        if pull is None:
+            pull = GPIO.PUD_OFF
         self._callback_function = False
         self._callback_args = False
+        self._events = events
+        self._registered = False
+        self._gesture_callback = dict()
+        self._pressed = False
+        self._long_pressed = False
+        self._second_press = False
+        self._settle_timer = None
+        self._click_timer = None
+        self._hold_timer = None
+        self._edge_time = None
         self.last_push = 0
         self.minimum_delay = minimum_delay
         self.gpio_pin = gpio_pin
+        # a button with a pull up resistor connects the pin to ground
+        self.active_low = pull == GPIO.PUD_UP if active_low is None else active_low
+        self.debounce_time = PushButton.DEBOUNCE_TIME
+        self.double_click_time = PushButton.DOUBLE_CLICK_TIME
+        self.long_press_time = PushButton.LONG_PRESS_TIME
+        self.repeat_interval = PushButton.REPEAT_INTERVAL
         # mode must be set to GPIO.BCM, since CircuitPython
         # (used for the SSD1306 OLED display) uses that under the hood
         GPIO.setmode(GPIO.BCM)
@@ -48,20 +193,145 @@ class PushButton:
                             .format(type(callback_function)))
         self._callback_function = callback_function
         self._callback_args = callback_args
-        GPIO.add_event_detect(self.gpio_pin, GPIO.BOTH)
-        GPIO.add_event_callback(self.gpio_pin, self._callback)
+        self._register()
         logging.info('Callback {} registered for PushButton'
                      .format(callback_function.__name__))
 
+    def set_gesture_callback(self, gesture, callback_function, *callback_args):
+        """ Register a function that is called for a gesture (PRESS, RELEASE, CLICK,
+            DOUBLE_CLICK, LONG_PRESS or REPEAT while held after a long press) """
+        if not callable(callback_function):
+            raise TypeError('Argument for handler function is not a function, but a {}.'
+                            .format(type(callback_function)))
+        if gesture not in range(PushButton.PRESS, PushButton.REPEAT + 1):
+            raise ValueError('Unknown gesture: {}'.format(gesture))
+        if not self._events:
+            raise ValueError('Gestures need a PushButton with InputEvents')
+        self._gesture_callback[gesture] = (callback_function, callback_args)
+        self._register()
+        logging.info('Callback {} registered for PushButton gesture {}'
+                     .format(callback_function.__name__, gesture))
+
+    def _register(self):
+        if self._registered:
+            return
+        self._registered = True
+        GPIO.add_event_detect(self.gpio_pin, GPIO.BOTH)
+        if self._events:
+            self._events.add_handler(self.gpio_pin, self._handle_edge)
+            GPIO.add_event_callback(self.gpio_pin, self._events.edge)
+        else:
+            GPIO.add_event_callback(self.gpio_pin, self._callback)
+
     def _callback(self, channel):
         if time() - self.last_push > self.minimum_delay and self._callback_function:
             self.last_push = time()
             logging.debug('Executing callback for PushButton')
-            return self._callback_function(*self._callback_args)
+            with tracer.input('button {}'.format(self.gpio_pin)):
+                return self._callback_function(*self._callback_args)
+
+    def _handle_edge(self, channel, level, timestamp):
+        """ Input event handler: the level has to be stable for debounce_time
+            before it counts as a press or a release """
+        if self._settle_timer:
+            self._settle_timer.cancel()
+        pressed = bool(level) != self.active_low
+        self._settle_timer = asyncio.get_running_loop().call_later(
+            self.debounce_time, self._settle, pressed, timestamp)
+
+    def _settle(self, pressed, timestamp):
+        self._settle_timer = None
+        if pressed == self._pressed:
+            return
+        self._pressed = pressed
+        self._edge_time = timestamp
+        if pressed:
+            self._press(timestamp)
+        else:
+            self._release()
+
+    def _press(self, timestamp):
+        loop = asyncio.get_running_loop()
+        self._long_pressed = False
+        if self._click_timer:
+            self._click_timer.cancel()
+            self._click_timer = None
+            self._second_press = True
+        self._hold_timer = loop.call_later(self.long_press_time, self._long_press)
+        self._fire(PushButton.PRESS)
+        if timestamp - self.last_push > self.minimum_delay and self._callback_function:
+            self.last_push = timestamp
+            logging.debug('Executing callback for PushButton')
+            self._run(self._callback_function, self._callback_args)
+
+    def _release(self):
+        self._cancel_hold()
+        self._fire(PushButton.RELEASE)
+        if self._long_pressed:
+            return
+        if self._second_press:
+            self._second_press = False
+            self._fire(PushButton.DOUBLE_CLICK)
+        elif PushButton.DOUBLE_CLICK in self._gesture_callback.keys():
+            # wait to see if this click is the first of a double click
+            self._click_timer = asyncio.get_running_loop().call_later(
+                self.double_click_time, self._click)
+        else:
+            self._fire(PushButton.CLICK)
+
+    def _click(self):
+        self._click_timer = None
+        self._fire(PushButton.CLICK)
+
+    def _long_press(self):
+        self._edge_time = None
+        self._long_pressed = True
+        self._second_press = False
+        self._hold_timer = None
+        self._fire(PushButton.LONG_PRESS)
+        if PushButton.REPEAT in self._gesture_callback.keys():
+            self._hold_timer = asyncio.get_running_loop().call_later(
+                self.repeat_interval, self._repeat)
+
+    def _repeat(self):
+        self._edge_time = None
+        self._hold_timer = asyncio.get_running_loop().call_later(
+            self.repeat_interval, self._repeat)
+        self._fire(PushButton.REPEAT)
+
+    def _cancel_hold(self):
+        if self._hold_timer:
+            self._hold_timer.cancel()
+            self._hold_timer = None
+
+    def _fire(self, gesture):
+        if gesture in self._gesture_callback.keys():
+            logging.debug('Executing callback for PushButton gesture %d', gesture)
+            BUTTON_GESTURES.inc()
+            self._run(*self._gesture_callback[gesture])
+
+    def _run(self, callback_function, callback_args):
+        # timers run outside of the dispatcher, so don't let a failing
+        # callback end up in the loop's exception handler
+        # the trace starts at the edge, or now for a long press or repeat
+        try:
+            with tracer.input('button {}'.format(self.gpio_pin), self._edge_time):
+                callback_function(*callback_args)
+        except Exception:
+            logging.exception('Callback for PushButton on GPIO {} failed'
+                              .format(self.gpio_pin))
 
     def off(self):
         GPIO.remove_event_detect(self.gpio_pin)
+        if self._events:
+            self._events.remove_handler(self.gpio_pin)
+        for timer in (self._settle_timer, self._click_timer, self._hold_timer):
+            if timer:
+                timer.cancel()
+        self._settle_timer = self._click_timer = self._hold_timer = None
+        self._registered = False
         self._callback_function = None
+        self._gesture_callback = dict()
 
 
 class RotaryEncoder:
@@ -72,15 +342,62 @@ class RotaryEncoder:
     LEFT = 1
     RIGHT = 2
 
-    def __init__(self, gpio_pin_a, gpio_pin_b, minimum_delay=0.1, pull=GPIO.PUD_UP):
+#              +---------+         +---------+      0
+#              |         |         |         |
+#    A         |         |         |         |
+#              |         |         |         |
+#    +---------+         +---------+         +----- 1
+#
+#        +---------+         +---------+            0
+#        |         |         |         |
+#    B   |         |         |         |
+#        |         |         |         |
+#    ----+         +---------+         +---------+  1
+#
+# Quadrature transition table, indexed by (previous state << 2) | new state,
+# where a state is (A << 1) | B. Valid transitions count a quarter step
+# (+1 is RIGHT, -1 is LEFT), a double transition (a missed edge) or no
+# change counts as 0.
+    TRANSITIONS = (0, +1, -1, 0,
+                   -1, 0, 0, +1,
+                   +1, 0, 0, -1,
+                   0, -1, +1, 0)
+
+# States in which the knob rests in a detent, per number of quarter steps
+# in a detent
+    DETENT_STATES = {1: (0b00, 0b01, 0b10, 0b11),
+                     2: (0b00, 0b11),
+                     4: (0b11,)}
+
+# Velocity acceleration: (maximum time between detents (sec), step multiplier),
+# fastest first
+    ACCELERATION = ((0.02, 5), (0.05, 2))
+
+    def __init__(self, gpio_pin_a, gpio_pin_b, minimum_delay=0, pull=None,
+                 steps_per_detent=4, acceleration=None, events=None):
+        if pull is None:
+            pull = GPIO.PUD_UP
+        if steps_per_detent not in RotaryEncoder.DETENT_STATES.keys():
+            raise ValueError('steps_per_detent should be one of {}'
+                             .format(tuple(RotaryEncoder.DETENT_STATES.keys())))
         self._callback_function = False
         self._callback_args = False
-        self.in_critical_section = False
+        self._lock = threading.Lock()
+        self._events = events
+        self._levels = {gpio_pin_a: 1, gpio_pin_b: 1}
         self.direction = RotaryEncoder.UNKNOWN
         self.prev_direction = RotaryEncoder.UNKNOWN
-        self.prev_state = 0
+        self.steps = 0
+        self.prev_state = 0b11
+        self.position = 0
         self.last_push = 0
+        self.last_detent = 0
         self.minimum_delay = minimum_delay
+        self.detent_states = RotaryEncoder.DETENT_STATES[steps_per_detent]
+        # tolerate a missed edge within a detent
+        self._threshold = max(1, steps_per_detent // 2)
+        self.acceleration = RotaryEncoder.ACCELERATION if acceleration is True \
+            else acceleration or ()
         self.gpio_pin_a = gpio_pin_a
         self.gpio_pin_b = gpio_pin_b
         # mode must be set to GPIO.BCM, since CircuitPython
@@ -96,59 +413,82 @@ class RotaryEncoder:
                             .format(type(callback_function)))
         self._callback_function = callback_function
         self._callback_args = callback_args
-        GPIO.add_event_detect(self.gpio_pin_a, GPIO.BOTH, bouncetime=10)
-        GPIO.add_event_callback(self.gpio_pin_a, self._decode_rotary)
-        GPIO.add_event_detect(self.gpio_pin_b, GPIO.BOTH, bouncetime=10)
-        GPIO.add_event_callback(self.gpio_pin_b, self._decode_rotary)
+        for gpio_pin in (self.gpio_pin_a, self.gpio_pin_b):
+            GPIO.add_event_detect(gpio_pin, GPIO.BOTH)
+            if self._events:
+                self._events.add_handler(gpio_pin, self._handle_edge)
+                GPIO.add_event_callback(gpio_pin, self._events.edge)
+            else:
+                GPIO.add_event_callback(gpio_pin, self._decode_rotary)
+        self._read_levels()
         logging.info('Callback {} registered for RotaryEncoder'
                      .format(callback_function.__name__))
 
+    def _read_levels(self):
+        """ Start decoding from the state the switches are in, which depends on
+            the wiring (the knob rests at 00 with pull-down resistors) """
+        with self._lock:
+            for gpio_pin in (self.gpio_pin_a, self.gpio_pin_b):
+                self._levels[gpio_pin] = 1 if GPIO.input(gpio_pin) else 0
+            self.prev_state = self._levels[self.gpio_pin_a] << 1 | self._levels[self.gpio_pin_b]
+            self.position = 0
+
     def _decode_rotary(self, channel):
         """ Internal class that determines the state of the switches """
+        if not self._callback_function:
+            return None
+        state = (1 if GPIO.input(self.gpio_pin_a) else 0) << 1 | \
+            (1 if GPIO.input(self.gpio_pin_b) else 0)
+        return self._transition(state, time())
 
-#              +---------+         +---------+      0
-#              |         |         |         |
-#    A         |         |         |         |
-#              |         |         |         |
-#    +---------+         +---------+         +----- 1
-#
-#        +---------+         +---------+            0
-#        |         |         |         |
-#    B   |         |         |         |
-#        |         |         |         |
-#    ----+         +---------+         +---------+  1
-
-        if self.in_critical_section is True or not self._callback_function:
-            logging.debug('In critical section')
-            return
-        self.in_critical_section = True
-        MSB = GPIO.input(self.gpio_pin_a)
-        LSB = GPIO.input(self.gpio_pin_b)
-        new_state = (MSB << 1) | LSB
-        sum = (self.prev_state << 2) | new_state
-        self.prev_state = new_state
-        self.in_critical_section = False
-        self.prev_direction = self.direction
-        if(sum == 0b1101 or sum == 0b0100 or sum == 0b0010 or sum == 0b1011):
-            logging.info('Rotary encoder state: {0:04b} (LEFT)'.format(int(sum)))
-            self.direction = RotaryEncoder.LEFT
-        elif (sum == 0b1110 or sum == 0b0111 or sum == 0b0001 or sum == 0b1000):
-            logging.info('Rotary encoder state: {0:04b} (RIGHT)'.format(int(sum)))
-            self.direction = RotaryEncoder.RIGHT
-        else:
-            logging.info('Rotary encoder state: {0:04b} (UNKNOWN)'.format(int(sum)))
-            self.direction = RotaryEncoder.UNKNOWN
+    def _handle_edge(self, channel, level, timestamp):
+        """ Input event handler: track the level of both switches from the edges """
+        if not self._callback_function:
             return None
-        if time() - self.last_push > self.minimum_delay and self._callback_function:
-            self.last_push = time()
+        self._levels[channel] = 1 if level else 0
+        state = self._levels[self.gpio_pin_a] << 1 | self._levels[self.gpio_pin_b]
+        return self._transition(state, timestamp)
+
+    def _transition(self, state, timestamp):
+        """ Feed a new state of the switches into the decoder and call the
+            callback function when a full detent has been turned """
+        with self._lock:
+            self.position += RotaryEncoder.TRANSITIONS[(self.prev_state << 2) | state]
+            self.prev_state = state
+            if state not in self.detent_states:
+                return None
+            position = self.position
+            self.position = 0
+            if abs(position) < self._threshold:
+                return None
+            self.prev_direction = self.direction
+            self.direction = RotaryEncoder.RIGHT if position > 0 else RotaryEncoder.LEFT
+            self.steps = self._multiplier(timestamp - self.last_detent)
+            self.last_detent = timestamp
+            ROTARY_DETENTS.inc()
+            if timestamp - self.last_push < self.minimum_delay or not self._callback_function:
+                logging.debug('Debounce active.')
+                return None
+            self.last_push = timestamp
+        logging.debug('Rotary encoder turned %d step(s) %s', self.steps,
+                      'RIGHT' if self.direction == RotaryEncoder.RIGHT else 'LEFT')
+        with tracer.input('encoder {}'.format(self.gpio_pin_a), timestamp):
             return self._callback_function(*self._callback_args)
-        else:
-            logging.info('Debounce active.')
-            return None
+
+    def _multiplier(self, interval):
+        """ Determine the number of steps for a detent from the time since the
+            previous detent """
+        for max_interval, multiplier in self.acceleration:
+            if interval <= max_interval:
+                return multiplier
+        return 1
 
     def off(self):
         GPIO.remove_event_detect(self.gpio_pin_a)
         GPIO.remove_event_detect(self.gpio_pin_b)
+        if self._events:
+            self._events.remove_handler(self.gpio_pin_a)
+            self._events.remove_handler(self.gpio_pin_b)
         self._callback_function = None
 
 
@@ -159,38 +499,146 @@ class RGBValueOutOfRange(Exception):
 
 
 class RGBLED():
-    """ RGB LED driver using software based PWM """
+    """ RGB LED driver using software based PWM, with fade and breathe effects """
 
     PWM_FREQ = 100
-    DIM_RED = (10, 0, 0)
-    DIM_GREEN = (0, 10, 0)
-    DIM_BLUE = (0, 0, 10)
-    BRIGHT_RED = (25, 0, 0)
-    BRIGHT_GREEN = (0, 25, 0)
-    BRIGHT_BLUE = (0, 0, 25)
-
-    def __init__(self, gpio_pin_r, gpio_pin_g, gpio_pin_b):
+# Colours are brightness values; with the default gamma the dim colours have a
+# duty cycle of 10% and the bright ones 25%
+    DIM_RED = (35.1, 0, 0)
+    DIM_GREEN = (0, 35.1, 0)
+    DIM_BLUE = (0, 0, 35.1)
+    BRIGHT_RED = (53.25, 0, 0)
+    BRIGHT_GREEN = (0, 53.25, 0)
+    BRIGHT_BLUE = (0, 0, 53.25)
+# Gamma for the conversion of brightness to duty cycle (1.0 is linear, about
+# 2.2 gives perceptually even fades)
+    GAMMA = 2.2
+# Maximum number of duty cycle updates per second while an effect runs
+    FRAME_RATE = 50
+
+    def __init__(self, gpio_pin_r, gpio_pin_g, gpio_pin_b, gamma=None):
         self.gpio_pin_r = gpio_pin_r
         self.gpio_pin_g = gpio_pin_g
         self.gpio_pin_b = gpio_pin_b
         self.values = (0, 0, 0)
+        self._gamma_table = RGBLED.gamma_table(gamma or RGBLED.GAMMA)
+        self._duty_cycle = None
+        self._effect = None
+        self._wakeup = None
+        self._setup()
+
+    def _setup(self):
         GPIO.setmode(GPIO.BCM)
-        GPIO.setup(gpio_pin_r, GPIO.OUT)
-        GPIO.setup(gpio_pin_g, GPIO.OUT)
-        GPIO.setup(gpio_pin_b, GPIO.OUT)
-        self.pwm = [GPIO.PWM(gpio_pin_r, RGBLED.PWM_FREQ),
-                    GPIO.PWM(gpio_pin_g, RGBLED.PWM_FREQ),
-                    GPIO.PWM(gpio_pin_b, RGBLED.PWM_FREQ)]
+        GPIO.setup(self.gpio_pin_r, GPIO.OUT)
+        GPIO.setup(self.gpio_pin_g, GPIO.OUT)
+        GPIO.setup(self.gpio_pin_b, GPIO.OUT)
+        self.pwm = [GPIO.PWM(self.gpio_pin_r, RGBLED.PWM_FREQ),
+                    GPIO.PWM(self.gpio_pin_g, RGBLED.PWM_FREQ),
+                    GPIO.PWM(self.gpio_pin_b, RGBLED.PWM_FREQ)]
 
-    def set(self, values):
-        """ Set the values of each color to 0-100 """
+    def set_pins(self, gpio_pin_r, gpio_pin_g, gpio_pin_b):
+        """ Move the LED to other pins, keeping its colour and effect """
+        pins = (gpio_pin_r, gpio_pin_g, gpio_pin_b)
+        if pins == (self.gpio_pin_r, self.gpio_pin_g, self.gpio_pin_b):
+            return
+        for i in range(0, 3):
+            self.pwm[i].stop()
+        # release the old pins before setting up the new ones
+        for pin in (self.gpio_pin_r, self.gpio_pin_g, self.gpio_pin_b):
+            GPIO.cleanup(pin)
+        self.gpio_pin_r, self.gpio_pin_g, self.gpio_pin_b = pins
+        self._duty_cycle = None
+        self._setup()
+        self._write(self.values)
+
+    @staticmethod
+    def gamma_table(gamma):
+        """ Duty cycle for each brightness value 0-100 """
+        return tuple(round(100 * (value / 100) ** gamma, 2) for value in range(0, 101))
+
+    @staticmethod
+    def validate(values):
+        if len(values) != 3:
+            raise RGBValueOutOfRange('Expected 3 values, got {}.'.format(len(values)))
         for value in values:
-            if value not in range(0, 101):
+            if not isinstance(value, (int, float)) or not 0 <= value <= 100:
                 raise RGBValueOutOfRange
-        self.values = values
+
+    def set(self, values):
+        """ Set the values of each color to 0-100 """
+        RGBLED.validate(values)
+        self._effect = None
+        self._write(values)
+
+    def fade(self, values, duration=0.5):
+        """ Fade from the current values to new values in <duration> sec """
+        RGBLED.validate(values)
+        if self._wakeup is None or duration <= 0:
+            return self.set(values)
+        self._start_effect(self._fade, self.values, tuple(values), duration)
+
+    def breathe(self, values, period=2, minimum=(0, 0, 0)):
+        """ Pulse between <minimum> and <values> until the next set() or fade() """
+        RGBLED.validate(values)
+        RGBLED.validate(minimum)
+        if self._wakeup is None:
+            return self.set(values)
+        self._start_effect(self._breathe, tuple(minimum), tuple(values), period)
+
+    def _start_effect(self, function, start_values, end_values, duration):
+        self._effect = (function, time(), start_values, end_values, duration)
+        self._wakeup.set()
+
+    @staticmethod
+    def _fade(progress):
+        return min(1, progress), progress >= 1
+
+    @staticmethod
+    def _breathe(progress):
+        return (1 - math.cos(2 * math.pi * progress)) / 2, False
+
+    def _write(self, values):
+        """ Update the duty cycles, skipping the channels that don't change """
+        self.values = tuple(values)
+        duty_cycle = tuple(round(self._duty_cycle_for(value), 1) for value in values)
+        if duty_cycle == self._duty_cycle:
+            return
         for i in range(0, 3):
-            self.pwm[i].start(values[i])
+            if self._duty_cycle is None:
+                self.pwm[i].start(duty_cycle[i])
+            elif duty_cycle[i] != self._duty_cycle[i]:
+                self.pwm[i].ChangeDutyCycle(duty_cycle[i])
+        self._duty_cycle = duty_cycle
+
+    def _duty_cycle_for(self, value):
+        i = int(value)
+        if i >= 100:
+            return self._gamma_table[100]
+        return self._gamma_table[i] + \
+            (self._gamma_table[i + 1] - self._gamma_table[i]) * (value - i)
+
+    async def animator(self, frame_rate=FRAME_RATE):
+        """ Asyncio task that runs the fade and breathe effects """
+        self._wakeup = asyncio.Event()
+        logging.info('started LED animation task')
+        try:
+            while True:
+                if self._effect is None:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                function, start_time, start_values, end_values, duration = self._effect
+                level, finished = function((time() - start_time) / duration)
+                self._write([start + (end - start) * level
+                             for start, end in zip(start_values, end_values)])
+                if finished:
+                    self._effect = None
+                await asyncio.sleep(1 / frame_rate)
+        finally:
+            self._wakeup = None
 
     def off(self):
+        self._effect = None
+        self._duty_cycle = None
         for i in range(0, 3):
             self.pwm[i].stop()
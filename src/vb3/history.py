@@ -0,0 +1,170 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import collections
+import csv
+import logging
+import mmap
+import os
+import struct
+import sys
+import zlib
+from time import time
+
+
+Record = collections.namedtuple('Record', ['seq', 'timestamp', 'channel', 'values'])
+
+
+class InvalidHistoryFile(Exception):
+    def __init__(self, filename, message='Not a volumio-buddy history file: {}'):
+        self.filename = filename
+        self.message = message
+        super().__init__(self, message)
+
+    def __str__(self):
+        return self.message.format(self.filename)
+
+
+class History:
+    """ Ring buffer of fixed-size binary records in a memory-mapped file. Appending
+        a record is a memory write, the kernel writes the pages back to the file.
+        Every record has a sequence number and a checksum, so a record that was
+        torn by a crash is skipped when the file is read """
+
+    MAGIC = b'VB3H'
+    VERSION = 1
+    HEADER = struct.Struct('<4sHHI')  # magic, version, record size, capacity
+    HEADER_SIZE = 64
+    PAYLOAD = struct.Struct('<QdHH4f')  # sequence, timestamp, channel, padding, values
+    CHECKSUM = struct.Struct('<I')
+    RECORD_SIZE = PAYLOAD.size + CHECKSUM.size
+    CAPACITY = 65536
+
+# Record channels and the names of their values
+    BATTERY = 1
+    CLIENT = 2
+    CHANNELS = {BATTERY: ('battery', ('voltage', 'current', 'power', 'state')),
+                CLIENT: ('client', ('status', 'volume', 'seek', 'duration'))}
+
+    def __init__(self, filename, capacity=CAPACITY):
+        self.filename = filename
+        self.capacity = capacity
+        size = History.HEADER_SIZE + capacity * History.RECORD_SIZE
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.pread(fd, History.HEADER.size, 0)
+            if os.fstat(fd).st_size != size or \
+                    header != History.HEADER.pack(History.MAGIC, History.VERSION,
+                                                  History.RECORD_SIZE, capacity):
+                logging.info('Creating history file {} for {} records'.format(filename, capacity))
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, History.HEADER.pack(History.MAGIC, History.VERSION,
+                                                  History.RECORD_SIZE, capacity), 0)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        last = max((record.seq for record in History._scan(self._mmap, capacity)), default=0)
+        self._seq = last + 1
+        self._index = last % capacity
+
+    def append(self, channel, *values):
+        """ Store up to 4 values for a channel """
+        values = (tuple(values) + (0, 0, 0, 0))[:4]
+        offset = History.HEADER_SIZE + self._index * History.RECORD_SIZE
+        History.PAYLOAD.pack_into(self._mmap, offset, self._seq, time(), channel, 0, *values)
+        checksum = zlib.crc32(memoryview(self._mmap)[offset:offset + History.PAYLOAD.size])
+        History.CHECKSUM.pack_into(self._mmap, offset + History.PAYLOAD.size, checksum)
+        self._seq += 1
+        self._index = (self._index + 1) % self.capacity
+
+    def records(self, channel=None):
+        return History._records(self._mmap, self.capacity, channel)
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        if not self._mmap.closed:
+            self._mmap.flush()
+            self._mmap.close()
+
+    @staticmethod
+    def read(filename, channel=None):
+        """ All valid records in a history file, oldest first """
+        with open(filename, 'rb') as file:
+            header = file.read(History.HEADER.size)
+            try:
+                magic, version, record_size, capacity = History.HEADER.unpack(header)
+            except struct.error:
+                raise InvalidHistoryFile(filename)
+            if magic != History.MAGIC or version != History.VERSION or \
+                    record_size != History.RECORD_SIZE:
+                raise InvalidHistoryFile(filename)
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return History._records(buffer, capacity, channel)
+
+    @staticmethod
+    def _records(buffer, capacity, channel):
+        return sorted((record for record in History._scan(buffer, capacity)
+                       if channel is None or record.channel == channel),
+                      key=lambda record: record.seq)
+
+    @staticmethod
+    def _scan(buffer, capacity):
+        view = memoryview(buffer)
+        for i in range(capacity):
+            offset = History.HEADER_SIZE + i * History.RECORD_SIZE
+            payload = view[offset:offset + History.PAYLOAD.size]
+            seq, timestamp, channel, _, *values = History.PAYLOAD.unpack(payload)
+            if seq == 0:
+                continue
+            checksum, = History.CHECKSUM.unpack_from(view, offset + History.PAYLOAD.size)
+            if checksum != zlib.crc32(payload):
+                continue
+            yield Record(seq, timestamp, channel, tuple(values))
+
+
+def main(argv=None):
+    """ Export a history file as CSV """
+    channels = {name: channel for channel, (name, _) in History.CHANNELS.items()}
+    parser = argparse.ArgumentParser(description='Export the volumio-buddy history as CSV.')
+    parser.add_argument('filename')
+    parser.add_argument('-c', '--channel', action='store', type=str,
+                        choices=channels.keys(), default=None)
+    parser.add_argument('-o', '--output', action='store', type=str, default='-')
+    args = parser.parse_args(argv)
+    records = History.read(args.filename, channels.get(args.channel))
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        writer = csv.writer(output)
+        if args.channel:
+            writer.writerow(('seq', 'timestamp') + History.CHANNELS[channels[args.channel]][1])
+        else:
+            writer.writerow(('seq', 'timestamp', 'channel', 'value1', 'value2', 'value3', 'value4'))
+        for record in records:
+            name = History.CHANNELS.get(record.channel, (str(record.channel),))[0]
+            row = (record.seq, '{:.3f}'.format(record.timestamp))
+            if not args.channel:
+                row += (name,)
+            writer.writerow(row + tuple('{:g}'.format(value) for value in record.values))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
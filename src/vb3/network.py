@@ -13,57 +13,483 @@
 # You should have received a copy of the GNU General Public License along with
 # Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import ctypes
+import ctypes.util
+import fcntl
+import logging
+import os
 import socket
+import struct
+from time import time
 
+SIOCGIFADDR = 0x8915
+RTF_UP = 0x0001
+RTMGRP_LINK = 0x01
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+# Events that create, change or replace a file in a watched directory
+IN_CHANGES = IN_CLOSE_WRITE | IN_MODIFY | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
 
-class Network(object):
-    def __init__(self):
-        self.hostapd = dict()
-        self.wpa_supplicant = dict()
-        try:
-            file = open('/etc/hostapd/hostapd.tmpl')
+
+def interface_addresses():
+    """ IPv4 address per network interface (without the loopback interface) """
+    addresses = dict()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, name in socket.if_nameindex():
+            if name == 'lo':
+                continue
+            try:
+                request = struct.pack('256s', name[:15].encode())
+                addresses[name] = socket.inet_ntoa(
+                    fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24])
+            except OSError:
+                pass
+    return addresses
+
+
+def default_interface(route_file='/proc/net/route'):
+    """ Name of the interface with the default route """
+    try:
+        with open(route_file) as file:
+            next(file)
             for line in file:
-                try:
-                    key, value = line.split('=')
-                    self.hostapd[key] = value[:-1]
-                except ValueError:
-                    pass
-        except IOError:
-            pass
+                fields = line.split()
+                if len(fields) > 3 and fields[1] == '00000000' and int(fields[3], 16) & RTF_UP:
+                    return fields[0]
+    except (OSError, StopIteration, ValueError):
+        pass
+    return None
+
+
+def parse_hostapd(lines):
+    """ Parse the key=value lines of a hostapd configuration """
+    config = dict()
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        config[key.strip()] = value.strip()
+    return config
+
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def parse_wpa_supplicant(lines):
+    """ Parse a wpa_supplicant configuration into the global settings and a list
+        with the settings of each network={} block """
+    config = dict()
+    networks = []
+    network = None
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if network is None and line.replace(' ', '') == 'network={':
+            network = dict()
+        elif network is not None and line == '}':
+            networks.append(network)
+            network = None
+        elif '=' in line:
+            key, value = line.split('=', 1)
+            (config if network is None else network)[key.strip()] = _unquote(value.strip())
+    return config, networks
+
+
+class ConfigFile:
+    """ Configuration file that is parsed on first access and parsed again after
+        it changed. Changes are reported with invalidate() (e.g. by inotify),
+        otherwise the file is checked with stat() at most every <stat_interval> sec """
+
+    STAT_INTERVAL = 5
+
+    def __init__(self, filename, parser, stat_interval=STAT_INTERVAL):
+        self.filename = filename
+        self.stat_interval = stat_interval
+        self.watched = False
+        self._parser = parser
+        self._data = None
+        self._signature = None
+        self._last_stat = 0
+
+    def invalidate(self):
+        self._data = None
+
+    def get(self):
+        if self._data is not None and not self.watched and \
+                time() - self._last_stat > self.stat_interval:
+            if self._stat() != self._signature:
+                self._data = None
+        if self._data is None:
+            self._load()
+        return self._data
+
+    def _stat(self):
+        self._last_stat = time()
         try:
-            self.hostapd['ssid']
-        except KeyError:
-            self.hostapd['ssid'] = 'unknown'
+            stat = os.stat(self.filename)
+            return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            return None
+
+    def _load(self):
+        self._signature = self._stat()
         try:
-            self.hostapd['wpa_passphrase']
-        except KeyError:
-            self.hostapd['wpa_passphrase'] = 'unknown'
+            with open(self.filename) as file:
+                self._data = self._parser(file)
+        except (OSError, UnicodeDecodeError) as exception:
+            logging.debug('Cannot read {}: {}'.format(self.filename, exception))
+            self._data = self._parser([])
+        logging.info('Parsed {}'.format(self.filename))
+
+
+class Inotify:
+    """ Minimal inotify wrapper (through libc) to watch directories """
+
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watches = dict()
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self._watches[wd] = path
+        return wd
+
+    def read(self):
+        """ (directory, filename, mask) of the pending events """
+        events = []
         try:
-            file = open('/etc/wpa_supplicant/wpa_supplicant.conf')
-            for line in file:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset + Inotify.EVENT.size <= len(data):
+            wd, mask, _, length = Inotify.EVENT.unpack_from(data, offset)
+            offset += Inotify.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+            offset += length
+            events.append((self._watches.get(wd), name, mask))
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def format_rate(rate):
+    """ Short label for a rate in bytes/sec """
+    if rate < 1000:
+        return '{:.0f}B'.format(rate)
+    if rate < 1000000:
+        return '{:.1f}k'.format(rate / 1000)
+    return '{:.1f}M'.format(rate / 1000000)
+
+
+class LinkStats:
+    """ Signal level, link quality and throughput of a (wireless) interface from
+        /proc/net/wireless and /proc/net/dev. The files are kept open and read
+        again from the start for each sample """
+
+# Maximum link quality reported by most drivers
+    MAX_QUALITY = 70
+
+    def __init__(self, interface=None, wireless_file='/proc/net/wireless',
+                 dev_file='/proc/net/dev'):
+        self.interface = interface
+        self.wireless_file = wireless_file
+        self.dev_file = dev_file
+        self._wireless = None
+        self._dev = None
+        self._timestamp = None
+        self.link = None
+        self.level = None
+        self.rx_bytes = None
+        self.tx_bytes = None
+        self.rx_rate = 0
+        self.tx_rate = 0
+
+    @staticmethod
+    def _read(file, filename):
+        if file is None:
+            file = open(filename, 'rb', buffering=0)
+        file.seek(0)
+        return file, file.read()
+
+    def sample(self, timestamp=None):
+        """ Read the counters and compute the rates since the previous sample """
+        timestamp = time() if timestamp is None else timestamp
+        try:
+            self._wireless, data = LinkStats._read(self._wireless, self.wireless_file)
+            self._wireless_stats(data)
+        except OSError:
+            self.link = self.level = None
+        try:
+            self._dev, data = LinkStats._read(self._dev, self.dev_file)
+            self._dev_stats(data, timestamp)
+        except OSError:
+            self.rx_rate = self.tx_rate = 0
+
+    def _wireless_stats(self, data):
+        self.link = self.level = None
+        for line in data.splitlines()[2:]:
+            name, _, values = line.partition(b':')
+            name = name.strip().decode()
+            if self.interface is None:
+                self.interface = name
+            if name != self.interface:
+                continue
+            fields = values.split()
+            self.link = float(fields[1].rstrip(b'.'))
+            self.level = float(fields[2].rstrip(b'.'))
+            return
+
+    def _dev_stats(self, data, timestamp):
+        if self.interface is None:
+            return
+        interface = self.interface.encode()
+        for line in data.splitlines()[2:]:
+            name, _, values = line.partition(b':')
+            if name.strip() != interface:
+                continue
+            fields = values.split()
+            rx_bytes, tx_bytes = int(fields[0]), int(fields[8])
+            if self._timestamp is not None and timestamp > self._timestamp:
+                interval = timestamp - self._timestamp
+                # counters can wrap or reset when the interface comes back up
+                self.rx_rate = max(0, rx_bytes - self.rx_bytes) / interval
+                self.tx_rate = max(0, tx_bytes - self.tx_bytes) / interval
+            self.rx_bytes, self.tx_bytes, self._timestamp = rx_bytes, tx_bytes, timestamp
+            return
+
+    def quality(self):
+        """ Link quality (%) """
+        if self.link is None:
+            return None
+        return int(min(100, 100 * self.link / LinkStats.MAX_QUALITY))
+
+    def close(self):
+        for file in (self._wireless, self._dev):
+            if file:
+                file.close()
+        self._wireless = self._dev = None
+
+
+class Network(object):
+    """ Addresses, Wi-Fi settings and link statistics for the popups """
+# Delay (sec) to collect a burst of netlink messages before refreshing
+    REFRESH_DELAY = 0.2
+# Refresh interval (sec) when netlink is not available
+    POLL_INTERVAL = 30
+# Sample interval (sec) for the link statistics
+    LINK_INTERVAL = 2
+
+    def __init__(self, route_file='/proc/net/route',
+                 hostapd_file='/etc/hostapd/hostapd.tmpl',
+                 wpa_supplicant_file='/etc/wpa_supplicant/wpa_supplicant.conf',
+                 interface=None, wireless_file='/proc/net/wireless',
+                 dev_file='/proc/net/dev'):
+        self.route_file = route_file
+        self.refresh_delay = Network.REFRESH_DELAY
+        self.poll_interval = Network.POLL_INTERVAL
+        self._addresses = dict()
+        self._ip = None
+        self.refresh()
+        self._hostapd = ConfigFile(hostapd_file, parse_hostapd)
+        self._wpa_supplicant = ConfigFile(wpa_supplicant_file, parse_wpa_supplicant)
+        self.link_stats = LinkStats(interface, wireless_file, dev_file)
+
+    @property
+    def hostapd(self):
+        """ Settings of the hotspot """
+        config = {'ssid': 'unknown', 'wpa_passphrase': 'unknown'}
+        config.update(self._hostapd.get())
+        return config
+
+    def networks(self):
+        """ Settings of the networks configured for wpa_supplicant """
+        return self._wpa_supplicant.get()[1]
+
+    @property
+    def wpa_supplicant(self):
+        """ Settings of the wpa_supplicant network with the highest priority """
+        config = {'ssid': 'unknown', 'psk': 'unknown'}
+        networks = self.networks()
+        if networks:
+            def priority(network):
                 try:
-                    key, value = line.split('=')
-                    self.wpa_supplicant[key] = value[:-1]
+                    return int(network.get('priority', 0))
                 except ValueError:
-                    pass
-        except IOError:
-            pass
-        try:
-            self.wpa_supplicant['ssid']
-        except KeyError:
-            self.wpa_supplicant['ssid'] = 'unknown'
+                    return 0
+            config.update(max(networks, key=priority))
+        return config
+
+    def ssid(self):
+        return self.wpa_supplicant['ssid']
+
+    def hotspot_ssid(self):
+        return self.hostapd['ssid']
+
+    def hotspot_passphrase(self):
+        return self.hostapd['wpa_passphrase']
+
+    def signal(self):
+        """ Signal level and link quality of the wireless interface (popup label) """
+        if self.link_stats.level is None:
+            return 'n/a'
+        return '{:.0f}dBm {}%'.format(self.link_stats.level, self.link_stats.quality())
+
+    def link_quality(self):
+        quality = self.link_stats.quality()
+        return 'n/a' if quality is None else '{}%'.format(quality)
+
+    def throughput(self):
+        """ Receive and transmit rate (popup label) """
+        return 'rx {}/s tx {}/s'.format(format_rate(self.link_stats.rx_rate),
+                                        format_rate(self.link_stats.tx_rate))
+
+    async def link_sampler(self, interval=LINK_INTERVAL):
+        """ Asyncio task that samples the link statistics """
+        logging.info('started link statistics task')
         try:
-            self.wpa_supplicant['psk']
-        except KeyError:
-            self.wpa_supplicant['psk'] = 'unknown'
+            while True:
+                self.link_stats.sample()
+                await asyncio.sleep(interval)
+        finally:
+            self.link_stats.close()
+
+    def refresh(self):
+        """ Rebuild the address table """
+        addresses = interface_addresses()
+        interface = default_interface(self.route_file)
+        if interface in addresses.keys():
+            ip = addresses[interface]
+        else:
+            ip = next(iter(addresses.values()), None)
+        if addresses != self._addresses:
+            logging.info('Network addresses: %s', addresses)
+        self._addresses = addresses
+        self._ip = ip
 
     def my_ip(self):
+        """ Address of the interface with the default route (from the cache) """
+        return self._ip
+
+    def ip(self, interface):
+        return self._addresses.get(interface)
+
+    def addresses(self):
+        return self._addresses
+
+    async def watch(self):
+        """ Asyncio task that refreshes the address table when the kernel reports
+            a change of links, addresses or routes, and that watches the
+            configuration files with inotify. Polls when netlink is not available """
+        loop = asyncio.get_running_loop()
+        inotify = self._watch_files(loop)
+        try:
+            await self._watch_network(loop)
+        finally:
+            if inotify:
+                loop.remove_reader(inotify.fileno())
+                inotify.close()
+                for config_file in (self._hostapd, self._wpa_supplicant):
+                    config_file.watched = False
+
+    def _watch_files(self, loop):
         try:
-            return [line for line in
-                    ([ip for ip in socket.gethostbyname_ex(socket.gethostname())[2]
-                     if not ip.startswith('127.')][:1],
-                        [[(s.connect(('8.8.8.8', 53)), s.getsockname()[0], s.close())
-                          for s in [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)]][0][1]])
-                    if line][0][0]
-        except Exception:
+            inotify = Inotify()
+        except (AttributeError, OSError) as exception:
+            logging.warning('Cannot watch configuration files ({}), using stat instead'
+                            .format(exception))
             return None
+        config_files = dict()
+        for config_file in (self._hostapd, self._wpa_supplicant):
+            directory, filename = os.path.split(os.path.abspath(config_file.filename))
+            try:
+                # watch the directory, since editors replace files
+                inotify.add_watch(directory, IN_CHANGES)
+            except OSError as exception:
+                logging.info('Cannot watch {} ({}), using stat instead'
+                             .format(directory, exception))
+                continue
+            config_files[(directory, filename)] = config_file
+            config_file.watched = True
+            config_file.invalidate()
+
+        def on_inotify():
+            for directory, filename, mask in inotify.read():
+                config_file = config_files.get((directory, filename))
+                if config_file:
+                    logging.debug('%s changed', config_file.filename)
+                    config_file.invalidate()
+
+        loop.add_reader(inotify.fileno(), on_inotify)
+        return inotify
+
+    async def _watch_network(self, loop):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE))
+            sock.setblocking(False)
+        except (AttributeError, OSError) as exception:
+            logging.warning('Cannot watch network changes ({}), polling instead'
+                            .format(exception))
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                self.refresh()
+        logging.info('started network watch task')
+        refresh_handle = None
+
+        def on_netlink():
+            nonlocal refresh_handle
+            try:
+                while sock.recv(65536):
+                    pass
+            except BlockingIOError:
+                pass
+            except OSError as exception:
+                # e.g. ENOBUFS when messages were lost: refresh anyway
+                logging.debug('Netlink: %s', exception)
+            # changes come in bursts, so refresh once per burst
+            if refresh_handle is None:
+                refresh_handle = loop.call_later(self.refresh_delay, refresh)
+
+        def refresh():
+            nonlocal refresh_handle
+            refresh_handle = None
+            self.refresh()
+
+        loop.add_reader(sock.fileno(), on_netlink)
+        try:
+            await loop.create_future()
+        finally:
+            loop.remove_reader(sock.fileno())
+            if refresh_handle:
+                refresh_handle.cancel()
+            sock.close()
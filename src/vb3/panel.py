@@ -0,0 +1,278 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import abc
+from time import sleep
+from PIL import Image, ImageChops
+import board
+import busio
+import digitalio
+from adafruit_bus_device import i2c_device, spi_device
+
+# Byte translation tables for the two pixels of a grayscale byte: the left pixel
+# goes in the high nibble, the right pixel in the low nibble
+HIGH_NIBBLE = bytes(value & 0xf0 for value in range(256))
+LOW_NIBBLE = bytes(value >> 4 for value in range(256))
+
+
+def pack_pages(image):
+    """ Pack a 1-bit image in pages of 8 rows, with a byte per column and the top row
+        of the page in the least significant bit. PIL packs the rows of the transposed
+        image (so the columns of the image) and transposes the packed bytes back,
+        which is much faster than setting the bits pixel by pixel """
+    width, height = image.size
+    columns = image.transpose(Image.TRANSPOSE).tobytes('raw', '1;R')
+    return Image.frombytes('L', (height // 8, width), columns). \
+        transpose(Image.TRANSPOSE).tobytes()
+
+
+def pack_nibbles(image):
+    """ Pack an image in 4-bit grayscale, two pixels per byte """
+    width, height = image.size
+    pixels = image.convert('L').tobytes()
+    left = Image.frombytes('L', (width // 2, height), pixels[0::2].translate(HIGH_NIBBLE))
+    right = Image.frombytes('L', (width // 2, height), pixels[1::2].translate(LOW_NIBBLE))
+    return ImageChops.add(left, right).tobytes()
+
+
+class I2CBus:
+    """ I2C connection to a display controller. A control byte in front of the
+        data tells commands from display data """
+
+    def __init__(self, addr=0x3c, i2c=None):
+        self._device = i2c_device.I2CDevice(i2c or busio.I2C(board.SCL, board.SDA), addr)
+
+    def command(self, data):
+        self._write(b'\x00' + data)
+
+    def data(self, data):
+        self._write(b'\x40' + data)
+
+    def _write(self, data):
+        with self._device:
+            self._device.write(data)
+
+
+class SPIBus:
+    """ 4-wire SPI connection to a display controller. The D/C pin tells commands
+        from display data """
+
+    def __init__(self, dc, reset=None, cs=None, baudrate=8000000, spi=None):
+        self._dc = digitalio.DigitalInOut(dc)
+        self._dc.switch_to_output(value=False)
+        self._device = spi_device.SPIDevice(spi or busio.SPI(board.SCK, board.MOSI),
+                                            digitalio.DigitalInOut(cs or board.CE0),
+                                            baudrate=baudrate)
+        if reset:
+            reset = digitalio.DigitalInOut(reset)
+            reset.switch_to_output(value=True)
+            sleep(0.001)
+            reset.value = False
+            sleep(0.01)
+            reset.value = True
+            sleep(0.001)
+
+    def command(self, data):
+        self._write(False, data)
+
+    def data(self, data):
+        self._write(True, data)
+
+    def _write(self, dc, data):
+        self._dc.value = dc
+        with self._device as spi:
+            spi.write(data)
+
+
+class Panel(abc.ABC):
+    """ Base class for the display drivers. A driver initializes the controller and
+        packs the images in the format of its display RAM. The Display calls
+        image() and show() for every frame """
+
+# Panel dimensions
+    WIDTH = 128
+    HEIGHT = 64
+# 'i2c' or 'spi'
+    BUS = 'i2c'
+# Initialization commands
+    INIT = ()
+
+    def __init__(self, bus):
+        self._bus = bus
+        self.width = self.WIDTH
+        self.height = self.HEIGHT
+        self.buffer = b''
+        for command in self.INIT:
+            self.command(*command)
+
+    def command(self, *data):
+        self._bus.command(bytes(data))
+
+    def image(self, image):
+        """ Pack an image of the size of the panel in the buffer """
+        if image.size != (self.width, self.height):
+            raise ValueError('Image must be {}x{} pixels, not {}x{}'.format(
+                self.width, self.height, *image.size))
+        self.buffer = self.pack(image)
+
+    @abc.abstractmethod
+    def pack(self, image):
+        """ The image in the format of the display RAM """
+
+    @abc.abstractmethod
+    def show(self):
+        """ Send the buffer to the display """
+
+    def poweroff(self):
+        self.command(0xae)
+
+    def poweron(self):
+        self.command(0xaf)
+
+
+class SSD1306(Panel):
+    """ 128x64 OLED with a SSD1306 controller. The display RAM is written in
+        horizontal addressing mode, so a frame is a single transfer """
+
+    INIT = ((0xae,),             # display off
+            (0x20, 0x00),        # horizontal addressing mode
+            (0x40,),             # start line 0
+            (0xa1,),             # segment remap
+            (0xa8, 63),          # multiplex ratio: height - 1
+            (0xc8,),             # scan COM outputs from the bottom
+            (0xd3, 0x00),        # display offset
+            (0xda, 0x12),        # COM pins configuration
+            (0xd5, 0x80),        # clock divide ratio and oscillator frequency
+            (0xd9, 0xf1),        # precharge period
+            (0xdb, 0x30),        # VCOMH deselect level
+            (0x81, 0xff),        # contrast
+            (0xa4,),             # show the display RAM
+            (0xa6,),             # not inverted
+            (0x8d, 0x14),        # charge pump on
+            (0xaf,))             # display on
+
+    def pack(self, image):
+        return pack_pages(image if image.mode == '1' else image.convert('1'))
+
+    def show(self):
+        self.command(0x21, 0, self.width - 1)
+        self.command(0x22, 0, self.height // 8 - 1)
+        self._bus.data(self.buffer)
+
+
+class SSD1306_128x32(SSD1306):
+    """ 128x32 OLED with a SSD1306 controller """
+
+    HEIGHT = 32
+# The multiplex ratio and the COM pins configuration differ from the 128x64 panel
+    INIT = tuple({0xa8: (0xa8, 31), 0xda: (0xda, 0x02)}.get(command[0], command)
+                 for command in SSD1306.INIT)
+
+
+class SH1106(SSD1306):
+    """ 128x64 OLED with a SH1106 controller. It has 132 columns of display RAM, of
+        which the middle 128 are visible, and only page addressing, so a frame is
+        sent page by page """
+
+# First visible column in the display RAM
+    COLUMN_OFFSET = 2
+    INIT = ((0xae,),             # display off
+            (0xd5, 0x80),        # clock divide ratio and oscillator frequency
+            (0xa8, 63),          # multiplex ratio: height - 1
+            (0xd3, 0x00),        # display offset
+            (0x40,),             # start line 0
+            (0xad, 0x8b),        # DC-DC converter on
+            (0xa1,),             # segment remap
+            (0xc8,),             # scan COM outputs from the bottom
+            (0xda, 0x12),        # COM pins configuration
+            (0x81, 0x80),        # contrast
+            (0xd9, 0x22),        # precharge period
+            (0xdb, 0x35),        # VCOM deselect level
+            (0xa4,),             # show the display RAM
+            (0xa6,),             # not inverted
+            (0xaf,))             # display on
+
+    def show(self):
+        buffer = memoryview(self.buffer)
+        for page in range(self.height // 8):
+            self.command(0xb0 | page, self.COLUMN_OFFSET & 0x0f, 0x10 | self.COLUMN_OFFSET >> 4)
+            self._bus.data(buffer[page*self.width:(page + 1)*self.width])
+
+
+class SSD1322(Panel):
+    """ 256x64 OLED with a SSD1322 controller and 16 gray levels, connected with
+        SPI. The command parameters are sent as display data """
+
+    WIDTH = 256
+    BUS = 'spi'
+# First column (of 4 pixels) of the display RAM that is visible
+    COLUMN_OFFSET = 28
+    INIT = ((0xfd, 0x12),        # unlock the commands
+            (0xae,),             # display off
+            (0xb3, 0x91),        # clock divide ratio and oscillator frequency
+            (0xca, 63),          # multiplex ratio: height - 1
+            (0xa2, 0x00),        # display offset
+            (0xa1, 0x00),        # start line 0
+            (0xa0, 0x14, 0x11),  # horizontal address increment, nibble remap, dual COM
+            (0xb5, 0x00),        # GPIO pins off
+            (0xab, 0x01),        # internal VDD regulator
+            (0xb4, 0xa0, 0xfd),  # display enhancement A: external VSL
+            (0xc1, 0x9f),        # contrast
+            (0xc7, 0x0f),        # master contrast
+            (0xb9,),             # linear gray scale table
+            (0xb1, 0xe2),        # phase length
+            (0xd1, 0xa2, 0x20),  # display enhancement B
+            (0xbb, 0x1f),        # precharge voltage
+            (0xb6, 0x08),        # second precharge period
+            (0xbe, 0x07),        # VCOMH
+            (0xa6,),             # normal display
+            (0xa9,),             # exit partial display
+            (0xaf,))             # display on
+
+    def command(self, command, *data):
+        self._bus.command(bytes((command,)))
+        if data:
+            self._bus.data(bytes(data))
+
+    def pack(self, image):
+        return pack_nibbles(image)
+
+    def show(self):
+        self.command(0x15, self.COLUMN_OFFSET, self.COLUMN_OFFSET + self.width // 4 - 1)
+        self.command(0x75, 0, self.height - 1)
+        self.command(0x5c)
+        self._bus.data(self.buffer)
+
+
+# Display drivers by name (see the driver setting in the [display] section)
+PANELS = {'ssd1306': SSD1306,
+          'ssd1306_128x32': SSD1306_128x32,
+          'sh1106': SH1106,
+          'ssd1322': SSD1322}
+
+
+def create_panel(driver='ssd1306', i2c_addr=None, spi_dc=25, spi_reset=0):
+    """ Connect to the display with the named driver. The SPI pins are GPIO
+        numbers; a reset pin of 0 means it isn't connected """
+    if driver not in PANELS.keys():
+        raise ValueError('Unknown display driver: {}. Use one of {}'.format(
+            driver, ', '.join(PANELS.keys())))
+    panel = PANELS[driver]
+    if panel.BUS == 'spi':
+        bus = SPIBus(getattr(board, 'D{}'.format(spi_dc)),
+                     reset=getattr(board, 'D{}'.format(spi_reset)) if spi_reset else None)
+    else:
+        bus = I2CBus(i2c_addr or 0x3c)
+    return panel(bus)
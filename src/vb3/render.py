@@ -0,0 +1,276 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import multiprocessing
+import signal
+import struct
+from time import monotonic, time
+from PIL import Image
+from .display import BarModal, Display, Popup
+
+try:
+    # multiprocessing.shared_memory is new in Python 3.8
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+class SharedFrameBuffer:
+    """ Double buffer of frames in shared memory, written by the render worker
+        and read by the service. Each buffer holds a frame for the display and
+        the main screen without modals (see Display.frame()). The writer fills
+        the buffer that is not in front and then brings it to the front; the
+        sequence number of a buffer is odd while it is being written """
+
+# Header: number of frames written and the index of the front buffer
+    HEADER = struct.Struct('=QI')
+# Buffer header: sequence number and whether it has a main screen frame
+    BUFFER_HEADER = struct.Struct('=Q?')
+# Attempts to read a frame that isn't being written
+    MAX_TRIES = 100
+
+    def __init__(self, mode, size, name=None):
+        self.mode = mode
+        self.size = tuple(size)
+        self.frame_size = len(Image.new(mode, self.size).tobytes())
+        self.buffer_size = SharedFrameBuffer.BUFFER_HEADER.size + 2*self.frame_size
+        total = SharedFrameBuffer.HEADER.size + 2*self.buffer_size
+        if name is None:
+            self._memory = shared_memory.SharedMemory(create=True, size=total)
+            self._owner = True
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self.name = self._memory.name
+        self._count = 0
+        self._front = 0
+        self._sequence = [0, 0]
+
+    def _offset(self, index):
+        return SharedFrameBuffer.HEADER.size + index*self.buffer_size
+
+    def write(self, image, frame=None):
+        """ Write a frame and (optionally) the main screen, and bring them to the front """
+        buf = self._memory.buf
+        back = 1 - self._front
+        offset = self._offset(back)
+        self._sequence[back] += 1
+        SharedFrameBuffer.BUFFER_HEADER.pack_into(buf, offset, self._sequence[back], False)
+        offset += SharedFrameBuffer.BUFFER_HEADER.size
+        buf[offset:offset + self.frame_size] = image.tobytes()
+        if frame is not None:
+            buf[offset + self.frame_size:offset + 2*self.frame_size] = frame.tobytes()
+        self._sequence[back] += 1
+        SharedFrameBuffer.BUFFER_HEADER.pack_into(buf, self._offset(back), self._sequence[back],
+                                                  frame is not None)
+        self._front = back
+        self._count += 1
+        SharedFrameBuffer.HEADER.pack_into(buf, 0, self._count, back)
+
+    def count(self):
+        """ Number of frames written """
+        return SharedFrameBuffer.HEADER.unpack_from(self._memory.buf, 0)[0]
+
+    def read(self, image, frame=None):
+        """ Load the front frame into an image of the same mode and size, and the
+            main screen into <frame>. Returns whether the main screen was loaded, or
+            None when the writer kept overwriting the frame; the images may then
+            hold a mix of two frames """
+        buf = self._memory.buf
+        for _ in range(SharedFrameBuffer.MAX_TRIES):
+            _, front = SharedFrameBuffer.HEADER.unpack_from(buf, 0)
+            offset = self._offset(front)
+            sequence, has_frame = SharedFrameBuffer.BUFFER_HEADER.unpack_from(buf, offset)
+            if sequence % 2:
+                continue
+            data = offset + SharedFrameBuffer.BUFFER_HEADER.size
+            image.frombytes(bytes(buf[data:data + self.frame_size]))
+            if frame is not None and has_frame:
+                frame.frombytes(bytes(buf[data + self.frame_size:data + 2*self.frame_size]))
+            # a torn read when the writer wrote this buffer again in the meantime
+            if SharedFrameBuffer.BUFFER_HEADER.unpack_from(buf, offset)[0] == sequence:
+                return has_frame
+        return None
+
+    def close(self):
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
+
+
+class _NullPanel:
+    """ The render worker only renders, the service shows the frames """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+    def image(self, image):
+        pass
+
+    def show(self):
+        pass
+
+
+def render_worker(name, mode, size, connection, interval, modal_duration):
+    """ Render process: applies the display calls that arrive on the connection
+        and renders a frame into the shared frame buffer every <interval> sec.
+        It stops when the service closes the connection """
+    # the service stops the worker, also on the signals systemd sends to all
+    # processes of the service
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    framebuffer = SharedFrameBuffer(mode, size, name)
+    display = Display(panel=_NullPanel(*size))
+    display.set_modal_duration(modal_duration)
+    next_frame = monotonic()
+    try:
+        while True:
+            if connection.poll(max(0, next_frame - monotonic())):
+                method, args = connection.recv()
+                if method == 'update_interval':
+                    interval = args[0]
+                elif method in RenderProcessDisplay.FORWARDED:
+                    getattr(display, method)(*args)
+                continue
+            next_frame = monotonic() + interval
+            framebuffer.write(display.render(), display.frame())
+    except (EOFError, OSError):
+        pass
+    finally:
+        framebuffer.close()
+
+
+class RenderProcessDisplay(Display):
+    """ Display that renders in a separate process, so layout, rasterization
+        and their garbage don't hold up the event loop and the GPIO threads.
+        The calls that change the screen are sent to the render worker; the
+        finished frames come back through a SharedFrameBuffer and update()
+        only shows them. The worker stops at the shutdown status, after which
+        the display renders in the service itself """
+    __slots__ = ('_process', '_connection', '_framebuffer', '_count', '_interval',
+                 '_next_frame')
+
+# Display calls that are applied in the render worker
+    FORWARDED = ('update_main_screen', 'status', 'volume', 'popup', 'set_modal_duration',
+                 'restore')
+
+    def __init__(self, i2c_addr=None, panel=None):
+        super().__init__(i2c_addr, panel)
+        self._count = 0
+        self._interval = self.update_interval
+        self._next_frame = Image.new(self._image.mode, self._image.size)
+        self._framebuffer = SharedFrameBuffer(self._image.mode, self._image.size)
+        # the service runs threads (logging, GPIO), so don't fork it
+        context = multiprocessing.get_context('spawn')
+        self._connection, worker_connection = context.Pipe()
+        self._process = context.Process(
+            target=render_worker, name='vbuddy-render', daemon=True,
+            args=(self._framebuffer.name, self._image.mode, self._image.size,
+                  worker_connection, self._interval, self._modal_duration))
+        self._process.start()
+        worker_connection.close()
+        logging.info('Started render process %d', self._process.pid)
+
+    def _send(self, method, *args):
+        try:
+            self._connection.send((method, args))
+        except (OSError, ValueError) as exception:
+            logging.warning('Cannot send %s to the render process: %s', method, exception)
+
+    def update_main_screen(self, label, duration, seek):
+        super().update_main_screen(label, duration, seek)
+        if self._process:
+            self._send('update_main_screen', label, duration, seek)
+
+    def status(self, status_type):
+        if not self._process or status_type == Display.STATUS_SHUTDOWN:
+            self.close()
+            return super().status(status_type)
+        if status_type in Display.LABEL.keys() and status_type != self._status:
+            self._prev_status = self._status
+            self._status = status_type
+            if status_type != Display.STATUS_STOP:
+                self._modal_timeout = time() + self._modal_duration
+            self._send('status', status_type)
+
+    def volume(self, level):
+        if not self._process:
+            return super().volume(level)
+        BarModal.validate_level(level)
+        self._modal_timeout = time() + self._modal_duration
+        self._send('volume', level)
+
+    def popup(self, label):
+        if not self._process:
+            return super().popup(label)
+        if type(label) not in (tuple, str):
+            raise TypeError('Textlabel is a {}. Should be string or tuple'
+                            .format(type(label).__name__))
+        Popup.validate_label(label)
+        self._modal_timeout = time() + self._modal_duration
+        self._send('popup', label)
+
+    def set_modal_duration(self, duration):
+        super().set_modal_duration(duration)
+        if self._process:
+            self._send('set_modal_duration', duration)
+
+    def restore(self, mode, size, data):
+        if not super().restore(mode, size, data):
+            return False
+        if self._process:
+            self._send('restore', mode, size, data)
+        return True
+
+    def update(self):
+        """ Show the last frame of the render worker, if there is a new one """
+        if not self._process:
+            return super().update()
+        if not self._process.is_alive():
+            logging.error('Render process stopped with exit code %s, rendering in the service',
+                          self._process.exitcode)
+            self.close()
+            return super().update()
+        if self.update_interval != self._interval:
+            self._interval = self.update_interval
+            self._send('update_interval', self._interval)
+        count = self._framebuffer.count()
+        if count == self._count:
+            return
+        has_frame = self._framebuffer.read(self._image, self._next_frame)
+        if has_frame is None:
+            # don't show a torn frame, read it again at the next update
+            logging.debug('Cannot read a consistent frame from the render process')
+            return
+        self._count = count
+        if has_frame:
+            if self._frame is None:
+                self._frame = Image.new(self._image.mode, self._image.size)
+            self._frame, self._next_frame = self._next_frame, self._frame
+        self.show(self._image)
+
+    def close(self):
+        """ Stop the render worker """
+        if not self._process:
+            return
+        self._connection.close()
+        self._process.join(1)
+        if self._process.is_alive():
+            logging.warning('Render process does not stop, terminating it')
+            self._process.terminate()
+        self._process = None
+        self._framebuffer.close()
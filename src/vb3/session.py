@@ -0,0 +1,182 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import importlib
+import json
+import selectors
+from time import time
+
+
+class SessionRecorder:
+    """ Records the inputs of a session: the pushState messages, the GPIO edges
+        and the battery samples, as lines of JSON with [timestamp, kind, data].
+        A SessionReplay plays them back in virtual time """
+
+    def __init__(self):
+        self._file = None
+
+    def open(self, filename, **info):
+        """ Start recording to a file. The <info> (e.g. the gpio pins) is written
+            in the first record """
+        self.close()
+        self._file = open(filename, 'a', buffering=1)
+        self._write(time(), 'session', info)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def state(self, data):
+        if self._file:
+            self._write(time(), 'state', data)
+
+    def edge(self, timestamp, channel, level):
+        if self._file:
+            self._write(timestamp, 'edge', (channel, level))
+
+    def battery(self, timestamp, bus_voltage, shunt_voltage, current):
+        if self._file:
+            self._write(timestamp, 'battery', (bus_voltage, shunt_voltage, current))
+
+    def _write(self, timestamp, kind, data):
+        self._file.write(json.dumps((timestamp, kind, data)) + '\n')
+
+
+recorder = SessionRecorder()
+
+
+def read_session(filename):
+    """ The records of a session file, in the order of their timestamps """
+    with open(filename) as file:
+        records = [tuple(json.loads(line)) for line in file if line.strip()]
+    return sorted(records, key=lambda record: record[0])
+
+
+class VirtualClock:
+    """ Time that only moves when the event loop has nothing to do. While it
+        runs, time() in the modules that use it returns the virtual time """
+
+# Modules that use time.time()
+    MODULES = ('battery', 'display', 'gpio', 'simulator', 'tracing')
+
+    def __init__(self, start=0):
+        self.now = start
+        self._patched = dict()
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def __enter__(self):
+        for name in VirtualClock.MODULES:
+            module = importlib.import_module('.' + name, __package__)
+            self._patched[module] = module.time
+            module.time = self.time
+        return self
+
+    def __exit__(self, *exc_info):
+        for module, function in self._patched.items():
+            module.time = function
+        self._patched.clear()
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """ Selector that polls the file descriptors, and moves the clock to the
+        next timer instead of waiting for it """
+
+    def __init__(self, clock):
+        super().__init__()
+        self._clock = clock
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            return super().select(None)
+        self._clock.advance(timeout)
+        return []
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """ Event loop on a VirtualClock: sleeps and timers finish as soon as
+        nothing else is ready to run """
+
+    def __init__(self, clock):
+        super().__init__(_VirtualSelector(clock))
+        self.clock = clock
+        # timers are due within the resolution of the clock, which has to be
+        # coarser than a float step at timestamps like time() (~2e-7 sec)
+        self._clock_resolution = 1e-6
+
+    def time(self):
+        return self.clock.now
+
+
+class ReplayINA:
+    """ Stand-in for the INA219 of a Battery, with the recorded readings """
+
+    def __init__(self, bus_voltage=0, shunt_voltage=0, current=0):
+        self.bus_voltage = bus_voltage
+        self.shunt_voltage = shunt_voltage
+        self.current = current
+
+
+class SessionReplay:
+    """ Plays back the records of a session at their (virtual) time: states go
+        to the VolumioClient, edges to the simulated GPIO and battery readings
+        to a ReplayINA """
+
+    def __init__(self, records, volumio_client=None, gpio=None, ina=None):
+        self.records = records
+        self.volumio_client = volumio_client
+        self.gpio = gpio
+        self.ina = ina
+        self.replayed = dict(state=0, edge=0, battery=0)
+
+    def info(self):
+        """ The info of the first session record """
+        for timestamp, kind, data in self.records:
+            if kind == 'session':
+                return data
+        return dict()
+
+    def start_time(self):
+        return self.records[0][0] if self.records else 0
+
+    def duration(self):
+        return self.records[-1][0] - self.start_time() if self.records else 0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for timestamp, kind, data in self.records:
+            delay = timestamp - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if kind == 'state' and self.volumio_client:
+                self.volumio_client.receive_state(data)
+            elif kind == 'edge' and self.gpio:
+                self.gpio.inject(*data)
+            elif kind == 'battery' and self.ina:
+                self.ina.bus_voltage, self.ina.shunt_voltage, self.ina.current = data
+            else:
+                continue
+            self.replayed[kind] += 1
+            # let the dispatcher and the callbacks handle the record
+            await asyncio.sleep(0)
@@ -0,0 +1,212 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import csv
+import logging
+import threading
+from time import sleep, time
+
+
+class SimulatedPWM:
+    """ Software PWM channel of the simulator, keeps a history of the duty cycles """
+
+    def __init__(self, channel, frequency):
+        self.channel = channel
+        self.frequency = frequency
+        self.duty_cycle = None
+        self.history = []
+
+    def start(self, duty_cycle):
+        self.ChangeDutyCycle(duty_cycle)
+
+    def ChangeDutyCycle(self, duty_cycle):
+        if not 0 <= duty_cycle <= 100:
+            raise ValueError('dutycycle must have a value from 0.0 to 100.0')
+        self.duty_cycle = duty_cycle
+        self.history.append((time(), duty_cycle))
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+    def stop(self):
+        self.duty_cycle = None
+
+
+class SimulatedGPIO:
+    """ In-process stand-in for the RPi.GPIO module. Edges are injected with
+        inject() or replayed from a trace of (timestamp, pin, level) tuples
+        and call the registered event callbacks, like RPi.GPIO does """
+
+# Constants with the same values as RPi.GPIO
+    LOW = 0
+    HIGH = 1
+    OUT = 0
+    IN = 1
+    BOARD = 10
+    BCM = 11
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self._mode = None
+        self._levels = dict()
+        self._edge = dict()
+        self._bouncetime = dict()
+        self._last_callback = dict()
+        self._callbacks = dict()
+        self._lock = threading.RLock()
+        self.edges = 0
+        self.pwm = dict()
+
+    def setmode(self, mode):
+        self._mode = mode
+
+    def getmode(self):
+        return self._mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=None):
+        with self._lock:
+            if direction == self.OUT:
+                self._levels[channel] = initial or self.LOW
+            elif channel not in self._levels.keys():
+                self._levels[channel] = self.HIGH if pull_up_down == self.PUD_UP else self.LOW
+
+    def input(self, channel):
+        return self._levels.get(channel, self.LOW)
+
+    def output(self, channel, level):
+        self._levels[channel] = self.HIGH if level else self.LOW
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        with self._lock:
+            if channel in self._edge.keys():
+                raise RuntimeError('Conflicting edge detection already enabled for this GPIO channel')
+            self._edge[channel] = edge
+            self._bouncetime[channel] = (bouncetime or 0) / 1000
+            self._last_callback[channel] = 0
+            self._callbacks[channel] = [callback] if callback else []
+
+    def add_event_callback(self, channel, callback):
+        with self._lock:
+            if channel not in self._edge.keys():
+                raise RuntimeError('Add event detection using add_event_detect first before adding a callback')
+            self._callbacks[channel].append(callback)
+
+    def remove_event_detect(self, channel):
+        with self._lock:
+            self._edge.pop(channel, None)
+            self._callbacks.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        with self._lock:
+            channels = [channel] if channel is not None else list(self._levels.keys())
+            for channel in channels:
+                self.remove_event_detect(channel)
+                self._levels.pop(channel, None)
+
+    def PWM(self, channel, frequency):
+        self.pwm[channel] = SimulatedPWM(channel, frequency)
+        return self.pwm[channel]
+
+    def inject(self, channel, level, bounces=0, bounce_interval=0.0002):
+        """ Change the level of an input and call the event callbacks. With
+            <bounces>, the contact chatters before it settles on the new level """
+        for i in range(bounces):
+            self._set_level(channel, level)
+            self._set_level(channel, not level)
+            if bounce_interval:
+                sleep(bounce_interval)
+        self._set_level(channel, level)
+
+    def _set_level(self, channel, level):
+        level = self.HIGH if level else self.LOW
+        with self._lock:
+            if self._levels.get(channel, self.LOW) == level:
+                return
+            self._levels[channel] = level
+            edge = self._edge.get(channel)
+            if edge is None or (edge == self.RISING and level == self.LOW) or \
+                    (edge == self.FALLING and level == self.HIGH):
+                return
+            now = time()
+            if now - self._last_callback[channel] < self._bouncetime[channel]:
+                return
+            self._last_callback[channel] = now
+            callbacks = list(self._callbacks[channel])
+        self.edges += 1
+        for callback in callbacks:
+            try:
+                callback(channel)
+            except Exception:
+                logging.exception('Simulated GPIO callback for channel {} failed'.format(channel))
+
+    def replay(self, trace, speed=1.0, bounces=0, bounce_interval=0.0002):
+        """ Replay a trace of (timestamp, pin, level) tuples. A speed of 2 replays
+            twice as fast as recorded, a speed of 0 as fast as possible """
+        start_time = time()
+        first_timestamp = None
+        for timestamp, channel, level in trace:
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            if speed:
+                delay = (timestamp - first_timestamp)/speed - (time() - start_time)
+                if delay > 0:
+                    sleep(delay)
+            self.inject(channel, level, bounces=bounces, bounce_interval=bounce_interval if speed else 0)
+
+    def replay_in_thread(self, trace, speed=1.0, bounces=0, bounce_interval=0.0002):
+        """ Replay a trace in a separate thread, like the RPi.GPIO callback thread """
+        thread = threading.Thread(target=self.replay, args=(trace, speed, bounces, bounce_interval),
+                                  daemon=True)
+        thread.start()
+        return thread
+
+
+def spin(pin_a, pin_b, detents, direction=1, interval=0.001, start=0):
+    """ Create a trace for turning a rotary encoder <detents> detents, from and to
+        the resting state 11. A negative <direction> turns it to the left """
+    states = [0b10, 0b00, 0b01, 0b11] if direction > 0 else [0b01, 0b00, 0b10, 0b11]
+    trace = []
+    previous = 0b11
+    timestamp = start
+    for state in states*detents:
+        changed = previous ^ state
+        if changed & 0b10:
+            trace.append((timestamp, pin_a, state >> 1))
+        if changed & 0b01:
+            trace.append((timestamp, pin_b, state & 1))
+        previous = state
+        timestamp += interval
+    return trace
+
+
+def read_trace(filename):
+    """ Read a trace from a CSV file with timestamp,pin,level lines """
+    with open(filename, newline='') as file:
+        return [(float(timestamp), int(pin), int(level))
+                for timestamp, pin, level in csv.reader(file)
+                if not timestamp.startswith('#')]
+
+
+def write_trace(filename, trace):
+    with open(filename, 'w', newline='') as file:
+        csv.writer(file).writerows(trace)
@@ -0,0 +1,155 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import threading
+from time import time
+
+
+class Snapshot:
+    """ Last known player state, main screen frame and LED colour, so they can be
+        shown right after a restart. The file is replaced atomically, so a crash
+        or power loss leaves either the old or the new snapshot. Inside the event
+        loop the file is written in the default executor, so the fsync doesn't
+        hold up the loop """
+
+    VERSION = 1
+# Minimum time between two writes (sec)
+    MIN_INTERVAL = 10
+# Delay before a write in the event loop, so the display has rendered the new state (sec)
+    SETTLE_TIME = 1
+
+    def __init__(self, filename, min_interval=MIN_INTERVAL):
+        self.filename = filename
+        self.min_interval = min_interval
+        self._state = None
+        self._frame = None
+        self._led = None
+        self._dirty = False
+        self._last_write = 0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._written = 0
+
+    def save(self, state, frame=None, led=None):
+        """ Save the snapshot, at most once per <min_interval> sec. Inside the event
+            loop the write is deferred. The frame is a PIL image, or a function that
+            returns one when the file is written """
+        self._state = dict(state)
+        self._frame = frame
+        self._led = tuple(led) if led else None
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if time() - self._last_write >= self.min_interval:
+                return self.flush()
+            return False
+        if self._timer is None:
+            delay = max(self._last_write + self.min_interval - time(), Snapshot.SETTLE_TIME)
+            self._timer = loop.call_later(delay, self._deferred_flush)
+        return False
+
+    def _deferred_flush(self):
+        self._timer = None
+        if not self._dirty:
+            return
+        data = self._data()
+        self._last_write = time()
+        future = asyncio.get_running_loop().run_in_executor(None, self._write, data)
+        future.add_done_callback(self._written_callback)
+
+    def _written_callback(self, future):
+        if future.cancelled() or not future.result():
+            self._dirty = True
+
+    def flush(self):
+        """ Write a pending snapshot to the file """
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if not self._dirty:
+            return False
+        if not self._write(self._data()):
+            self._dirty = True
+            return False
+        self._last_write = time()
+        return True
+
+    def _data(self):
+        """ The pending snapshot. The frame is copied here, in the thread that renders it """
+        frame = self._frame() if callable(self._frame) else self._frame
+        data = {'version': Snapshot.VERSION,
+                'timestamp': time(),
+                'state': self._state,
+                'led': self._led,
+                'frame': None}
+        if frame is not None:
+            data['frame'] = {'mode': frame.mode,
+                             'size': frame.size,
+                             'data': base64.b64encode(frame.tobytes()).decode('ascii')}
+        self._dirty = False
+        self._sequence += 1
+        return self._sequence, data
+
+    def _write(self, snapshot):
+        """ Write the snapshot to the file, unless a newer one was written already """
+        sequence, data = snapshot
+        temp_filename = '{}.{}.tmp'.format(self.filename, os.getpid())
+        with self._lock:
+            if sequence < self._written:
+                return True
+            try:
+                with open(temp_filename, 'w') as file:
+                    json.dump(data, file)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_filename, self.filename)
+            except OSError as exception:
+                logging.warning('Cannot write snapshot %s: %s', self.filename, exception)
+                try:
+                    os.remove(temp_filename)
+                except OSError:
+                    pass
+                return False
+            self._written = sequence
+        logging.debug('Snapshot written to %s', self.filename)
+        return True
+
+    def load(self):
+        """ Read the snapshot file. Returns a dict with the keys timestamp,
+            state, led and frame (a tuple of mode, size and bytes) or None """
+        try:
+            with open(self.filename) as file:
+                data = json.load(file)
+            if data.get('version') != Snapshot.VERSION:
+                raise ValueError('unsupported version {}'.format(data.get('version')))
+            frame = data.get('frame')
+            return {'timestamp': data['timestamp'],
+                    'state': dict(data['state']),
+                    'led': tuple(data['led']) if data.get('led') else None,
+                    'frame': (frame['mode'], tuple(frame['size']),
+                              base64.b64decode(frame['data'])) if frame else None}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as exception:
+            logging.warning('Cannot read snapshot {}: {} ({})'
+                            .format(self.filename, exception, type(exception).__name__))
+            return None
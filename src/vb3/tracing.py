@@ -0,0 +1,149 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+from time import time
+from .util import metrics
+
+
+class Trace:
+    """ Timestamps of one input event on its way to the screen """
+
+# Stages in the order an input event passes them. A callback that only
+# changes the display goes from input to frame
+    STAGES = ('input', 'emit', 'confirm', 'frame')
+
+    def __init__(self, trace_id, source, timestamp):
+        self.id = trace_id
+        self.source = source
+        self.command = None
+        self.timestamps = {'input': timestamp}
+
+    def mark(self, stage, timestamp=None):
+        self.timestamps[stage] = timestamp or time()
+
+    def durations(self):
+        """ Time (sec) from the previous stage, for each stage that was passed """
+        durations = dict()
+        previous = self.timestamps['input']
+        for stage in Trace.STAGES[1:]:
+            if stage in self.timestamps.keys():
+                durations[stage] = self.timestamps[stage] - previous
+                previous = self.timestamps[stage]
+        return durations
+
+    def as_dict(self):
+        return dict(id=self.id, source=self.source, command=self.command, **self.timestamps)
+
+
+class Tracer:
+    """ Follows input events from a PushButton or RotaryEncoder callback through
+        the VolumioClient command and the pushState that confirms it, to the
+        first display frame after that. Stage latencies go into histograms, and
+        optionally every trace is written to a log file as a line of JSON """
+
+# A trace that isn't confirmed in time is dropped (sec)
+    TIMEOUT = 5
+# Maximum number of traces waiting for a pushState or a frame
+    MAX_PENDING = 32
+
+    def __init__(self, registry=metrics):
+        self._next_id = 1
+        self._current = contextvars.ContextVar('trace', default=None)
+        self._emitted = collections.deque(maxlen=Tracer.MAX_PENDING)
+        self._confirmed = collections.deque(maxlen=Tracer.MAX_PENDING)
+        self._log = None
+        self.stage_time = {stage: registry.histogram(
+            'vbuddy_trace_{}_seconds'.format(stage),
+            'Time from the previous stage of an input event to {}'.format(stage))
+            for stage in Trace.STAGES[1:]}
+        self.total_time = registry.histogram(
+            'vbuddy_trace_total_seconds', 'Time from an input event to the first frame that shows it')
+        self.expired = registry.counter(
+            'vbuddy_trace_expired_total', 'Input events that were not confirmed by a pushState')
+
+    def set_log(self, filename):
+        """ Write the finished traces to a file, or stop writing them with None """
+        if self._log:
+            self._log.close()
+        self._log = open(filename, 'a', buffering=1) if filename else None
+
+    @contextlib.contextmanager
+    def input(self, source, timestamp=None):
+        """ Context for an input callback. Commands sent from the callback belong
+            to the trace """
+        trace = Trace(self._next_id, source, timestamp or time())
+        self._next_id += 1
+        token = self._current.set(trace)
+        try:
+            yield trace
+        finally:
+            self._current.reset(token)
+            if 'emit' not in trace.timestamps.keys():
+                self._confirmed.append(trace)
+
+    def emit(self, command):
+        """ A command was sent to Volumio """
+        trace = self._current.get()
+        if trace is None or 'emit' in trace.timestamps.keys():
+            return
+        trace.command = command
+        trace.mark('emit')
+        # a full deque drops the oldest trace, which then never gets confirmed
+        if len(self._emitted) == self._emitted.maxlen:
+            self.expired.inc()
+        self._emitted.append(trace)
+
+    def confirm(self):
+        """ A pushState arrived, so the commands sent before it are done """
+        if not self._emitted:
+            return
+        now = time()
+        while self._emitted:
+            trace = self._emitted.popleft()
+            if now - trace.timestamps['input'] > Tracer.TIMEOUT:
+                self.expired.inc()
+                continue
+            trace.mark('confirm', now)
+            self._confirmed.append(trace)
+
+    def frame(self):
+        """ A frame was sent to the display """
+        if not self._confirmed:
+            return
+        now = time()
+        while self._confirmed:
+            trace = self._confirmed.popleft()
+            trace.mark('frame', now)
+            self._finish(trace)
+
+    def _finish(self, trace):
+        for stage, duration in trace.durations().items():
+            self.stage_time[stage].observe(duration)
+        self.total_time.observe(trace.timestamps['frame'] - trace.timestamps['input'])
+        if self._log:
+            try:
+                self._log.write(json.dumps(trace.as_dict()) + '\n')
+            except OSError as exception:
+                logging.warning('Cannot write trace log: {}'.format(exception))
+                self._log = None
+
+
+# Tracer that the vb3 classes report to
+tracer = Tracer()
@@ -15,10 +15,17 @@
 
 import argparse
 import asyncio
+import atexit
+import bisect
+import collections
 import functools
 import logging
+import logging.handlers
+import os
+import queue
 import signal
-from .display import Display
+import tempfile
+from time import perf_counter, strftime
 
 
 def argparser():
@@ -27,66 +34,398 @@ def argparser():
     parser.add_argument('-l', '--log', action='store', type=str,
                         choices=['debug', 'info', 'warning', 'error', 'critical'],
                         default='warning')
+    parser.add_argument('-L', '--log-ring', action='store', type=str,
+                        choices=['debug', 'info', 'warning', 'error', 'critical'],
+                        help='level of the last log records kept for a dump (default: --log)')
     parser.add_argument('-p', '--pull', action='store', type=str,
                         choices=['none', 'up', 'down'],
-                        default='none')
+                        help='overrides gpio.pull in the config file')
+    # systemd sets CONFIGURATION_DIRECTORY when the service has a ConfigurationDirectory
+    default_config = os.path.join(os.environ['CONFIGURATION_DIRECTORY'], 'vbuddy.toml') \
+        if 'CONFIGURATION_DIRECTORY' in os.environ.keys() else None
+    parser.add_argument('-c', '--config', action='store', type=str,
+                        default=default_config,
+                        help='TOML config file, reloaded on SIGHUP')
+    default_metrics = os.path.join(os.environ['RUNTIME_DIRECTORY'], 'metrics.sock') \
+        if 'RUNTIME_DIRECTORY' in os.environ.keys() else None
+    parser.add_argument('-m', '--metrics', action='store', type=str,
+                        default=default_metrics,
+                        help='serve metrics on <host>:<port> or a Unix socket path')
+    parser.add_argument('-e', '--event-loop', action='store', type=str,
+                        choices=['asyncio', 'uvloop'],
+                        help='overrides service.event_loop in the config file')
+    parser.add_argument('-T', '--trace-log', action='store', type=str,
+                        help='file to log the latency of every input event in')
+    parser.add_argument('-R', '--record', action='store', type=str,
+                        help='file to record the session in, for a replay')
+    # systemd sets RUNTIME_DIRECTORY (on tmpfs) when the service has a RuntimeDirectory
+    default_history = os.path.join(os.environ['RUNTIME_DIRECTORY'], 'history.bin') \
+        if 'RUNTIME_DIRECTORY' in os.environ.keys() else None
+    parser.add_argument('-H', '--history', action='store', type=str,
+                        default=default_history,
+                        help='file to keep a history of battery and player state in')
+    # the snapshot must survive a reboot, so it goes in the StateDirectory
+    default_snapshot = os.path.join(os.environ['STATE_DIRECTORY'], 'snapshot.json') \
+        if 'STATE_DIRECTORY' in os.environ.keys() else None
+    parser.add_argument('-S', '--snapshot', action='store', type=str,
+                        default=default_snapshot,
+                        help='file to save the last player state and screen in')
     return vars(parser.parse_args())
 
 
-def handle_exception(volumio_client, display, loop, context):
+def handle_exception(main_task, loop, context):
     # context["message"] will always be there; but context["exception"] may not
     msg = context.get("exception", context["message"])
     logging.error(f"Caught exception: {msg}")
+    dump_log()
     logging.info("Shutting down...")
-    asyncio.create_task(shutdown(volumio_client, display, loop))
+    main_task.cancel()
+
+
+def handle_signal(main_task, signal):
+    logging.info(f"Received exit signal {signal.name}...")
+    main_task.cancel()
+
+
+# Default time limit for the whole shutdown (sec)
+SHUTDOWN_TIMEOUT = 2.0
 
 
-async def shutdown(volumio_client, display, loop, signal=None):
-    """Cleanup tasks tied to the service's shutdown."""
-    if signal:
-        logging.info(f"Received exit signal {signal.name}...")
+async def shutdown(volumio_client, display, timeout=SHUTDOWN_TIMEOUT):
+    """ Cleanup tasks tied to the service's shutdown, within <timeout> sec in
+        total: show the shutdown frame once, disconnect from Volumio, cancel the
+        other tasks and clear the display last. The time of each phase is logged """
+    start = perf_counter()
+    deadline = start + timeout
+    phases = []
 
+    def phase_done(name, phase_start):
+        phases.append('{} {:.3f}s'.format(name, perf_counter() - phase_start))
+        return perf_counter()
+
+    phase_start = start
     if display:
-        display.status(Display.STATUS_SHUTDOWN)
+        display.status(display.STATUS_SHUTDOWN)
         display.update()
+        phase_start = phase_done('frame', phase_start)
 
     if volumio_client.is_connected():
         logging.info('Disconnecting websocket connection.')
         try:
-            await volumio_client.disconnect()
+            await asyncio.wait_for(volumio_client.disconnect(),
+                                   max(0, deadline - perf_counter()))
+        except asyncio.TimeoutError:
+            logging.warning('Websocket disconnect timed out.')
         except Exception:
             logging.info('Failed to disconnect websocket.')
-            pass
+        phase_start = phase_done('disconnect', phase_start)
 
     tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
     if tasks:
-        [task.cancel() for task in tasks]
-        logging.info(f"Cancelling {len(tasks)} outstanding tasks")
-        await asyncio.gather(*tasks, return_exceptions=True)
-        if display:
-            await asyncio.sleep(3)
+        for task in tasks:
+            task.cancel()
+        logging.info('Cancelling %d outstanding tasks', len(tasks))
+        _, pending = await asyncio.wait(tasks, timeout=max(0, deadline - perf_counter()))
+        if pending:
+            # Task.get_name() is new in Python 3.8
+            logging.warning('%d tasks did not finish in time: %s', len(pending),
+                            ', '.join(sorted(task.get_name() if hasattr(task, 'get_name') else repr(task)
+                                             for task in pending)))
+        phase_start = phase_done('cancel', phase_start)
 
     if display:
         display.clear()
+        phase_done('clear', phase_start)
+    logging.info('Shutdown took %.3fs (%s)', perf_counter() - start, ', '.join(phases))
 
-    loop.stop()
-
-
-def setup_exception_handling(volumio_client, display, loop):
 
-    signals = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
+def setup_exception_handling(loop, config=None, main_task=None):
+    """ Stop the service nicely after an OS signal or an unhandled exception,
+        by cancelling the main task (by default the task that calls this).
+        The main task runs shutdown() when it is cancelled """
+    main_task = main_task or asyncio.current_task(loop)
+    # SIGHUP reloads the config file, if there is one
+    signals = (signal.SIGTERM, signal.SIGINT) if config and config.filename \
+        else (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
     for s in signals:
-        loop.add_signal_handler(
-            s, lambda s=s: asyncio.create_task(shutdown(volumio_client, display, loop, signal=s)))
+        loop.add_signal_handler(s, handle_signal, main_task, s)
         logging.info(f'Added signal handler for {s.name} signal')
-    exception_handler = functools.partial(handle_exception, volumio_client, display)
+    if config and config.filename:
+        loop.add_signal_handler(signal.SIGHUP, config.reload)
+        logging.info('Added signal handler for SIGHUP signal to reload the config')
+    exception_handler = functools.partial(handle_exception, main_task)
     loop.set_exception_handler(exception_handler)
 
 
-def setup_logging(log_level):
-    log_level_num = getattr(logging, log_level.upper(), None)
-    if not isinstance(log_level_num, int):
-        raise ValueError('Invalid log level: %s' % log_level)
+def setup_event_loop(name):
+    """ Use the uvloop event loop for asyncio.run(), if it is installed.
+        Returns the name of the event loop that is used """
+    if name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            logging.warning('uvloop is not installed, using the asyncio event loop')
+            return 'asyncio'
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        return 'uvloop'
+    asyncio.set_event_loop_policy(None)
+    return 'asyncio'
+
+
+class LogRingBuffer(logging.Handler):
+    """ Keeps the last <capacity> log records in memory, to dump them after a
+        crash or on request """
+
+    CAPACITY = 1000
+
+    def __init__(self, capacity=CAPACITY):
+        super().__init__()
+        self.records = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def dump(self, file):
+        for record in list(self.records):
+            file.write(self.format(record) + '\n')
+
+
+# Recent log records, also below the log level down to INFO
+log_ring = LogRingBuffer()
+
+
+def diagnostics_directory():
+    """ Directory for log dumps and profiles. The LogsDirectory of the service is
+        on disk, so a dump written when the service crashes outlives the restart """
+    for name in ('LOGS_DIRECTORY', 'RUNTIME_DIRECTORY'):
+        if name in os.environ.keys():
+            return os.environ[name]
+    return tempfile.gettempdir()
+
+
+def dump_log(filename=None):
+    """ Write the records in the log ring buffer to a file """
+    if not filename:
+        filename = os.path.join(diagnostics_directory(),
+                                'vbuddy-log-{}.txt'.format(strftime('%Y%m%d-%H%M%S')))
+    try:
+        with open(filename, 'w') as file:
+            log_ring.dump(file)
+    except OSError as exception:
+        logging.error('Cannot dump the log: %s', exception)
+        return None
+    logging.warning('Dumped the last %d log records to %s', len(log_ring.records), filename)
+    return filename
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """ Hands log records to the logging thread. Only the message is merged
+        with its arguments in the calling thread, the logging thread formats
+        the rest """
+
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+_log_listener = None
+
+
+def stop_logging():
+    """ Stop the logging thread, after it has handled the queued records """
+    global _log_listener
+    if _log_listener:
+        _log_listener.stop()
+        _log_listener = None
+
+
+def _log_level(name):
+    level = getattr(logging, name.upper(), None)
+    if not isinstance(level, int):
+        raise ValueError('Invalid log level: %s' % name)
+    return level
+
+
+def setup_logging(log_level, stream=None, ring_level=None):
+    """ Log to stderr (or <stream>) from a separate thread, so a slow SD card
+        or journald doesn't block the event loop. The last records, at
+        <ring_level> (by default <log_level>) or above, are also kept in
+        log_ring. A ring level below the log level makes the event loop format
+        the extra records as well """
+    global _log_listener
+    log_level_num = _log_level(log_level)
+    ring_level_num = log_level_num if ring_level is None else _log_level(ring_level)
     FORMAT = "%(asctime)s - %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s"
-    logging.basicConfig(level=log_level_num, format=FORMAT)
-    logging.info('Logging on {} ({}) level.'.format(log_level.upper(), log_level_num))
+    formatter = logging.Formatter(FORMAT)
+    handler = logging.StreamHandler(stream)
+    handler.setLevel(log_level_num)
+    handler.setFormatter(formatter)
+    log_ring.setLevel(ring_level_num)
+    log_ring.setFormatter(formatter)
+    stop_logging()
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler, log_ring,
+                                              respect_handler_level=True)
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(_QueueHandler(log_queue))
+    root.setLevel(min(log_level_num, ring_level_num))
+    listener.start()
+    _log_listener = listener
+    atexit.unregister(stop_logging)
+    atexit.register(stop_logging)
+    logging.info('Logging on %s (%d) level.', log_level.upper(), log_level_num)
+
+
+class Counter:
+    """ Monotonically increasing metric, e.g. the number of received messages """
+
+    TYPE = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        return ((self.name, self.value),)
+
+
+class Gauge:
+    """ Metric that goes up and down. The value is set, or read from a function
+        when the metrics are collected """
+
+    TYPE = 'gauge'
+
+    def __init__(self, name, help, function=None):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        return ((self.name, self.function() if self.function else self.value),)
+
+
+class Histogram:
+    """ Distribution of durations (sec) in cumulative buckets """
+
+    TYPE = 'histogram'
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield '{}_bucket{{le="{}"}}'.format(self.name, bound), cumulative
+        yield self.name + '_sum', self.sum
+        yield self.name + '_count', self.count
+
+
+class Metrics:
+    """ Registry of the metrics of the service. Updating a metric only changes a
+        number, the text format is rendered when the metrics are scraped """
+
+    def __init__(self):
+        self._metrics = dict()
+
+    def _get(self, cls, name, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args)
+        elif type(metric) is not cls:
+            raise ValueError('Metric {} is a {}'.format(name, metric.TYPE))
+        return metric
+
+    def counter(self, name, help=''):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help='', function=None):
+        gauge = self._get(Gauge, name, help)
+        if function:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, help='', buckets=Histogram.BUCKETS):
+        return self._get(Histogram, name, help, buckets)
+
+    def __getitem__(self, name):
+        return self._metrics[name]
+
+    def render(self):
+        """ The metrics in the Prometheus text format """
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append('# HELP {} {}'.format(name, metric.help))
+            lines.append('# TYPE {} {}'.format(name, metric.TYPE))
+            try:
+                lines += ['{} {}'.format(sample, value) for sample, value in metric.samples()]
+            except Exception as exception:
+                logging.debug('Cannot collect %s: %s', name, exception)
+        return '\n'.join(lines) + '\n'
+
+
+# Registry that the vb3 classes report to
+metrics = Metrics()
+
+
+async def _handle_metrics_request(registry, reader, writer):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)).strip():
+            pass
+        method, path, *_ = request.decode('latin-1').split() + ['', '']
+        if method == 'GET' and path.split('?')[0] in ('/', '/metrics'):
+            status, body = '200 OK', registry.render().encode()
+        else:
+            status, body = '404 Not Found', b'Not found\n'
+        writer.write('HTTP/1.0 {}\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                     'Content-Length: {}\r\nConnection: close\r\n\r\n'
+                     .format(status, len(body)).encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as exception:
+        logging.debug('Metrics request failed: %s', exception)
+    finally:
+        writer.close()
+
+
+async def serve_metrics(address, registry=metrics):
+    """ Asyncio task that serves the metrics over HTTP on <host>:<port>, or on a
+        Unix socket when the address is a path """
+    handler = functools.partial(_handle_metrics_request, registry)
+    try:
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            server = await asyncio.start_server(handler, host or '127.0.0.1', int(port))
+        else:
+            if os.path.exists(address):
+                os.remove(address)
+            server = await asyncio.start_unix_server(handler, address)
+    except (OSError, ValueError) as exception:
+        logging.warning('Cannot serve metrics on {}: {}'.format(address, exception))
+        return
+    logging.info('Serving metrics on {}'.format(address))
+    async with server:
+        await server.serve_forever()
@@ -14,8 +14,25 @@
 # Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import engineio.asyncio_client
 import logging
 import socketio
+from time import perf_counter
+from .session import recorder
+from .tracing import tracer
+from .util import metrics
+
+PUSH_STATES = metrics.counter('vbuddy_volumio_push_states_total', 'pushState messages received')
+COMMANDS = metrics.counter('vbuddy_volumio_commands_total', 'Commands sent to Volumio')
+COMMAND_LATENCY = metrics.histogram('vbuddy_volumio_command_latency_seconds',
+                                    'Time between a command and the next pushState')
+DISCONNECTS = metrics.counter('vbuddy_volumio_disconnects_total',
+                              'Websocket disconnects')
+
+# The engineio client replaces the SIGINT handler of the event loop with one
+# that stops the loop, which breaks asyncio.run(). The service disconnects the
+# client itself when it shuts down
+engineio.asyncio_client.async_signal_handler_set = True
 
 
 class ConnectionError(Exception):
@@ -47,8 +64,10 @@ class VolumioClient:
         self.state = VolumioState()
         self._sio = socketio.AsyncClient()
         self._loop = None
+        self._emits = set()
         self._tries = 0
         self._max_tries = 5
+        self._command_time = None
 
         @self._sio.event
         async def connect():
@@ -66,6 +85,7 @@ class VolumioClient:
 
         @self._sio.event
         async def disconnect():
+            DISCONNECTS.inc()
             if self._display:
                 self._display.status(self._display.STATUS_RECONNECTING)
             logging.info('Volumio websocket disconnected.')
@@ -73,10 +93,21 @@ class VolumioClient:
         @self._sio.event
         async def pushState(*data):
             logging.info('pushState message received')
-            logging.debug('\twith data:\n  {}'.format(data[0]))
-            self.state.update(data[0])
-            if self._pushState_handler and self.state.delta():
-                self._pushState_handler(*self._pushState_handler_args)
+            self.receive_state(data[0])
+
+    def receive_state(self, data):
+        """ Handle the state of a pushState message (from Volumio, or from a
+            session replay) """
+        PUSH_STATES.inc()
+        tracer.confirm()
+        recorder.state(data)
+        if self._command_time is not None:
+            COMMAND_LATENCY.observe(perf_counter() - self._command_time)
+            self._command_time = None
+        logging.debug('\twith data:\n  %s', data)
+        self.state.update(data)
+        if self._pushState_handler and self.state.delta():
+            self._pushState_handler(*self._pushState_handler_args)
 
     def set_pushState_handler(self, handler_function, *handler_args):
         if not callable(handler_function):
@@ -104,21 +135,40 @@ class VolumioClient:
     def is_connected(self):
         return self._sio.connected
 
-    def play(self):
+    def _emit(self, *args):
         if self._sio.connected:
-            asyncio.run_coroutine_threadsafe(self._sio.emit('play'), self._loop)
+            COMMANDS.inc()
+            self._command_time = perf_counter()
+            tracer.emit(args[0])
+            if self._in_loop_thread():
+                # Skip the wakeup of the event loop for callbacks that already
+                # run in it
+                task = self._loop.create_task(self._sio.emit(*args))
+                self._emits.add(task)
+                task.add_done_callback(self._emits.discard)
+            else:
+                asyncio.run_coroutine_threadsafe(self._sio.emit(*args), self._loop)
+
+    def _in_loop_thread(self):
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def play(self):
+        self._emit('play')
 
     def pause(self):
-        if self._sio.connected:
-            asyncio.run_coroutine_threadsafe(self._sio.emit('pause'), self._loop)
+        self._emit('pause')
+
+    def stop(self):
+        self._emit('stop')
 
     def prev(self):
-        if self._sio.connected:
-            asyncio.run_coroutine_threadsafe(self._sio.emit('prev'), self._loop)
+        self._emit('prev')
 
     def next(self):
-        if self._sio.connected:
-            asyncio.run_coroutine_threadsafe(self._sio.emit('next'), self._loop)
+        self._emit('next')
 
     def toggle_play(self):
         if 'status' in self.state.current.keys() and self.state.current['status'] == 'play':
@@ -127,12 +177,10 @@ class VolumioClient:
             return self.play()
 
     def volume_up(self):
-        if self._sio.connected:
-            asyncio.run_coroutine_threadsafe(self._sio.emit('volume', '+'), self._loop)
+        self._emit('volume', '+')
 
     def volume_down(self):
-        if self._sio.connected:
-            asyncio.run_coroutine_threadsafe(self._sio.emit('volume', '-'), self._loop)
+        self._emit('volume', '-')
 
     async def disconnect(self):
         if self._sio.connected:
@@ -175,21 +223,30 @@ class VolumioState():
 
     def __init__(self, state=dict()):
         self.current = dict()
+        self.stale = False
         self.update(state)
         self.previous = self.current
 
+    def restore(self, state):
+        """ Use a saved state until the first live state arrives """
+        self.current = self.sanitize(state)
+        self.previous = self.current
+        self.stale = True
+
     def sanitize(self, in_state):
         out_state = dict()
         for key in self.schema.keys():
             try:
                 out_state[key] = self.schema[key]['transform'](in_state[key])
             except (KeyError, TypeError, ValueError) as exception:
-                logging.debug('{} for key \'{}\', using default'.format(type(exception), key))
+                logging.debug('%s for key \'%s\', using default', type(exception), key)
                 out_state[key] = self.schema[key]['default']
         return out_state
 
     def update(self, state):
-        self.previous = self.current
+        # compare the first live state with the defaults, like after a cold start
+        self.previous = self.sanitize(dict()) if self.stale else self.current
+        self.stale = False
         self.current = self.sanitize(state)
         return self.current
 
@@ -43,3 +43,101 @@ def test_battery_empty_function():
     assert battery.set_empty_function(callback, callback_arg) is None
     with pytest.raises(TypeError):
         battery.set_empty_function(battery, callback_arg)
+
+
+def sampled_battery(voltages, interval=10):
+    battery = vb3.Battery(buffer_size=8)
+    battery._ina = mock.MagicMock()
+    battery._ina.shunt_voltage = 0
+    battery._ina.current = 500
+    with mock.patch('vb3.battery.time') as patched_time:
+        for i, voltage in enumerate(voltages):
+            patched_time.return_value = i*interval
+            battery._ina.bus_voltage = voltage
+            battery.sample()
+    return battery
+
+
+def test_sample_buffer():
+    samples = vb3.battery.SampleBuffer(3)
+    for i in range(5):
+        samples.append(i, i, 0, 0)
+    assert len(samples) == 3
+    assert samples.last('voltage', 5) == [2, 3, 4]
+    assert samples.mean('voltage', 2) == 3.5
+    assert samples.slope('voltage') == 1
+
+
+def test_battery_cached_reads():
+    battery = sampled_battery([20, 19, 18])
+    battery._ina.reset_mock()
+    battery.smoothing = 2
+    assert battery.voltage() == 18.5
+    assert battery.current() == 500
+    assert battery.power() == 9.25
+    assert battery.level() == 61
+    assert battery._ina.mock_calls == []
+
+
+def test_battery_first_read_samples():
+    battery = sampled_battery([])
+    battery._ina.bus_voltage = 20
+    assert battery.voltage() == 20
+    assert len(battery.samples) == 1
+
+
+def test_battery_time_remaining():
+    battery = sampled_battery([20, 19.9, 19.8, 19.7])
+    battery.smoothing = 1
+    assert battery.time_remaining() == pytest.approx((19.7 - 14)/0.01)
+    battery = sampled_battery([19.7, 19.8])
+    assert battery.time_remaining() is None
+
+
+def test_battery_state_transitions():
+    battery = sampled_battery([20])
+    calls = []
+    battery.set_warn_function(calls.append, 'warn')
+    battery.set_empty_function(calls.append, 'empty')
+    battery.set_normal_function(calls.append, 'normal')
+    # a single noisy sample doesn't change the state
+    for voltage in (15.9, 16.5, 13.5, 16.5):
+        assert battery.update_state(voltage) == vb3.Battery.NORMAL
+    for voltage in (15.9, 15.8, 15.9, 15.8, 15.7):
+        battery.update_state(voltage)
+    assert battery.state == vb3.Battery.WARNING
+    assert calls == ['warn']
+    # hysteresis: just above the warning level is not enough to recover
+    for voltage in (16.1, 16.1, 16.1, 16.3, 16.3, 16.3):
+        battery.update_state(voltage)
+    assert calls == ['warn', 'normal']
+    for voltage in (13.9, 13.9, 13.9, 13.9):
+        battery.update_state(voltage)
+    assert battery.state == vb3.Battery.DEPLETED
+    assert calls == ['warn', 'normal', 'empty']
+    with pytest.raises(TypeError):
+        battery.set_normal_function(battery)
+
+
+def test_battery_adaptive_interval():
+    battery = sampled_battery([21, 21, 21])
+    assert battery.next_interval() == battery.max_interval
+    battery = sampled_battery([16.2, 16.2, 16.2])
+    assert battery.next_interval() < battery.max_interval/2
+    battery = sampled_battery([21, 20, 19, 18], interval=10)
+    assert battery.next_interval() < battery.max_interval/2
+    battery = sampled_battery([21, 21, 21])
+    battery._ina.current = 2000
+    battery.sample()
+    assert battery.next_interval() < battery.max_interval
+    battery.update_state(15)
+    assert battery.next_interval() == battery.min_interval
+
+
+def test_battery_history():
+    battery = sampled_battery([])
+    battery.history = mock.MagicMock()
+    battery._ina.bus_voltage = 20
+    battery.sample()
+    battery.history.append.assert_called_once_with(battery.history.BATTERY, 20, 500, 10,
+                                                   vb3.Battery.NORMAL)
@@ -0,0 +1,78 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+from .context import vb3
+
+
+def test_config_defaults():
+    config = vb3.Config()
+    assert config['gpio'] == vb3.Config.DEFAULTS['gpio']
+    assert config['gpio'] is not vb3.Config.DEFAULTS['gpio']
+    assert len(config['popups']) == 5
+
+
+def test_config_missing_file(tmp_path):
+    config = vb3.Config(str(tmp_path / 'vbuddy.toml'))
+    assert config['display'] == vb3.Config.DEFAULTS['display']
+
+
+def test_config_file(tmp_path):
+    filename = tmp_path / 'vbuddy.toml'
+    filename.write_text('[gpio]\npull = "up"\nled_red = 19\n'
+                        '[display]\nupdate_interval = 1\n'
+                        '[[popups]]\nlabel = "ip: {}"\nvalues = ["network.ip"]\n')
+    config = vb3.Config(str(filename))
+    assert config['gpio']['pull'] == 'up'
+    assert config['gpio']['led_red'] == 19
+    assert config['gpio']['led_green'] == 12
+    assert config['display']['update_interval'] == 1.0
+    assert config['popups'] == [{'label': 'ip: {}', 'values': ['network.ip']}]
+
+
+def test_config_invalid(tmp_path):
+    filename = tmp_path / 'vbuddy.toml'
+    filename.write_text('[gpio]\nled_red = "13"\n')
+    with pytest.raises(vb3.config.InvalidConfig):
+        vb3.Config(str(filename)).load()
+    assert vb3.Config(str(filename))['gpio']['led_red'] == 13
+    filename.write_text('[gpio\n')
+    with pytest.raises(vb3.config.InvalidConfig):
+        vb3.Config(str(filename)).load()
+
+
+def test_config_reload(tmp_path):
+    filename = tmp_path / 'vbuddy.toml'
+    filename.write_text('[gpio]\nled_red = 19\n')
+    config = vb3.Config(str(filename))
+    reloaded = []
+    config.set_reload_function('gpio', reloaded.append, 'gpio')
+    config.set_reload_function('display', reloaded.append, 'display')
+    filename.write_text('[gpio]\nled_red = 20\n[volumio]\nport = 3001\n')
+    assert config.reload() == ['gpio', 'volumio']
+    assert reloaded == ['gpio']
+    assert config.previous['gpio']['led_red'] == 19
+    assert config['gpio']['led_red'] == 20
+    filename.write_text('[gpio]\nled_red = true\n')
+    assert config.reload() == []
+    assert config['gpio']['led_red'] == 20
+
+
+def test_config_reload_function():
+    config = vb3.Config()
+    with pytest.raises(ValueError):
+        config.set_reload_function('unknown', print)
+    with pytest.raises(TypeError):
+        config.set_reload_function('gpio', 'print')
@@ -0,0 +1,98 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import socket
+import time
+import pytest
+from .context import vb3
+
+
+@pytest.fixture
+def notify_socket(tmp_path, monkeypatch):
+    address = str(tmp_path / 'notify')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(address)
+    sock.setblocking(False)
+    monkeypatch.setenv('NOTIFY_SOCKET', address)
+    yield sock
+    sock.close()
+
+
+def received(sock):
+    messages = []
+    while True:
+        try:
+            messages.append(sock.recv(64).decode())
+        except BlockingIOError:
+            return messages
+
+
+def test_sd_notify(notify_socket, monkeypatch):
+    assert vb3.diagnostics.sd_notify('READY=1') is True
+    assert received(notify_socket) == ['READY=1']
+    monkeypatch.delenv('NOTIFY_SOCKET')
+    assert vb3.diagnostics.sd_notify('READY=1') is False
+
+
+def test_watchdog_interval(monkeypatch):
+    monkeypatch.delenv('WATCHDOG_USEC', raising=False)
+    assert vb3.diagnostics.watchdog_interval() is None
+    monkeypatch.setenv('WATCHDOG_USEC', '30000000')
+    assert vb3.diagnostics.watchdog_interval() == 15
+    monkeypatch.setenv('WATCHDOG_PID', str(os.getpid() + 1))
+    assert vb3.diagnostics.watchdog_interval() is None
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_loop_monitor(notify_socket, monkeypatch):
+    monkeypatch.setenv('WATCHDOG_USEC', '20000')
+    monkeypatch.delenv('WATCHDOG_PID', raising=False)
+    stalls = vb3.metrics['vbuddy_loop_stalls_total'].value
+    monitor = vb3.LoopMonitor(interval=0.005, stall_time=0.05)
+    task = asyncio.create_task(monitor.monitor())
+    await asyncio.sleep(0.05)
+    assert received(notify_socket)[:2] == ['READY=1', 'WATCHDOG=1']
+    # a blocking call stalls the loop, so there is no ping for it
+    time.sleep(0.1)
+    await asyncio.sleep(0.001)
+    assert monitor.max_lag >= 0.05
+    assert vb3.metrics['vbuddy_loop_stalls_total'].value == stalls + 1
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_dump_stacks():
+    async def sleeper():
+        await asyncio.sleep(1)
+    task = asyncio.create_task(sleeper(), name='sleeper')
+    await asyncio.sleep(0)
+    dump = vb3.diagnostics.dump_stacks(asyncio.get_running_loop())
+    assert 'sleeper' in dump
+    assert 'MainThread' in dump
+    task.cancel()
+
+
+def test_profiler(tmp_path):
+    profiler = vb3.diagnostics.Profiler(str(tmp_path))
+    profiler.toggle()
+    assert profiler.running()
+    data = [bytearray(1000) for _ in range(100)]
+    filename = profiler.toggle()
+    assert not profiler.running() and data
+    assert os.path.exists(filename)
+    assert os.path.getsize(filename.replace('.prof', '.txt')) > 0
@@ -13,6 +13,8 @@
 # You should have received a copy of the GNU General Public License along with
 # Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
 
+import gc
+import tracemalloc
 import unittest.mock as mock
 import pytest
 
@@ -39,27 +41,87 @@ def arg_func_5():
     return [1, 2, 3, 4, 5]
 
 
-@mock.patch('adafruit_ssd1306.SSD1306_I2C')
+@mock.patch('adafruit_bus_device.i2c_device.I2CDevice')
 @mock.patch('busio.I2C')
-def test_display(mock_i2c, mock_ssd1306):
-    mock_ssd1306().width = 128
-    mock_ssd1306().height = 64
+def test_display(mock_i2c, mock_device):
     display = vb3.Display()
     assert mock_i2c.called_once()
-    assert mock_ssd1306.called_once()
+    mock_device.assert_called_once_with(mock_i2c(), 0x3c)
+    assert isinstance(display._display, vb3.panel.SSD1306)
     assert display.width == 128
     assert display.height == 64
 
 
-@mock.patch('adafruit_ssd1306.SSD1306_I2C')
+@mock.patch('adafruit_bus_device.i2c_device.I2CDevice')
 @mock.patch('busio.I2C')
-def test_display_show(mock_i2c, mock_ssd1306):
-    mock_ssd1306().width = 128
-    mock_ssd1306().height = 64
+def test_display_show(mock_i2c, mock_device):
     display = vb3.Display()
+    mock_device().write.reset_mock()
     display.show(display._image)
-    assert display._display.image.called_once()
-    assert display._display.show.called_once()
+    assert mock_device().write.call_args[0][0] == b'\x40' + display._display.buffer
+
+
+@mock.patch('adafruit_bus_device.i2c_device.I2CDevice')
+@mock.patch('busio.I2C')
+def test_display_restore(mock_i2c, mock_device):
+    display = vb3.Display()
+    frame = vb3.display.Image.new('1', (128, 64), 1)
+    assert display.restore(frame.mode, frame.size, frame.tobytes()) is True
+    display.update()
+    assert display._image.getpixel((0, 63)) == 255
+    assert display.frame() is None
+    assert display.restore('1', (64, 32), b'') is False
+    display.update_main_screen('artist - album - title', 100, 10)
+    display.status(display.STATUS_PLAY)
+    display.update()
+    assert display.frame().size == (128, 64)
+    assert display._restored is None
+
+
+class Panel:
+    """ Stand-in for the SSD1306 driver that doesn't record its calls """
+
+    def image(self, image):
+        pass
+
+    def show(self):
+        pass
+
+
+@mock.patch('busio.I2C')
+def test_display_steady_state_allocations(mock_i2c):
+    display = vb3.Display()
+    display._display = Panel()
+    display.update_main_screen('a long artist - album - title that scrolls over the screen',
+                               240, 10)
+    display.status(display.STATUS_PLAY)
+    display.volume(50)
+    for _ in range(200):
+        display.update()
+    # no images are created or copied once the labels are rendered
+    with mock.patch.object(vb3.display.Image, 'new', wraps=vb3.display.Image.new) as new, \
+            mock.patch.object(vb3.display.Image.Image, 'copy') as copy, \
+            mock.patch.object(vb3.display.Image.Image, 'crop') as crop:
+        for _ in range(20):
+            display.update()
+        display.volume(60)
+        display.update()
+    assert not new.called and not copy.called and not crop.called
+    # and the frames don't keep anything allocated
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(100):
+            display.update()
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'filename')
+    # the frame and metrics counters can replace a few ints
+    assert sum(stat.size_diff for stat in stats) < 1024
 
 
 @mock.patch('busio.I2C')
@@ -13,6 +13,9 @@
 # You should have received a copy of the GNU General Public License along with
 # Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import threading
+import time
 import unittest.mock as mock
 import pytest
 from .context import vb3
@@ -77,3 +80,215 @@ def test_led(patched_pwm, patched_setup):
 def test_clean_up(patched_cleanup):
     vb3.gpio.cleanup()
     assert patched_cleanup.called_once()
+
+
+# Recorded edge traces: (timestamp, state of the A and B switches)
+TRACE_RIGHT_SLOW = [(0.000, 0b10), (0.010, 0b00), (0.020, 0b01), (0.030, 0b11),
+                    (0.200, 0b10), (0.210, 0b00), (0.220, 0b01), (0.230, 0b11)]
+TRACE_LEFT_BOUNCING = [(0.000, 0b01), (0.001, 0b11), (0.002, 0b01), (0.010, 0b00),
+                       (0.020, 0b10), (0.021, 0b00), (0.022, 0b10), (0.030, 0b11)]
+TRACE_RIGHT_MISSED_EDGE = [(0.000, 0b10), (0.010, 0b01), (0.020, 0b11)]
+TRACE_RIGHT_FAST = [(0.000 + i*0.012, state) for i, state in
+                    enumerate([0b10, 0b00, 0b01, 0b11]*4)]
+
+
+def replay(encoder, trace):
+    turns = []
+    encoder.set_callback(lambda: turns.append((encoder.direction, encoder.steps)))
+    for timestamp, state in trace:
+        encoder._transition(state, 10 + timestamp)
+    return turns
+
+
+def test_rotary_encoder_replay_right():
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, pull=pull)
+    assert replay(encoder, TRACE_RIGHT_SLOW) == [(vb3.RotaryEncoder.RIGHT, 1)]*2
+
+
+def test_rotary_encoder_replay_bouncing():
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, pull=pull)
+    assert replay(encoder, TRACE_LEFT_BOUNCING) == [(vb3.RotaryEncoder.LEFT, 1)]
+
+
+def test_rotary_encoder_replay_missed_edge():
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, pull=pull)
+    assert replay(encoder, TRACE_RIGHT_MISSED_EDGE) == [(vb3.RotaryEncoder.RIGHT, 1)]
+
+
+def test_rotary_encoder_replay_minimum_delay():
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, minimum_delay=0.5, pull=pull)
+    assert len(replay(encoder, TRACE_RIGHT_SLOW)) == 1
+
+
+def test_rotary_encoder_replay_acceleration():
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, pull=pull, acceleration=True)
+    assert replay(encoder, TRACE_RIGHT_FAST) == [(vb3.RotaryEncoder.RIGHT, 1)] + \
+        [(vb3.RotaryEncoder.RIGHT, 2)]*3
+
+
+def test_rotary_encoder_steps_per_detent():
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, pull=pull, steps_per_detent=1)
+    assert len(replay(encoder, TRACE_RIGHT_SLOW)) == 8
+    with pytest.raises(ValueError):
+        vb3.RotaryEncoder(pin_a, pin_b, pull=pull, steps_per_detent=3)
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_input_events():
+    edges = vb3.metrics['vbuddy_input_edges_total'].value
+    detents = vb3.metrics['vbuddy_rotary_detents_total'].value
+    events = vb3.InputEvents()
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, pull=pull, events=events)
+    turns = []
+    encoder.set_callback(lambda: turns.append(encoder.direction))
+    task = asyncio.create_task(events.dispatcher())
+    await asyncio.sleep(0)
+    with mock.patch('RPi.GPIO.input') as patched_input:
+        for channel, level in ((pin_a, 1), (pin_b, 0), (pin_a, 0), (pin_b, 1), (pin_a, 1)):
+            patched_input.return_value = level
+            thread = threading.Thread(target=events.edge, args=(channel,))
+            thread.start()
+            thread.join()
+    await asyncio.sleep(0.01)
+    task.cancel()
+    assert turns == [vb3.RotaryEncoder.RIGHT]
+    assert events.events == 5
+    assert events.queue_depth() == 0
+    assert events.max_queue_depth >= 1
+    assert 0 <= events.latency() <= events.latency_max
+    assert vb3.metrics['vbuddy_input_edges_total'].value == edges + 5
+    assert vb3.metrics['vbuddy_rotary_detents_total'].value == detents + 1
+
+
+def test_input_events_without_dispatcher():
+    events = vb3.InputEvents()
+    events.edge(pin)
+    assert events.dropped == 1
+    with pytest.raises(TypeError):
+        events.add_handler(pin, None)
+
+
+def gesture_button(*gestures):
+    button = vb3.PushButton(pin, events=vb3.InputEvents(), active_low=False)
+    button.debounce_time = 0.005
+    button.double_click_time = 0.05
+    button.long_press_time = 0.1
+    button.repeat_interval = 0.03
+    fired = []
+    for gesture in gestures:
+        button.set_gesture_callback(gesture, fired.append, gesture)
+    return button, fired
+
+
+async def edges(button, trace):
+    """ Feed (delay, level) edges to the button """
+    for delay, level in trace:
+        await asyncio.sleep(delay)
+        button._handle_edge(pin, level, time.time())
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_pushbutton_click():
+    button, fired = gesture_button(vb3.PushButton.PRESS, vb3.PushButton.RELEASE,
+                                   vb3.PushButton.CLICK)
+    # bouncing press
+    await edges(button, [(0, 1), (0.001, 0), (0.001, 1), (0.02, 0), (0.02, 0)])
+    assert fired == [vb3.PushButton.PRESS, vb3.PushButton.RELEASE, vb3.PushButton.CLICK]
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_pushbutton_double_click():
+    button, fired = gesture_button(vb3.PushButton.CLICK, vb3.PushButton.DOUBLE_CLICK)
+    await edges(button, [(0, 1), (0.01, 0), (0.02, 1), (0.01, 0), (0.1, 0)])
+    assert fired == [vb3.PushButton.DOUBLE_CLICK]
+    await edges(button, [(0, 1), (0.01, 0), (0.1, 0)])
+    assert fired == [vb3.PushButton.DOUBLE_CLICK, vb3.PushButton.CLICK]
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_pushbutton_long_press_and_repeat():
+    button, fired = gesture_button(vb3.PushButton.CLICK, vb3.PushButton.LONG_PRESS,
+                                   vb3.PushButton.REPEAT)
+    await edges(button, [(0, 1), (0.2, 0), (0.02, 0)])
+    assert fired[0] == vb3.PushButton.LONG_PRESS
+    assert fired.count(vb3.PushButton.REPEAT) >= 1
+    assert vb3.PushButton.CLICK not in fired
+    button.off()
+
+
+def test_pushbutton_gesture_callback_exceptions():
+    button = vb3.PushButton(pin)
+    with pytest.raises(ValueError):
+        button.set_gesture_callback(vb3.PushButton.CLICK, callback, callback_arg)
+    button = vb3.PushButton(pin, events=vb3.InputEvents())
+    with pytest.raises(ValueError):
+        button.set_gesture_callback(-1, callback, callback_arg)
+    with pytest.raises(TypeError):
+        button.set_gesture_callback(vb3.PushButton.CLICK, button)
+
+
+def pwm_led(gamma=None):
+    with mock.patch('RPi.GPIO.PWM') as patched_pwm:
+        patched_pwm.side_effect = lambda pin, freq: mock.MagicMock()
+        return vb3.RGBLED(led_pin_r, led_pin_g, led_pin_b, gamma=gamma)
+
+
+def test_led_redundant_writes():
+    led = pwm_led()
+    led.set(vb3.RGBLED.DIM_RED)
+    led.set(vb3.RGBLED.DIM_RED)
+    led.set(vb3.RGBLED.DIM_GREEN)
+    assert [pwm.start.call_count for pwm in led.pwm] == [1, 1, 1]
+    assert led.pwm[0].ChangeDutyCycle.call_args_list == [mock.call(0)]
+    assert led.pwm[1].ChangeDutyCycle.call_args_list == [mock.call(10)]
+    assert not led.pwm[2].ChangeDutyCycle.called
+
+
+def test_led_out_of_range():
+    led = pwm_led()
+    for values in ((101, 0, 0), (-1, 0, 0), ('1', 0, 0), (1, 0)):
+        with pytest.raises(vb3.gpio.RGBValueOutOfRange):
+            led.set(values)
+    led.set((12.5, 0, 100))
+
+
+def test_led_gamma():
+    led = pwm_led(gamma=2)
+    led.set((50, 0, 100))
+    assert [pwm.start.call_args for pwm in led.pwm] == \
+        [mock.call(25), mock.call(0), mock.call(100)]
+
+
+def test_led_default_gamma():
+    led = pwm_led()
+    led.set(vb3.RGBLED.BRIGHT_RED)
+    led.set((50, 0, 0))
+    assert [args[0][0] for args in led.pwm[0].ChangeDutyCycle.call_args_list] == [21.8]
+    assert led.pwm[0].start.call_args == mock.call(25)
+
+
+def test_led_fade_without_animator():
+    led = pwm_led()
+    led.fade(vb3.RGBLED.DIM_GREEN)
+    assert led.values == vb3.RGBLED.DIM_GREEN
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_led_animator():
+    led = pwm_led()
+    led.set((0, 0, 0))
+    task = asyncio.create_task(led.animator(frame_rate=100))
+    await asyncio.sleep(0)
+    led.fade((100, 0, 0), duration=0.1)
+    await asyncio.sleep(0.2)
+    assert led.values == (100, 0, 0)
+    # the frame rate bounds the number of updates
+    assert 2 <= led.pwm[0].ChangeDutyCycle.call_count <= 12
+    assert not led.pwm[1].ChangeDutyCycle.called
+    led.breathe(vb3.RGBLED.DIM_BLUE, period=0.1)
+    await asyncio.sleep(0.05)
+    assert led.pwm[2].ChangeDutyCycle.called
+    led.set(vb3.RGBLED.DIM_RED)
+    await asyncio.sleep(0.02)
+    assert led.values == vb3.RGBLED.DIM_RED
+    task.cancel()
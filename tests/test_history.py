@@ -0,0 +1,83 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+from .context import vb3
+
+
+def test_history(tmp_path):
+    filename = str(tmp_path / 'history.bin')
+    history = vb3.History(filename, capacity=4)
+    for i in range(3):
+        history.append(vb3.History.BATTERY, 20 - i, 500, 10)
+    history.append(vb3.History.CLIENT, 1, 50)
+    assert [record.values[0] for record in history.records(vb3.History.BATTERY)] == [20, 19, 18]
+    assert history.records(vb3.History.CLIENT)[0].values == (1, 50, 0, 0)
+    history.close()
+
+
+def test_history_wraps_and_reopens(tmp_path):
+    filename = str(tmp_path / 'history.bin')
+    history = vb3.History(filename, capacity=4)
+    for i in range(6):
+        history.append(vb3.History.BATTERY, i)
+    history.close()
+    history = vb3.History(filename, capacity=4)
+    history.append(vb3.History.BATTERY, 6)
+    history.close()
+    records = vb3.History.read(filename)
+    assert [record.values[0] for record in records] == [3, 4, 5, 6]
+    assert [record.seq for record in records] == [4, 5, 6, 7]
+
+
+def test_history_torn_record(tmp_path):
+    filename = str(tmp_path / 'history.bin')
+    history = vb3.History(filename, capacity=4)
+    for i in range(3):
+        history.append(vb3.History.BATTERY, i)
+    history.close()
+    with open(filename, 'r+b') as file:
+        file.seek(vb3.History.HEADER_SIZE + vb3.History.RECORD_SIZE + 12)
+        file.write(b'\xff')
+    assert [record.values[0] for record in vb3.History.read(filename)] == [0, 2]
+
+
+def test_history_capacity_change(tmp_path):
+    filename = str(tmp_path / 'history.bin')
+    history = vb3.History(filename, capacity=4)
+    history.append(vb3.History.BATTERY, 1)
+    history.close()
+    history = vb3.History(filename, capacity=8)
+    assert history.records() == []
+    history.close()
+
+
+def test_history_invalid_file(tmp_path):
+    filename = tmp_path / 'history.bin'
+    filename.write_bytes(b'no history')
+    with pytest.raises(vb3.history.InvalidHistoryFile):
+        vb3.History.read(str(filename))
+
+
+def test_history_export(tmp_path, capsys):
+    filename = str(tmp_path / 'history.bin')
+    history = vb3.History(filename, capacity=4)
+    history.append(vb3.History.BATTERY, 20.5, 500, 10, 0)
+    history.close()
+    vb3.history.main([filename, '--channel', 'battery'])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'seq,timestamp,voltage,current,power,state'
+    assert lines[1].startswith('1,')
+    assert lines[1].endswith(',20.5,500,10,0')
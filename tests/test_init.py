@@ -0,0 +1,47 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import sys
+import pytest
+from .context import vb3
+
+src = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+heavy_modules = ('PIL', 'socketio', 'RPi', 'board', 'busio', 'adafruit_ina219',
+                 'adafruit_bus_device')
+
+
+def imported_modules(statement):
+    """ The heavy modules that are loaded after running a statement in a new interpreter """
+    code = 'import sys; sys.path.insert(0, {!r}); {}; print(" ".join(m for m in {!r} if m in sys.modules))' \
+        .format(src, statement, heavy_modules)
+    return subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout.split()
+
+
+def test_lazy_import():
+    assert imported_modules('import vb3') == []
+
+
+def test_lazy_import_util():
+    assert imported_modules('import vb3; vb3.argparser; vb3.setup_logging') == []
+
+
+def test_lazy_attributes():
+    assert vb3.PushButton is vb3.gpio.PushButton
+    assert 'VolumioClient' in dir(vb3)
+    with pytest.raises(AttributeError):
+        vb3.DoesNotExist
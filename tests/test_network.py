@@ -0,0 +1,186 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import unittest.mock as mock
+import pytest
+from .context import vb3
+
+fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+route_file = os.path.join(fixtures, 'proc_net_route')
+
+
+def test_default_interface():
+    assert vb3.network.default_interface(route_file) == 'wlan0'
+    assert vb3.network.default_interface(os.path.join(fixtures, 'missing')) is None
+
+
+def test_interface_addresses():
+    addresses = vb3.network.interface_addresses()
+    assert 'lo' not in addresses.keys()
+
+
+@mock.patch('vb3.network.interface_addresses')
+def test_network_my_ip(patched_addresses):
+    patched_addresses.return_value = {'eth0': '10.0.0.2', 'wlan0': '192.168.1.2'}
+    network = vb3.Network(route_file=route_file)
+    assert network.my_ip() == '192.168.1.2'
+    assert network.ip('eth0') == '10.0.0.2'
+    assert network.addresses() == patched_addresses.return_value
+    patched_addresses.return_value = {'eth0': '10.0.0.2'}
+    network.refresh()
+    assert network.my_ip() == '10.0.0.2'
+    patched_addresses.reset_mock()
+    # lookups come from the cache
+    network.my_ip()
+    assert not patched_addresses.called
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_network_watch():
+    network = vb3.Network(route_file=route_file)
+    with mock.patch.object(network, 'refresh') as patched_refresh:
+        task = asyncio.create_task(network.watch())
+        await asyncio.sleep(0.01)
+        assert not task.done()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert not patched_refresh.called
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_network_watch_polling():
+    network = vb3.Network(route_file=route_file)
+    network.poll_interval = 0.01
+    with mock.patch.object(network, 'refresh') as patched_refresh, \
+            mock.patch('socket.socket', side_effect=OSError('no netlink')):
+        task = asyncio.create_task(network.watch())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    assert patched_refresh.called
+
+
+def test_parse_wpa_supplicant():
+    with open(os.path.join(fixtures, 'wpa_supplicant.conf')) as file:
+        config, networks = vb3.network.parse_wpa_supplicant(file)
+    assert config['country'] == 'NL'
+    assert config['ctrl_interface'] == 'DIR=/var/run/wpa_supplicant GROUP=netdev'
+    assert [network['ssid'] for network in networks] == ['home', 'phone']
+    assert networks[0]['psk'] == 'secret=1'
+
+
+def test_network_config_files():
+    network = vb3.Network(route_file=route_file,
+                          hostapd_file=os.path.join(fixtures, 'hostapd.tmpl'),
+                          wpa_supplicant_file=os.path.join(fixtures, 'wpa_supplicant.conf'))
+    assert network.hotspot_ssid() == 'Volumio'
+    assert network.hotspot_passphrase() == 'volumio2'
+    assert network.ssid() == 'phone'
+    assert network.wpa_supplicant['psk'] == 'also secret'
+    assert len(network.networks()) == 2
+
+
+def test_network_missing_config_files():
+    network = vb3.Network(route_file=route_file,
+                          hostapd_file=os.path.join(fixtures, 'missing'),
+                          wpa_supplicant_file=os.path.join(fixtures, 'missing'))
+    assert network.hostapd == {'ssid': 'unknown', 'wpa_passphrase': 'unknown'}
+    assert network.ssid() == 'unknown'
+
+
+def test_config_file_lazy_and_stat(tmp_path):
+    filename = tmp_path / 'hostapd.conf'
+    filename.write_text('ssid=one\n')
+    parser = mock.Mock(side_effect=vb3.network.parse_hostapd)
+    config_file = vb3.network.ConfigFile(str(filename), parser, stat_interval=0)
+    assert not parser.called
+    assert config_file.get()['ssid'] == 'one'
+    assert config_file.get()['ssid'] == 'one'
+    assert parser.call_count == 1
+    filename.write_text('ssid=two\n')
+    os.utime(filename, ns=(0, 1))
+    assert config_file.get()['ssid'] == 'two'
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_network_watch_config_files(tmp_path):
+    filename = tmp_path / 'hostapd.tmpl'
+    filename.write_text('ssid=one\n')
+    network = vb3.Network(route_file=route_file, hostapd_file=str(filename),
+                          wpa_supplicant_file=str(tmp_path / 'wpa_supplicant.conf'))
+    task = asyncio.create_task(network.watch())
+    await asyncio.sleep(0.01)
+    assert network._hostapd.watched
+    assert network.hotspot_ssid() == 'one'
+    # replace the file like an editor does
+    (tmp_path / 'hostapd.tmp').write_text('ssid=two\n')
+    os.replace(tmp_path / 'hostapd.tmp', filename)
+    await asyncio.sleep(0.01)
+    assert network.hotspot_ssid() == 'two'
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert not network._hostapd.watched
+
+
+def link_stats(tmp_path):
+    wireless_file = tmp_path / 'wireless'
+    dev_file = tmp_path / 'dev'
+    with open(os.path.join(fixtures, 'proc_net_wireless')) as file:
+        wireless_file.write_text(file.read())
+    with open(os.path.join(fixtures, 'proc_net_dev')) as file:
+        dev_file.write_text(file.read())
+    return vb3.network.LinkStats(None, str(wireless_file), str(dev_file)), dev_file
+
+
+def test_link_stats(tmp_path):
+    stats, dev_file = link_stats(tmp_path)
+    stats.sample(timestamp=10)
+    assert stats.interface == 'wlan0'
+    assert stats.level == -54
+    assert stats.quality() == 80
+    assert stats.rx_rate == 0
+    dev_file.write_text(dev_file.read_text().replace('1000000', '1100000')
+                        .replace('200000', '204000'))
+    stats.sample(timestamp=12)
+    assert stats.rx_rate == 50000
+    assert stats.tx_rate == 2000
+    stats.close()
+
+
+def test_link_stats_missing_files(tmp_path):
+    stats = vb3.network.LinkStats('wlan0', str(tmp_path / 'missing'), str(tmp_path / 'missing'))
+    stats.sample()
+    assert stats.quality() is None
+    assert stats.rx_rate == 0
+
+
+def test_network_link_popup(tmp_path):
+    network = vb3.Network(route_file=route_file)
+    network.link_stats, dev_file = link_stats(tmp_path)
+    popup = vb3.Popup(('wifi: {}', '{}'), network.signal, network.throughput)
+    assert popup.label() == ('wifi: n/a', 'rx 0B/s tx 0B/s')
+    network.link_stats.sample(timestamp=10)
+    dev_file.write_text(dev_file.read_text().replace('1000000', '3500000'))
+    network.link_stats.sample(timestamp=11)
+    assert popup.label() == ('wifi: -54dBm 80%', 'rx 2.5M/s tx 0B/s')
+    assert network.link_quality() == '80%'
+
+
+def test_format_rate():
+    assert vb3.network.format_rate(999) == '999B'
+    assert vb3.network.format_rate(1500) == '1.5k'
+    assert vb3.network.format_rate(2500000) == '2.5M'
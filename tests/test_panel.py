@@ -0,0 +1,175 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import pytest
+
+from .context import vb3
+
+Image = vb3.display.Image
+
+
+class FakeBus:
+    """ Records the transfers to the display controller """
+
+    def __init__(self):
+        self.transfers = []
+
+    def command(self, data):
+        self.transfers.append(('command', bytes(data)))
+
+    def data(self, data):
+        self.transfers.append(('data', bytes(data)))
+
+    def frame(self):
+        """ The display data sent since the last call """
+        data = b''.join(data for kind, data in self.transfers if kind == 'data')
+        self.transfers = []
+        return data
+
+
+def random_image(mode, size):
+    random.seed(size[0]*size[1])
+    image = Image.new(mode, size)
+    image.putdata([random.choice((0, 255)) if mode == '1' else random.randrange(256)
+                   for i in range(size[0]*size[1])])
+    return image
+
+
+def pages(image):
+    """ Page packing, pixel by pixel """
+    width, height = image.size
+    pixels = image.load()
+    return bytes(sum(1 << bit for bit in range(8) if pixels[x, 8*page + bit])
+                 for page in range(height // 8) for x in range(width))
+
+
+def nibbles(image):
+    """ Grayscale packing, pixel by pixel """
+    width, height = image.size
+    pixels = image.load()
+    return bytes((pixels[x, y] >> 4) << 4 | pixels[x + 1, y] >> 4
+                 for y in range(height) for x in range(0, width, 2))
+
+
+@pytest.mark.parametrize('size', [(128, 64), (128, 32)])
+def test_pack_pages(size):
+    image = random_image('1', size)
+    assert vb3.panel.pack_pages(image) == pages(image)
+
+
+def test_pack_nibbles():
+    image = random_image('L', (256, 64))
+    assert vb3.panel.pack_nibbles(image) == nibbles(image)
+    assert vb3.panel.pack_nibbles(Image.new('1', (4, 1), 1)) == b'\xff\xff'
+
+
+def test_ssd1306():
+    bus = FakeBus()
+    panel = vb3.panel.SSD1306(bus)
+    assert ('command', b'\xa8\x3f') in bus.transfers
+    assert bus.frame() == b''
+    image = random_image('1', (128, 64))
+    panel.image(image)
+    panel.show()
+    assert bus.transfers[:2] == [('command', b'\x21\x00\x7f'), ('command', b'\x22\x00\x07')]
+    assert bus.frame() == pages(image)
+
+
+def test_ssd1306_128x32():
+    bus = FakeBus()
+    panel = vb3.panel.SSD1306_128x32(bus)
+    assert ('command', b'\xa8\x1f') in bus.transfers
+    assert ('command', b'\xda\x02') in bus.transfers
+    assert ('command', b'\xa8\x3f') not in bus.transfers
+    bus.frame()
+    image = random_image('1', (128, 32))
+    panel.image(image)
+    panel.show()
+    assert ('command', b'\x22\x00\x03') in bus.transfers
+    assert bus.frame() == pages(image)
+
+
+def test_sh1106():
+    bus = FakeBus()
+    panel = vb3.panel.SH1106(bus)
+    bus.frame()
+    image = random_image('1', (128, 64))
+    panel.image(image)
+    panel.show()
+    assert bus.transfers[0] == ('command', b'\xb0\x02\x10')
+    assert bus.transfers[-2] == ('command', b'\xb7\x02\x10')
+    assert [len(data) for kind, data in bus.transfers if kind == 'data'] == [128]*8
+    assert bus.frame() == pages(image)
+
+
+def test_ssd1322():
+    bus = FakeBus()
+    panel = vb3.panel.SSD1322(bus)
+# Command parameters are sent as data
+    assert bus.transfers[:2] == [('command', b'\xfd'), ('data', b'\x12')]
+    bus.frame()
+    image = random_image('L', (256, 64))
+    panel.image(image)
+    panel.show()
+    assert bus.transfers[:2] == [('command', b'\x15'), ('data', bytes((28, 91)))]
+    assert bus.transfers[-2] == ('command', b'\x5c')
+    assert bus.frame()[-8192:] == nibbles(image)
+
+
+def test_panel_image_size():
+    panel = vb3.panel.SSD1306(FakeBus())
+    with pytest.raises(ValueError):
+        panel.image(Image.new('1', (128, 32)))
+
+
+def test_panel_is_abstract():
+    with pytest.raises(TypeError):
+        vb3.panel.Panel(FakeBus())
+
+
+def test_create_panel():
+    with pytest.raises(ValueError):
+        vb3.create_panel('ssd1309')
+
+
+@pytest.mark.parametrize('driver', vb3.panel.PANELS.keys())
+def test_display_on_panel(driver):
+    bus = FakeBus()
+    panel = vb3.panel.PANELS[driver](bus)
+    display = vb3.Display(panel=panel)
+    display.update_main_screen('artist - album - title', 200, 100)
+    display.status(display.STATUS_PAUSE)
+    display._modal_timeout = 0
+    bus.frame()
+    display.update()
+    frame = display.frame()
+    assert frame.size == (panel.width, panel.height)
+    assert panel.buffer == panel.pack(frame)
+    assert bus.frame().endswith(panel.buffer)
+# The label, the time and the progress bar don't overlap
+    label_y, time_y, bar_height = display.main_screen_layout()
+    rows = [frame.crop((0, y, panel.width, y + 1)).getbbox() is not None
+            for y in range(panel.height)]
+    bar = panel.height - 1 - bar_height
+    assert rows[bar:] == [True]*(bar_height + 1)
+    assert not rows[bar - 1]
+    top = display._font.getbbox('0:00')[1]
+    assert rows[time_y + top] and not rows[time_y + top - 1]
+# A volume modal fits on the screen
+    display.volume(50)
+    display.update()
+    assert panel.buffer != panel.pack(frame)
+    assert bus.frame().endswith(panel.buffer)
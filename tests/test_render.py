@@ -0,0 +1,114 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import pytest
+from .context import vb3
+
+pytestmark = pytest.mark.skipif(vb3.render.shared_memory is None,
+                                reason='multiprocessing.shared_memory is new in Python 3.8')
+
+
+class Panel:
+    width = 128
+    height = 64
+
+    def __init__(self):
+        self.images = []
+
+    def image(self, image):
+        self.images.append(image.tobytes())
+
+    def show(self):
+        pass
+
+
+def test_shared_frame_buffer():
+    writer = vb3.render.SharedFrameBuffer('1', (128, 64))
+    reader = vb3.render.SharedFrameBuffer('1', (128, 64), writer.name)
+    image = vb3.display.Image.new('1', (128, 64))
+    frame = vb3.display.Image.new('1', (128, 64))
+    try:
+        assert reader.count() == 0
+        for colour in (1, 0, 1):
+            writer.write(vb3.display.Image.new('1', (128, 64), colour))
+        assert reader.count() == 3
+        assert reader.read(image, frame) is False
+        assert image.getpixel((5, 5)) == 255
+        writer.write(vb3.display.Image.new('1', (128, 64), 0),
+                     vb3.display.Image.new('1', (128, 64), 1))
+        assert reader.read(image, frame) is True
+        assert (image.getpixel((5, 5)), frame.getpixel((5, 5))) == (0, 255)
+        # a frame that is being written can't be read
+        vb3.render.SharedFrameBuffer.BUFFER_HEADER.pack_into(
+            writer._memory.buf, writer._offset(writer._front), 1, False)
+        assert reader.read(image, frame) is None
+    finally:
+        reader.close()
+        writer.close()
+
+
+def wait_for_frame(display, timeout=20):
+    count = display._count
+    end = time.monotonic() + timeout
+    while display._count == count and time.monotonic() < end:
+        time.sleep(0.05)
+        display.update()
+    return display._count > count
+
+
+def test_render_process():
+    panel = Panel()
+    display = vb3.RenderProcessDisplay(panel=panel)
+    try:
+        display.update_interval = 0.05
+        display.update_main_screen('artist - album - title', 100, 10)
+        display.status(display.STATUS_PLAY)
+        assert wait_for_frame(display)
+        assert display.frame() is not None
+        # the worker renders the main screen and the progress bar
+        assert wait_for_frame(display)
+        assert display._image.getpixel((0, 63)) == 255
+        shown = len(panel.images)
+        display.update()
+        assert len(panel.images) == shown
+    finally:
+        display.status(display.STATUS_SHUTDOWN)
+    assert display._process is None
+    display.update()
+    assert len(panel.images) == shown + 1
+
+
+def test_render_process_failure(caplog):
+    panel = Panel()
+    display = vb3.RenderProcessDisplay(panel=panel)
+    try:
+        with pytest.raises(ValueError):
+            display.volume(150)
+        with pytest.raises(vb3.display.InvalidLabelError):
+            display.popup(('one line',))
+        display.update_main_screen('artist - album - title', 100, 10)
+        display.status(display.STATUS_PLAY)
+        assert wait_for_frame(display)
+        # the worker dies: the display logs it and renders in the service
+        display._process.kill()
+        display._process.join(5)
+        shown = len(panel.images)
+        display.update()
+        assert display._process is None
+        assert 'Render process stopped' in caplog.text
+        assert len(panel.images) == shown + 1
+    finally:
+        display.close()
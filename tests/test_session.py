@@ -0,0 +1,103 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import pytest
+from time import perf_counter
+from .context import vb3
+
+
+@pytest.fixture
+def gpio():
+    sim = vb3.SimulatedGPIO()
+    previous = vb3.gpio.backend()
+    vb3.gpio.use_backend(sim)
+    yield sim
+    vb3.gpio.use_backend(previous)
+
+
+def replay(clock, coroutine):
+    loop = vb3.session.VirtualTimeLoop(clock)
+    try:
+        with clock:
+            return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_record_session(tmp_path):
+    filename = str(tmp_path / 'session.jsonl')
+    recorder = vb3.session.SessionRecorder()
+    recorder.state({'status': 'play'})
+    recorder.open(filename, gpio={'pushbutton_1': 4})
+    recorder.battery(2000000000.5, 19.0, 0.01, 300.0)
+    recorder.edge(1000000000.0, 4, 0)
+    recorder.state({'status': 'play'})
+    recorder.close()
+    records = vb3.session.read_session(filename)
+    assert [kind for _, kind, _ in records] == ['edge', 'session', 'state', 'battery']
+    assert records[0] == (1000000000.0, 'edge', [4, 0])
+    assert records[1][2] == {'gpio': {'pushbutton_1': 4}}
+    assert records[3][2] == [19.0, 0.01, 300.0]
+
+
+def test_virtual_time():
+    clock = vb3.session.VirtualClock(1700000000)
+
+    async def sleep():
+        await asyncio.sleep(3600)
+        return vb3.display.time()
+
+    start = perf_counter()
+    assert replay(clock, sleep()) == 1700003600
+    assert perf_counter() - start < 1
+    assert vb3.display.time() != clock.now
+
+
+def test_replay_session(gpio):
+    pin = 17
+    start = 1000
+    records = [(start, 'session', {'gpio': {'pushbutton_2': pin}}),
+               (start + 1, 'state', dict(status='play', volume=40)),
+               (start + 2, 'battery', (19.5, 0.02, 250.0)),
+               (start + 10, 'edge', (pin, 0)),
+               (start + 10.1, 'edge', (pin, 1)),
+               (start + 600, 'state', dict(status='pause', volume=40))]
+    events = vb3.InputEvents()
+    volumio_client = vb3.VolumioClient()
+    commands = []
+    volumio_client._emit = lambda *args: commands.append(args)
+    states = []
+    volumio_client.set_pushState_handler(lambda: states.append(volumio_client.state.current['status']))
+    button = vb3.PushButton(pin, pull=gpio.PUD_UP, events=events)
+    button.set_gesture_callback(vb3.PushButton.CLICK, volumio_client.toggle_play)
+    ina = vb3.session.ReplayINA()
+    session = vb3.SessionReplay(records, volumio_client, gpio, ina)
+    assert session.info() == {'gpio': {'pushbutton_2': pin}}
+    assert session.duration() == 600
+
+    async def run():
+        dispatcher = asyncio.create_task(events.dispatcher())
+        await session.run()
+        dispatcher.cancel()
+        await asyncio.gather(dispatcher, return_exceptions=True)
+        return asyncio.get_running_loop().time()
+
+    assert replay(vb3.session.VirtualClock(start), run()) == start + 600
+    button.off()
+    assert states == ['play', 'pause']
+    assert commands == [('pause',)]
+    assert (ina.bus_voltage, ina.shunt_voltage, ina.current) == (19.5, 0.02, 250.0)
+    assert session.replayed == {'state': 2, 'edge': 2, 'battery': 1}
@@ -0,0 +1,150 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import pytest
+from .context import vb3
+
+
+pin = 4
+pin_a = 23
+pin_b = 24
+
+
+@pytest.fixture
+def gpio():
+    sim = vb3.SimulatedGPIO()
+    previous = vb3.gpio.backend()
+    vb3.gpio.use_backend(sim)
+    yield sim
+    vb3.gpio.use_backend(previous)
+
+
+def test_simulator_setup(gpio):
+    gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP)
+    assert gpio.input(pin) == gpio.HIGH
+    gpio.setup(pin + 1, gpio.IN, pull_up_down=gpio.PUD_DOWN)
+    assert gpio.input(pin + 1) == gpio.LOW
+    with pytest.raises(RuntimeError):
+        gpio.add_event_callback(pin, print)
+
+
+def test_simulator_edges(gpio):
+    channels = []
+    gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP)
+    gpio.add_event_detect(pin, gpio.FALLING, callback=channels.append)
+    gpio.inject(pin, 0)
+    gpio.inject(pin, 0)
+    gpio.inject(pin, 1)
+    assert channels == [pin]
+    gpio.inject(pin, 0, bounces=2, bounce_interval=0)
+    assert channels == [pin]*4
+    gpio.remove_event_detect(pin)
+    gpio.inject(pin, 1)
+    assert gpio.edges == 4
+
+
+def test_simulator_bouncetime(gpio):
+    channels = []
+    gpio.setup(pin, gpio.IN)
+    gpio.add_event_detect(pin, gpio.BOTH, callback=channels.append, bouncetime=100)
+    gpio.inject(pin, 1, bounces=3, bounce_interval=0)
+    assert channels == [pin]
+
+
+def test_simulator_pushbutton(gpio):
+    pushes = []
+    button = vb3.PushButton(pin, pull=gpio.PUD_UP)
+    button.set_callback(pushes.append, 1)
+    gpio.inject(pin, 0, bounces=3, bounce_interval=0)
+    gpio.inject(pin, 1)
+    assert pushes == [1]
+    button.off()
+
+
+def test_simulator_rotary_encoder(gpio):
+    turns = []
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, pull=gpio.PUD_UP)
+    encoder.set_callback(lambda: turns.append(encoder.direction))
+    trace = vb3.simulator.spin(pin_a, pin_b, 3)
+    trace += vb3.simulator.spin(pin_a, pin_b, 2, direction=-1, start=1)
+    gpio.replay(trace, speed=0, bounces=1)
+    assert turns == [vb3.RotaryEncoder.RIGHT]*3 + [vb3.RotaryEncoder.LEFT]*2
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_simulator_rotary_encoder_pull_down(gpio):
+    """ With pull-down resistors the knob rests at 00, and the first detent
+        after the setup counts too """
+    turns = []
+    events = vb3.InputEvents()
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, pull=gpio.PUD_DOWN, steps_per_detent=2,
+                                events=events)
+    encoder.set_callback(lambda: turns.append(encoder.direction))
+    task = asyncio.create_task(events.dispatcher())
+    await asyncio.sleep(0)
+    for channel in (pin_b, pin_a):
+        await asyncio.get_running_loop().run_in_executor(None, gpio.inject, channel, 1)
+    await asyncio.sleep(0.01)
+    task.cancel()
+    assert turns == [vb3.RotaryEncoder.RIGHT]
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_simulator_input_events(gpio):
+    turns = []
+    events = vb3.InputEvents()
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, pull=gpio.PUD_UP, events=events)
+    encoder.set_callback(lambda: turns.append(encoder.direction))
+    task = asyncio.create_task(events.dispatcher())
+    await asyncio.sleep(0)
+    thread = gpio.replay_in_thread(vb3.simulator.spin(pin_a, pin_b, 5, interval=0.0005), speed=1)
+    while thread.is_alive():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.01)
+    task.cancel()
+    assert turns == [vb3.RotaryEncoder.RIGHT]*5
+    assert events.events == 20
+
+
+def test_simulator_led(gpio):
+    led = vb3.RGBLED(13, 12, 6)
+    led.set(vb3.RGBLED.DIM_RED)
+    led.set(vb3.RGBLED.DIM_RED)
+    assert gpio.pwm[13].duty_cycle == 10
+    assert len(gpio.pwm[13].history) == 1
+    led.off()
+    assert gpio.pwm[13].duty_cycle is None
+
+
+def test_simulator_led_set_pins(gpio, mocker):
+    led = vb3.RGBLED(13, 12, 6)
+    led.set(vb3.RGBLED.DIM_RED)
+    cleanup = mocker.spy(gpio, 'cleanup')
+    led.set_pins(13, 12, 6)
+    assert len(gpio.pwm[13].history) == 1
+    cleanup.assert_not_called()
+    led.set_pins(19, 12, 6)
+    assert [call[0] for call in cleanup.call_args_list] == [(13,), (12,), (6,)]
+    assert gpio.pwm[13].duty_cycle is None
+    assert gpio.pwm[19].duty_cycle == 10
+    assert gpio.pwm[12].duty_cycle == 0
+
+
+def test_simulator_trace_file(tmp_path):
+    trace = vb3.simulator.spin(pin_a, pin_b, 1)
+    filename = str(tmp_path / 'trace.csv')
+    vb3.simulator.write_trace(filename, trace)
+    assert vb3.simulator.read_trace(filename) == trace
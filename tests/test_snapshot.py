@@ -0,0 +1,88 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import threading
+import pytest
+from PIL import Image
+from .context import vb3
+
+
+def test_snapshot(tmp_path):
+    filename = str(tmp_path / 'snapshot.json')
+    snapshot = vb3.Snapshot(filename)
+    frame = Image.new('1', (128, 64))
+    frame.putpixel((3, 4), 1)
+    assert snapshot.save({'title': 'song'}, lambda: frame, (0, 10, 0)) is True
+    saved = vb3.Snapshot(filename).load()
+    assert saved['state'] == {'title': 'song'}
+    assert saved['led'] == (0, 10, 0)
+    mode, size, data = saved['frame']
+    assert Image.frombytes(mode, size, data).getpixel((3, 4)) == 255
+    assert os.listdir(str(tmp_path)) == ['snapshot.json']
+
+
+def test_snapshot_rate_limit(tmp_path):
+    filename = str(tmp_path / 'snapshot.json')
+    snapshot = vb3.Snapshot(filename)
+    snapshot.save({'title': 'first'})
+    assert snapshot.save({'title': 'second'}) is False
+    assert snapshot.load()['state'] == {'title': 'first'}
+    assert snapshot.flush() is True
+    assert snapshot.flush() is False
+    assert snapshot.load()['state'] == {'title': 'second'}
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_snapshot_deferred(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'snapshot.json')
+    snapshot = vb3.Snapshot(filename, min_interval=0.02)
+    monkeypatch.setattr(vb3.Snapshot, 'SETTLE_TIME', 0.01)
+    snapshot.save({'title': 'first'})
+    snapshot.save({'title': 'second'})
+    assert not os.path.exists(filename)
+    await asyncio.sleep(0.05)
+    assert snapshot.load()['state'] == {'title': 'second'}
+
+
+def test_snapshot_missing_or_invalid(tmp_path):
+    filename = tmp_path / 'snapshot.json'
+    assert vb3.Snapshot(str(filename)).load() is None
+    filename.write_text('{"version": 1, "timestamp": 0}')
+    assert vb3.Snapshot(str(filename)).load() is None
+    filename.write_text('not json')
+    assert vb3.Snapshot(str(filename)).load() is None
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_snapshot_written_in_executor(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'snapshot.json')
+    snapshot = vb3.Snapshot(filename, min_interval=0)
+    monkeypatch.setattr(vb3.Snapshot, 'SETTLE_TIME', 0.01)
+    threads = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: threads.append(threading.get_ident()) or fsync(fd))
+    snapshot.save({'title': 'first'})
+    await asyncio.sleep(0.05)
+    assert snapshot.load()['state'] == {'title': 'first'}
+    assert threads and threading.get_ident() not in threads
+# an older snapshot doesn't overwrite a newer one
+    snapshot.save({'title': 'older'})
+    older = snapshot._data()
+    snapshot.save({'title': 'newer'})
+    assert snapshot.flush() is True
+    assert snapshot._write(older) is True
+    assert snapshot.load()['state'] == {'title': 'newer'}
@@ -0,0 +1,108 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import unittest.mock as mock
+import pytest
+from .context import vb3
+from .test_simulator import gpio, pin_a, pin_b  # noqa: F401
+from .volumio_server import VolumioServer
+
+
+def test_tracer_command(tmp_path):
+    tracer = vb3.tracing.Tracer(vb3.util.Metrics())
+    tracer.set_log(str(tmp_path / 'trace.log'))
+    with tracer.input('encoder 23') as trace:
+        tracer.emit('volume')
+        tracer.emit('volume')
+    tracer.frame()
+    assert 'frame' not in trace.timestamps.keys()
+    tracer.confirm()
+    tracer.frame()
+    assert list(trace.timestamps.keys()) == ['input', 'emit', 'confirm', 'frame']
+    assert tracer.total_time.count == 1
+    assert all(tracer.stage_time[stage].count == 1 for stage in ('emit', 'confirm', 'frame'))
+    tracer.set_log(None)
+    record = json.loads((tmp_path / 'trace.log').read_text())
+    assert record['command'] == 'volume'
+    assert record['source'] == 'encoder 23'
+
+
+def test_tracer_display_only():
+    tracer = vb3.tracing.Tracer(vb3.util.Metrics())
+    with tracer.input('button 4'):
+        pass
+    tracer.frame()
+    assert tracer.total_time.count == 1
+    assert tracer.stage_time['frame'].count == 1
+    assert tracer.stage_time['emit'].count == 0
+
+
+def test_tracer_expired():
+    tracer = vb3.tracing.Tracer(vb3.util.Metrics())
+    with tracer.input('button 17', timestamp=1):
+        tracer.emit('play')
+    tracer.confirm()
+    tracer.frame()
+    assert tracer.expired.value == 1
+    assert tracer.total_time.count == 0
+
+
+def test_tracer_pending_overflow():
+    tracer = vb3.tracing.Tracer(vb3.util.Metrics())
+    for i in range(vb3.tracing.Tracer.MAX_PENDING + 3):
+        with tracer.input('encoder 23'):
+            tracer.emit('volume')
+    assert tracer.expired.value == 3
+    tracer.confirm()
+    tracer.frame()
+    assert tracer.total_time.count == vb3.tracing.Tracer.MAX_PENDING
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+@mock.patch('adafruit_bus_device.i2c_device.I2CDevice')
+@mock.patch('busio.I2C')
+async def test_input_to_photon(mock_i2c, mock_device, gpio, tmp_path):  # noqa: F811
+    """ Turn the simulated volume knob and follow it to the display """
+    server = VolumioServer(response_delay=0.01)
+    port = await server.start()
+    display = vb3.Display()
+    volumio_client = vb3.VolumioClient(display, host='127.0.0.1', port=port)
+    volumio_client.set_pushState_handler(
+        lambda: display.volume(volumio_client.state.current['volume']))
+    events = vb3.InputEvents()
+    encoder = vb3.RotaryEncoder(pin_a, pin_b, pull=gpio.PUD_UP, events=events)
+    encoder.set_callback(volumio_client.volume_up)
+    total = vb3.tracer.total_time.count
+    vb3.tracer.set_log(str(tmp_path / 'trace.log'))
+    tasks = [asyncio.create_task(events.dispatcher()),
+             asyncio.create_task(display.updater(0.01))]
+    await volumio_client.connect()
+    await asyncio.sleep(0.1)
+    gpio.replay(vb3.simulator.spin(pin_a, pin_b, 1), speed=0)
+    await asyncio.sleep(0.2)
+    vb3.tracer.set_log(None)
+    for task in tasks:
+        task.cancel()
+    encoder.off()
+    await volumio_client.disconnect()
+    await server.stop()
+    assert server.commands == [('volume', '+')]
+    assert vb3.tracer.total_time.count == total + 1
+    trace = json.loads((tmp_path / 'trace.log').read_text())
+    assert trace['command'] == 'volume'
+    assert trace['input'] <= trace['emit'] <= trace['confirm'] <= trace['frame']
+    assert trace['confirm'] - trace['emit'] >= 0.01
@@ -0,0 +1,206 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import io
+import logging
+import pytest
+import sys
+from .context import vb3
+
+
+def test_metrics_counter_and_gauge():
+    registry = vb3.util.Metrics()
+    counter = registry.counter('test_total', 'A counter')
+    counter.inc()
+    counter.inc(2)
+    assert registry.counter('test_total') is counter
+    registry.gauge('test_depth', 'A gauge', lambda: 7)
+    assert registry.render().splitlines() == [
+        '# HELP test_depth A gauge', '# TYPE test_depth gauge', 'test_depth 7',
+        '# HELP test_total A counter', '# TYPE test_total counter', 'test_total 3']
+    with pytest.raises(ValueError):
+        registry.histogram('test_total')
+
+
+def test_metrics_histogram():
+    registry = vb3.util.Metrics()
+    histogram = registry.histogram('test_seconds', 'A histogram', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+    lines = registry.render().splitlines()
+    assert lines[2:] == ['test_seconds_bucket{le="0.1"} 2',
+                         'test_seconds_bucket{le="1"} 3',
+                         'test_seconds_bucket{le="+Inf"} 4',
+                         'test_seconds_sum 2.65',
+                         'test_seconds_count 4']
+
+
+def test_metrics_failing_gauge():
+    registry = vb3.util.Metrics()
+    registry.gauge('test_broken', 'A broken gauge', lambda: 1/0)
+    assert registry.render().splitlines() == ['# HELP test_broken A broken gauge',
+                                              '# TYPE test_broken gauge']
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_serve_metrics(tmp_path):
+    registry = vb3.util.Metrics()
+    registry.counter('test_total', 'A counter').inc()
+    address = str(tmp_path / 'metrics.sock')
+    task = asyncio.create_task(vb3.serve_metrics(address, registry))
+    await asyncio.sleep(0.05)
+    for path, status in (('/metrics', b'200'), ('/other', b'404')):
+        reader, writer = await asyncio.open_unix_connection(address)
+        writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode())
+        response = await reader.read()
+        writer.close()
+        assert response.split()[1] == status
+    assert response.endswith(b'Not found\n')
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    vb3.util.stop_logging()
+    root.handlers = handlers
+    root.setLevel(level)
+    vb3.util.log_ring.records.clear()
+
+
+def test_setup_logging(root_logger, tmp_path):
+    stream = io.StringIO()
+    vb3.setup_logging('warning', stream=stream, ring_level='info')
+    assert logging.getLogger().level == logging.INFO
+    logging.info('kept in the ring buffer %d', 1)
+    logging.warning('logged %s', 'lazily')
+    logging.debug('dropped')
+    vb3.util.stop_logging()
+    assert 'logged lazily' in stream.getvalue()
+    assert 'kept in the ring buffer' not in stream.getvalue()
+    filename = vb3.dump_log(str(tmp_path / 'log.txt'))
+    lines = open(filename).read().splitlines()
+    assert [line.split('] ')[-1] for line in lines][-2:] == ['kept in the ring buffer 1',
+                                                             'logged lazily']
+    with pytest.raises(ValueError):
+        vb3.setup_logging('verbose')
+    with pytest.raises(ValueError):
+        vb3.setup_logging('warning', ring_level='verbose')
+
+
+def test_setup_logging_ring_level(root_logger):
+    vb3.setup_logging('warning', stream=io.StringIO())
+    assert logging.getLogger().level == logging.WARNING
+    logging.info('not formatted')
+    logging.warning('kept')
+    vb3.util.stop_logging()
+    assert [record.getMessage() for record in vb3.util.log_ring.records] == ['kept']
+
+
+def test_log_ring_buffer_capacity():
+    ring = vb3.util.LogRingBuffer(capacity=2)
+    for i in range(3):
+        ring.handle(logging.makeLogRecord({'msg': 'record %d', 'args': (i,)}))
+    output = io.StringIO()
+    ring.dump(output)
+    assert output.getvalue() == 'record 1\nrecord 2\n'
+
+
+def test_setup_event_loop_fallback(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'uvloop', None)
+    assert vb3.setup_event_loop('uvloop') == 'asyncio'
+    assert type(asyncio.get_event_loop_policy()) is asyncio.DefaultEventLoopPolicy
+    assert vb3.setup_event_loop('asyncio') == 'asyncio'
+
+
+def test_diagnostics_directory(monkeypatch, tmp_path):
+    monkeypatch.delenv('LOGS_DIRECTORY', raising=False)
+    monkeypatch.setenv('RUNTIME_DIRECTORY', str(tmp_path / 'run'))
+    assert vb3.util.diagnostics_directory() == str(tmp_path / 'run')
+    monkeypatch.setenv('LOGS_DIRECTORY', str(tmp_path / 'log'))
+    assert vb3.util.diagnostics_directory() == str(tmp_path / 'log')
+
+
+def test_exception_cancels_main_task(monkeypatch, tmp_path):
+    monkeypatch.setenv('LOGS_DIRECTORY', str(tmp_path))
+
+    def fail():
+        raise RuntimeError('callback failed')
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        vb3.setup_exception_handling(loop)
+        sleeper = asyncio.create_task(asyncio.sleep(10))
+        loop.call_soon(fail)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            await vb3.shutdown(vb3.VolumioClient(), None)
+        return sleeper
+
+    sleeper = asyncio.run(main())
+    assert sleeper.cancelled()
+    assert len(list(tmp_path.glob('vbuddy-log-*.txt'))) == 1
+
+
+class SlowClient:
+
+    def is_connected(self):
+        return True
+
+    async def disconnect(self):
+        await asyncio.sleep(10)
+
+
+class ShutdownDisplay:
+    STATUS_SHUTDOWN = 6
+
+    def __init__(self):
+        self.calls = []
+
+    def status(self, status):
+        self.calls.append(('status', status))
+
+    def update(self):
+        self.calls.append('update')
+
+    def clear(self):
+        self.calls.append('clear')
+
+
+@pytest.mark.parametrize('aiolib', ['asyncio'])
+async def test_shutdown_deadline(caplog):
+    async def stubborn():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            await asyncio.sleep(10)
+
+    task = asyncio.create_task(stubborn())
+    await asyncio.sleep(0)
+    display = ShutdownDisplay()
+    start = asyncio.get_running_loop().time()
+    with caplog.at_level(logging.INFO):
+        await vb3.shutdown(SlowClient(), display, timeout=0.2)
+    assert asyncio.get_running_loop().time() - start < 0.5
+    assert display.calls == [('status', 6), 'update', 'clear']
+    assert 'Websocket disconnect timed out.' in caplog.messages
+    assert any(message.startswith('1 tasks did not finish in time: ') for message in caplog.messages)
+    assert 'frame' in caplog.messages[-1] and 'clear' in caplog.messages[-1]
+    task.cancel()
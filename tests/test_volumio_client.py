@@ -90,3 +90,15 @@ def test_volumio_state_next_update():
     state.update({'status': 'next_test'})
     assert state.current['status'] == 'next_test'
     assert state.previous['status'] == 'test'
+
+
+def test_volumio_state_restore():
+    restored = vb3.VolumioState()
+    restored.restore({'status': 'play', 'title': 'saved'})
+    assert restored.stale is True
+    assert restored.current['title'] == 'saved'
+    assert len(restored.delta()) == 0
+    restored.update({'status': 'play', 'title': 'saved'})
+    assert restored.stale is False
+    assert restored.changed('status') is True
+    assert restored.delta() == {'status': 'play', 'title': 'saved'}
@@ -0,0 +1,92 @@
+# Copyright (c) 2022 Michiel Fokke
+# Author: Michiel Fokke <michiel@fokke.org>
+#
+# This file is part of Volumio-buddy.
+#
+# Volumio-buddy is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software Foundation,
+# either version 3 of the License, or (at your option) any later version.
+# Volumio-buddy is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Volumio-buddy. If not, see <https://www.gnu.org/licenses/>.
+
+""" Stand-in for the Volumio websocket API. It keeps a player state, handles
+    the commands that VolumioClient sends and answers every command with a
+    pushState, like Volumio does """
+
+import asyncio
+import socketio
+from aiohttp import web
+
+
+class _Manager(socketio.AsyncManager):
+    """ python-socketio 4 passes bare coroutines to asyncio.wait(), which
+        Python 3.11 refuses """
+
+    async def emit(self, event, data, namespace, room=None, skip_sid=None,
+                   callback=None, **kwargs):
+        if namespace not in self.rooms or room not in self.rooms[namespace]:
+            return
+        await asyncio.gather(*(self.server._emit_internal(sid, event, data, namespace)
+                               for sid in self.get_participants(namespace, room)
+                               if sid != skip_sid))
+
+
+class VolumioServer:
+    """ Socket.io server on localhost with a random port """
+
+    STATE = {'status': 'stop', 'volume': 50, 'seek': 0, 'duration': 240,
+             'artist': 'Artist', 'album': 'Album', 'title': 'Title 1',
+             'trackType': 'flac', 'samplerate': '44.1 kHz', 'bitdepth': '16 bit'}
+
+    def __init__(self, response_delay=0):
+        self.response_delay = response_delay
+        self.state = dict(VolumioServer.STATE)
+        self.commands = []
+        self.port = None
+        self._runner = None
+        self._sio = socketio.AsyncServer(async_mode='aiohttp', client_manager=_Manager())
+        self._app = web.Application()
+        self._sio.attach(self._app)
+        self._sio.on('getState', self._get_state)
+        for command in ('play', 'pause', 'stop', 'prev', 'next', 'volume'):
+            self._sio.on(command, self._command(command))
+
+    async def start(self):
+        self._runner = web.AppRunner(self._app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return self.port
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def push_state(self, sid=None):
+        if self.response_delay:
+            await asyncio.sleep(self.response_delay)
+        await self._sio.emit('pushState', dict(self.state), room=sid)
+
+    async def _get_state(self, sid, *data):
+        await self.push_state(sid)
+
+    def _command(self, command):
+        async def handler(sid, *data):
+            self.commands.append((command,) + data)
+            if command in ('play', 'pause', 'stop'):
+                self.state['status'] = command
+            elif command in ('prev', 'next'):
+                number = int(self.state['title'].split()[-1]) + (1 if command == 'next' else -1)
+                self.state['title'] = 'Title {}'.format(max(1, number))
+                self.state['seek'] = 0
+            elif command == 'volume':
+                step = {'+': 1, '-': -1}.get(data[0] if data else None, 0)
+                self.state['volume'] = max(0, min(100, self.state['volume'] + step))
+            await self.push_state()
+        return handler